@@ -24,6 +24,7 @@ from __future__ import annotations
 import math
 import os
 import random
+import time
 import urllib.request
 from collections import Counter
 
@@ -35,10 +36,19 @@ random.seed(42)
 EMBEDDING_DIM = 32  # Target embedding dimension (sparse n-grams → dense vectors)
 LEARNING_RATE = 0.05  # SGD learning rate (Adam adds overhead without much benefit here)
 TEMPERATURE = 0.1  # InfoNCE temperature: lower = sharper similarity distribution
-NUM_EPOCHS = 30  # Enough to see clear separation between positive/random pairs
-BATCH_SIZE = 64
+# Epochs are counted over the full 32K names, so 5 epochs is ~160K training pairs:
+# the same SGD budget as 30 epochs over the former 5K-name subset (150K pairs).
+# The runtime saving is from this fixed pair budget, not from the simulated workers.
+NUM_EPOCHS = 5
+BATCH_SIZE = 64  # Global batch: every anchor sees BATCH_SIZE - 1 in-batch negatives
+NUM_WORKERS = 4  # Simulated data-parallel workers (run sequentially), BATCH_SIZE / 4 anchors each
 MAX_VOCAB = 500  # Cap n-gram vocabulary to most frequent entries for speed
-TRAIN_SIZE = 5000  # Subset of names for training (full set is 32K — too slow for demo)
+
+# Approximate nearest-neighbor index over the embedding cache (random-hyperplane LSH,
+# the same scheme as 03-systems/microvectorsearch.py). Each extra table is another
+# independent chance to catch a true neighbor; each extra bit halves bucket size.
+ANN_TABLES = 8
+ANN_HASH_BITS = 8
 
 DATA_URL = "https://raw.githubusercontent.com/karpathy/makemore/master/names.txt"
 DATA_FILE = "names.txt"
@@ -109,27 +119,98 @@ def encode_ngrams_sparse(text: str, vocab: dict[str, int]) -> dict[int, float]:
 
 # === AUGMENTATION ===
 
-def augment(name: str) -> str:
-    """Create positive pair by random character deletion or swap.
+def augmentation_variants(name: str) -> tuple[list[str], list[str]]:
+    """Enumerate every positive pair augmentation can produce for `name`.
 
     Why augmentation: forces the encoder to learn invariances to small changes.
     If "anna" and "ana" map to similar embeddings, the model has learned that
     character deletion preserves identity — this is the contrastive learning
     principle that similar inputs should have similar representations.
+
+    The augmentation is a random single-character deletion or adjacent swap, so a
+    name of length L has only L deletions and L-1 swaps. Enumerating them up front
+    (~12 per name) lets training featurize every possible positive exactly once
+    instead of re-extracting n-grams for a fresh augmented string every epoch.
+
+    Returns (deletions, swaps). Names of length <= 2 are too short to augment
+    safely and yield ([name], []) — the name is its own positive.
     """
     if len(name) <= 2:
-        return name  # too short to augment safely
+        return [name], []
 
-    if random.random() < 0.5:
-        # Delete one random character
-        idx = random.randint(0, len(name) - 1)
-        return name[:idx] + name[idx + 1:]
-    else:
-        # Swap two adjacent characters
-        idx = random.randint(0, len(name) - 2)
+    deletions = [name[:idx] + name[idx + 1:] for idx in range(len(name))]
+    swaps = []
+    for idx in range(len(name) - 1):
         chars = list(name)
         chars[idx], chars[idx + 1] = chars[idx + 1], chars[idx]
-        return "".join(chars)
+        swaps.append("".join(chars))
+    return deletions, swaps
+
+
+def sample_augmentation(dataset: dict, name_idx: int) -> int:
+    """Pick a random positive for training name `name_idx`; return its CSR row.
+
+    Same distribution as augmenting on the fly: a fair coin chooses deletion or
+    swap, then a uniform position within that family."""
+    start = dataset["variant_start"][name_idx]
+    num_deletions = dataset["num_deletions"][name_idx]
+    num_swaps = dataset["num_swaps"][name_idx]
+    if num_swaps == 0 or random.random() < 0.5:
+        return start + random.randint(0, num_deletions - 1)
+    return start + num_deletions + random.randint(0, num_swaps - 1)
+
+
+# === CSR FEATURIZATION ===
+# Compressed Sparse Row (CSR) stores a sparse matrix as three flat arrays:
+#
+#   indptr[r] .. indptr[r+1]   the slice of `indices`/`data` belonging to row r
+#   indices[k]                 column (n-gram id) of the k-th non-zero
+#   data[k]                    its value (n-gram count)
+#
+# Row r's features are therefore zip(indices[s:e], data[s:e]) with s, e = indptr[r],
+# indptr[r+1] — two slices, no dict, no string. The whole training set plus every
+# possible augmentation is featurized into CSR once before training, so the per-batch
+# encode and gradient loops below touch only integers and floats.
+# Signpost: this is the same layout scipy.sparse.csr_matrix and every sparse BLAS
+# use; they just keep the three arrays in contiguous C buffers.
+
+def build_csr(sparse_rows: list[dict[int, float]]) -> dict[str, list]:
+    """Pack a list of sparse {column: value} rows into CSR arrays."""
+    indptr = [0]
+    indices: list[int] = []
+    data: list[float] = []
+    for row in sparse_rows:
+        for j, value in row.items():
+            indices.append(j)
+            data.append(value)
+        indptr.append(len(indices))
+    return {"indptr": indptr, "indices": indices, "data": data}
+
+
+def featurize_training_set(names: list[str], vocab: dict[str, int]) -> dict:
+    """Featurize anchors and all their augmentation variants into two CSR matrices.
+
+    Row i of "anchors" is names[i]. The variants of names[i] occupy rows
+    variant_start[i] .. variant_start[i] + num_deletions[i] + num_swaps[i] of
+    "variants", deletions first."""
+    anchor_rows = [encode_ngrams_sparse(name, vocab) for name in names]
+    variant_rows: list[dict[int, float]] = []
+    variant_start: list[int] = []
+    num_deletions: list[int] = []
+    num_swaps: list[int] = []
+    for name in names:
+        deletions, swaps = augmentation_variants(name)
+        variant_start.append(len(variant_rows))
+        num_deletions.append(len(deletions))
+        num_swaps.append(len(swaps))
+        variant_rows.extend(encode_ngrams_sparse(v, vocab) for v in deletions + swaps)
+    return {
+        "anchors": build_csr(anchor_rows),
+        "variants": build_csr(variant_rows),
+        "variant_start": variant_start,
+        "num_deletions": num_deletions,
+        "num_swaps": num_swaps,
+    }
 
 
 # === ENCODER ===
@@ -199,6 +280,48 @@ def grad_through_norm(
     return [(g - ei * g_dot_e) / norm for g, ei in zip(grad_normalized, e)]
 
 
+def encode_csr_batch(
+    csr: dict[str, list], rows: list[int], W_columns: list[list[float]]
+) -> list[list[float]]:
+    """Raw (unnormalized) embeddings z = W @ x for a batch of CSR rows.
+
+    Takes W column-major: W_columns[j] is column j of W, the d-dim vector n-gram j
+    contributes. Then z = Σ_k data[k] * W_columns[indices[k]] — a sum of ~10-15
+    whole vectors per row (the fastText view: a word is the sum of its n-grams)."""
+    indptr, indices, data = csr["indptr"], csr["indices"], csr["data"]
+    raw_batch = []
+    for r in rows:
+        embedding = [0.0] * EMBEDDING_DIM
+        for k in range(indptr[r], indptr[r + 1]):
+            count = data[k]
+            embedding = [z + count * w for z, w in zip(embedding, W_columns[indices[k]])]
+        raw_batch.append(embedding)
+    return raw_batch
+
+
+def accumulate_csr_grad(
+    csr: dict[str, list],
+    rows: list[int],
+    grads_raw: list[list[float]],
+    grad_columns: dict[int, list[float]],
+) -> None:
+    """Add d(L)/d(W) for a CSR batch into grad_columns (n-gram id → gradient column).
+
+    Since z = W @ x, d(L)/d(W[:, j]) = d(L)/d(z) * x_j — an outer product that is
+    non-zero only in the columns j where x has an n-gram. Storing just those columns
+    means the SGD step touches ~hundreds of columns instead of all d * V weights."""
+    indptr, indices, data = csr["indptr"], csr["indices"], csr["data"]
+    for r, g in zip(rows, grads_raw):
+        for k in range(indptr[r], indptr[r + 1]):
+            j = indices[k]
+            count = data[k]
+            column = grad_columns.get(j)
+            if column is None:
+                grad_columns[j] = [gi * count for gi in g]
+            else:
+                grad_columns[j] = [c + gi * count for c, gi in zip(column, g)]
+
+
 # === SIMILARITY ===
 
 def cosine_similarity(a: list[float], b: list[float]) -> float:
@@ -207,7 +330,7 @@ def cosine_similarity(a: list[float], b: list[float]) -> float:
     Since vectors are L2-normalized, cosine similarity = dot product.
     Range: [-1, 1] where 1 = identical direction, -1 = opposite, 0 = orthogonal.
     """
-    return sum(a[i] * b[i] for i in range(len(a)))
+    return sum([x * y for x, y in zip(a, b)])
 
 
 # === INFONCE LOSS ===
@@ -216,6 +339,7 @@ def infonce_loss_and_grads(
     anchor_embs: list[list[float]],
     positive_embs: list[list[float]],
     temperature: float,
+    rows: range | None = None,
 ) -> tuple[float, list[list[float]], list[list[float]]]:
     """Compute InfoNCE (NT-Xent) loss and embedding-space gradients.
 
@@ -231,28 +355,33 @@ def infonce_loss_and_grads(
     Why temperature: controls sharpness of the similarity distribution. Low tau
     (e.g. 0.1) makes the loss focus on hard negatives. tau=0.1 is standard in SimCLR.
 
-    Returns: (avg_loss, anchor_grads, positive_grads)
+    `rows` selects which anchors' loss terms to compute (default: all of them).
+    A data-parallel worker passes just its shard; negatives still range over the
+    full gathered batch in anchor_embs. Negatives are treated as constants, so the
+    gradient for row i touches only anchor_i and positive_i — which is what lets
+    each worker backpropagate its shard independently.
+
+    Returns: (summed loss over `rows`, anchor_grads, positive_grads) with one
+    gradient vector per entry in `rows`.
     """
-    bs = len(anchor_embs)
+    if rows is None:
+        rows = range(len(anchor_embs))
     total_loss = 0.0
+    anchor_grads = []
+    positive_grads = []
 
-    anchor_grads = [[0.0] * EMBEDDING_DIM for _ in range(bs)]
-    positive_grads = [[0.0] * EMBEDDING_DIM for _ in range(bs)]
+    for i in rows:
+        anchor = anchor_embs[i]
+        positive = positive_embs[i]
+        sim_pos = cosine_similarity(anchor, positive) / temperature
 
-    for i in range(bs):
-        # Similarity to positive pair
-        sim_pos = cosine_similarity(anchor_embs[i], positive_embs[i]) / temperature
-
-        # Similarities to all negatives (other anchors in batch)
-        sim_negs = []
-        for j in range(bs):
-            if j != i:
-                sim_negs.append(
-                    cosine_similarity(anchor_embs[i], anchor_embs[j]) / temperature
-                )
+        # Similarities to every anchor in the batch; the anchor itself is masked
+        # with -inf so it contributes exp(-inf) = 0 to the denominator.
+        sim_negs = [cosine_similarity(anchor, other) / temperature for other in anchor_embs]
+        sim_negs[i] = -math.inf
 
         # Log-sum-exp trick for numerical stability (subtract max before exp)
-        max_sim = max([sim_pos] + sim_negs)
+        max_sim = max(sim_pos, max(sim_negs))
         exp_pos = math.exp(sim_pos - max_sim)
         exp_negs = [math.exp(s - max_sim) for s in sim_negs]
         denom = exp_pos + sum(exp_negs)
@@ -261,29 +390,52 @@ def infonce_loss_and_grads(
         total_loss += -math.log(max(exp_pos / denom, 1e-10))
 
         # Gradient of loss w.r.t. anchor embedding:
-        # d(loss)/d(anchor_i) = (1/tau) * (sum_j p_j * anchor_j - positive_i)
-        # where p_j = exp(sim_neg_j) / denom is the softmax probability
-
-        # Positive contribution: pushes anchor toward positive
-        p_pos = exp_pos / denom
-        for d in range(EMBEDDING_DIM):
-            anchor_grads[i][d] += (p_pos - 1.0) / temperature * positive_embs[i][d]
-            positive_grads[i][d] += (p_pos - 1.0) / temperature * anchor_embs[i][d]
-
-        # Negative contributions: pushes anchor away from negatives
-        neg_idx = 0
-        for j in range(bs):
-            if j == i:
-                continue
-            p_neg = exp_negs[neg_idx] / denom
-            for d in range(EMBEDDING_DIM):
-                anchor_grads[i][d] += p_neg / temperature * anchor_embs[j][d]
-            neg_idx += 1
-
-    return total_loss / bs, anchor_grads, positive_grads
-
+        # d(loss)/d(anchor_i) = (1/tau) * ((p_pos - 1) * positive_i + sum_j p_j * anchor_j)
+        # where p_j = exp(sim_neg_j) / denom is the softmax probability.
+        # Positive term pulls the anchor toward its positive; each negative term
+        # pushes it away in proportion to how confusable that negative is.
+        pos_weight = (exp_pos / denom - 1.0) / temperature
+        grad_anchor = [pos_weight * x for x in positive]
+        for other, exp_neg in zip(anchor_embs, exp_negs):
+            if exp_neg > 0.0:
+                neg_weight = exp_neg / denom / temperature
+                grad_anchor = [g + neg_weight * x for g, x in zip(grad_anchor, other)]
+        anchor_grads.append(grad_anchor)
+        positive_grads.append([pos_weight * x for x in anchor])
+
+    return total_loss, anchor_grads, positive_grads
+
+
+# === DATA-PARALLEL TRAINING (SIMULATED WORKERS) ===
+# The batch is split across NUM_WORKERS workers, each holding a full replica of W.
+# One step runs four phases:
+#
+#   1. local       each worker encodes its shard of anchors and positives
+#   2. all-gather  workers exchange anchor embeddings, so every worker sees all B
+#                  in-batch negatives — sharding must not shrink the negative set,
+#                  or the contrastive signal weakens with every worker added
+#   3. local       each worker computes the loss rows for its own anchors against
+#                  the gathered batch and backpropagates into its own W gradient
+#   4. all-reduce  gradients are summed across workers; every replica then applies
+#                  the identical SGD update, so the replicas never drift apart
+#
+# The O(B^2 * d) similarity work in phase 3 is split B/NUM_WORKERS rows per worker,
+# while communication is only B*d floats gathered plus the touched gradient columns.
+#
+# Signpost: workers here run one after another in a single process (like the
+# simulated devices in 03-systems/microparallel.py), and we report the critical
+# path — the slowest worker per phase — as the time a real parallel run would take.
+# Production contrastive training (CLIP, SimCLR) does this across GPUs with an
+# NCCL all-gather of embeddings and an all-reduce of gradients.
+
+def split_shards(rows: list[int], num_workers: int) -> list[range]:
+    """Split batch positions 0..len(rows)-1 into num_workers contiguous ranges."""
+    shard_size = math.ceil(len(rows) / num_workers)
+    return [
+        range(start, min(start + shard_size, len(rows)))
+        for start in range(0, len(rows), shard_size)
+    ]
 
-# === TRAINING ===
 
 def train(
     names: list[str],
@@ -292,98 +444,143 @@ def train(
     num_epochs: int,
     batch_size: int,
     learning_rate: float,
+    num_workers: int = 1,
 ) -> None:
-    """Train embedding model with SGD.
+    """Train embedding model with data-parallel SGD over num_workers workers.
 
     Signpost: production systems use Adam with learning rate warmup. SGD is
     sufficient here because the model is a single linear layer — there's no
     depth to cause gradient scale issues across layers.
     """
-    vocab_size = len(vocab)
+    dataset = featurize_training_set(names, vocab)
+    print(f"  featurized {len(names):,} anchors + "
+          f"{len(dataset['variants']['indptr']) - 1:,} augmentation variants into CSR")
+
+    # Train on a column-major copy of W: both the CSR encode and the sparse SGD step
+    # work one n-gram column at a time. Results are written back into W at the end.
+    W_columns = [list(column) for column in zip(*W)]
+
+    sequential_time = 0.0
+    critical_path_time = 0.0
+    floats_communicated = 0
 
     for epoch in range(num_epochs):
-        epoch_names = names[:]
-        random.shuffle(epoch_names)
+        order = list(range(len(names)))
+        random.shuffle(order)
 
         epoch_loss = 0.0
-        num_batches = 0
+        num_examples = 0
 
-        for batch_start in range(0, len(epoch_names), batch_size):
-            batch = epoch_names[batch_start:batch_start + batch_size]
-            if len(batch) < 2:
+        for batch_start in range(0, len(order), batch_size):
+            anchor_rows = order[batch_start:batch_start + batch_size]
+            if len(anchor_rows) < 2:
                 continue
+            positive_rows = [sample_augmentation(dataset, idx) for idx in anchor_rows]
+            shards = split_shards(anchor_rows, num_workers)
+
+            # Phase 1 (local): each worker encodes its shard. Keep both raw
+            # (pre-normalization) and normalized embeddings: raw embeddings are
+            # needed for the normalization Jacobian in backprop.
+            anchor_raw: list[list[float]] = []
+            positive_raw: list[list[float]] = []
+            encode_times = []
+            for shard in shards:
+                start = time.time()
+                shard_anchors = [anchor_rows[b] for b in shard]
+                shard_positives = [positive_rows[b] for b in shard]
+                anchor_raw += encode_csr_batch(dataset["anchors"], shard_anchors, W_columns)
+                positive_raw += encode_csr_batch(
+                    dataset["variants"], shard_positives, W_columns
+                )
+                encode_times.append(time.time() - start)
+
+            # Phase 2 (all-gather): concatenation stands in for the exchange.
+            anchor_embs = [l2_normalize(z) for z in anchor_raw]
+            positive_embs = [l2_normalize(z) for z in positive_raw]
+            floats_communicated += len(anchor_embs) * EMBEDDING_DIM
 
-            # Encode anchors and positives (sparse n-grams → dense embeddings)
-            # Store both raw (pre-normalization) and normalized embeddings:
-            # raw embeddings are needed for the normalization Jacobian in backprop
-            anchor_sparse = []
-            positive_sparse = []
-            anchor_raw = []
-            positive_raw = []
-            anchor_embs = []
-            positive_embs = []
-
-            for name in batch:
-                a_sp = encode_ngrams_sparse(name, vocab)
-                anchor_sparse.append(a_sp)
-                a_raw = encode_sparse_raw(a_sp, W)
-                anchor_raw.append(a_raw)
-                anchor_embs.append(l2_normalize(a_raw))
-
-                p_sp = encode_ngrams_sparse(augment(name), vocab)
-                positive_sparse.append(p_sp)
-                p_raw = encode_sparse_raw(p_sp, W)
-                positive_raw.append(p_raw)
-                positive_embs.append(l2_normalize(p_raw))
-
-            # Compute loss and gradients w.r.t. NORMALIZED embeddings
-            loss, a_grads, p_grads = infonce_loss_and_grads(
-                anchor_embs, positive_embs, TEMPERATURE
-            )
-            epoch_loss += loss
-            num_batches += 1
-
-            # Backpropagate gradients to W using SPARSE computation.
+            # Phase 3 (local): loss rows and W gradient for this worker's shard only.
             # Chain rule: d(L)/d(W) = d(L)/d(emb_norm) * d(emb_norm)/d(emb_raw) * d(emb_raw)/d(W)
             # The normalization Jacobian (middle term) projects out the radial
             # gradient component, preventing representation collapse.
-            grad_W = [[0.0] * vocab_size for _ in range(EMBEDDING_DIM)]
-
-            for b_idx in range(len(batch)):
-                # Transform gradients through normalization Jacobian
-                a_grad_raw = grad_through_norm(anchor_raw[b_idx], a_grads[b_idx])
-                p_grad_raw = grad_through_norm(positive_raw[b_idx], p_grads[b_idx])
-
-                for j, count in anchor_sparse[b_idx].items():
-                    for i in range(EMBEDDING_DIM):
-                        grad_W[i][j] += a_grad_raw[i] * count
-
-                for j, count in positive_sparse[b_idx].items():
-                    for i in range(EMBEDDING_DIM):
-                        grad_W[i][j] += p_grad_raw[i] * count
-
-            # SGD update (only for entries with non-zero gradients)
-            scale = learning_rate / len(batch)
-            for i in range(EMBEDDING_DIM):
-                for j in range(vocab_size):
-                    if grad_W[i][j] != 0.0:
-                        W[i][j] -= scale * grad_W[i][j]
-
-        avg_loss = epoch_loss / max(num_batches, 1)
+            worker_grads: list[dict[int, list[float]]] = []
+            backward_times = []
+            for shard in shards:
+                start = time.time()
+                loss, a_grads, p_grads = infonce_loss_and_grads(
+                    anchor_embs, positive_embs, TEMPERATURE, rows=shard
+                )
+                epoch_loss += loss
+                a_grads_raw = [
+                    grad_through_norm(anchor_raw[b], g) for b, g in zip(shard, a_grads)
+                ]
+                p_grads_raw = [
+                    grad_through_norm(positive_raw[b], g) for b, g in zip(shard, p_grads)
+                ]
+                grad_columns: dict[int, list[float]] = {}
+                accumulate_csr_grad(
+                    dataset["anchors"], [anchor_rows[b] for b in shard], a_grads_raw,
+                    grad_columns,
+                )
+                accumulate_csr_grad(
+                    dataset["variants"], [positive_rows[b] for b in shard], p_grads_raw,
+                    grad_columns,
+                )
+                worker_grads.append(grad_columns)
+                backward_times.append(time.time() - start)
+            num_examples += len(anchor_rows)
+
+            # Phase 4 (all-reduce): sum every worker's gradient columns. Only the
+            # n-gram columns some worker touched are exchanged — a sparse all-reduce.
+            start = time.time()
+            reduced: dict[int, list[float]] = {}
+            for grad_columns in worker_grads:
+                floats_communicated += len(grad_columns) * EMBEDDING_DIM
+                for j, grad_column in grad_columns.items():
+                    total = reduced.get(j)
+                    reduced[j] = grad_column if total is None else [
+                        t + g for t, g in zip(total, grad_column)
+                    ]
+
+            # SGD update, restricted to the n-gram columns this batch actually used
+            scale = learning_rate / len(anchor_rows)
+            for j, grad_column in reduced.items():
+                W_columns[j] = [w - scale * g for w, g in zip(W_columns[j], grad_column)]
+            update_time = time.time() - start
+
+            sequential_time += sum(encode_times) + sum(backward_times) + update_time
+            critical_path_time += max(encode_times) + max(backward_times) + update_time
+
+        avg_loss = epoch_loss / max(num_examples, 1)
         if (epoch + 1) % 5 == 0 or epoch == 0:
             print(f"  epoch {epoch + 1:>3}/{num_epochs}  loss={avg_loss:.4f}")
 
+    for j, column in enumerate(W_columns):
+        for i in range(EMBEDDING_DIM):
+            W[i][j] = column[i]
+
+    # Workers ran one after another, so the elapsed time is the sequential sum;
+    # the critical path is what the same schedule would take on parallel workers.
+    print(f"  {num_workers} simulated workers: {sequential_time:.1f}s of compute "
+          f"(run sequentially), simulated critical path {critical_path_time:.1f}s "
+          f"({sequential_time / max(critical_path_time, 1e-9):.1f}x simulated speedup), "
+          f"{floats_communicated / 1e6:.1f}M floats communicated")
+
 
 # === INFERENCE ===
 
-def find_nearest_neighbors(
+def find_nearest_neighbors_uncached(
     query: str,
     candidates: list[str],
     vocab: dict[str, int],
     W: list[list[float]],
     k: int = 5,
 ) -> list[tuple[str, float]]:
-    """Find k nearest neighbors by cosine similarity in embedding space."""
+    """Find k nearest neighbors by re-encoding every candidate for this query.
+
+    This is the naive baseline: n-gram extraction and projection for all candidates
+    are repeated on every lookup, even though none of them changed since the last one.
+    Kept for the timing comparison against the cached path below."""
     q_emb = encode_sparse(encode_ngrams_sparse(query, vocab), W)
 
     similarities = []
@@ -398,6 +595,156 @@ def find_nearest_neighbors(
     return similarities[:k]
 
 
+# === EMBEDDING CACHE ===
+# Candidate embeddings depend only on (candidate strings, W). Encoding the whole
+# candidate set once into a matrix of unit vectors turns every later query into
+# a single pass of d-dimensional dot products — no string work at all. This is
+# exactly what a vector database stores: precomputed embeddings, not raw documents.
+#
+# The cache must be invalidated whenever W changes, or queries silently return
+# neighbors under stale weights. We fingerprint W by hashing its values: O(d*V),
+# ~16K floats here, which is negligible next to re-encoding 32K names.
+
+def weights_fingerprint(W: list[list[float]]) -> int:
+    """Content hash of the projection matrix — changes whenever any weight does."""
+    return hash(tuple(tuple(row) for row in W))
+
+
+def build_embedding_cache(
+    candidates: list[str],
+    vocab: dict[str, int],
+    W: list[list[float]],
+) -> dict:
+    """Encode every candidate once into a matrix of L2-normalized embeddings.
+
+    Returns a plain dict: the candidate names, their embedding rows (same order),
+    the W fingerprint they were computed under, and an optional ANN index (None
+    until build_ann_index attaches one)."""
+    matrix = [encode_sparse(encode_ngrams_sparse(name, vocab), W) for name in candidates]
+    return {
+        "candidates": candidates,
+        "matrix": matrix,
+        "fingerprint": weights_fingerprint(W),
+        "ann": None,
+    }
+
+
+def refresh_embedding_cache(
+    cache: dict | None,
+    candidates: list[str],
+    vocab: dict[str, int],
+    W: list[list[float]],
+) -> dict:
+    """Return `cache` if it is still valid for (candidates, W), else rebuild it.
+
+    A rebuild drops any attached ANN index too: its buckets were computed from
+    the old embeddings, so they would route queries to the wrong candidates."""
+    if (cache is not None and cache["candidates"] is candidates
+            and cache["fingerprint"] == weights_fingerprint(W)):
+        return cache
+    return build_embedding_cache(candidates, vocab, W)
+
+
+def top_k_scored(scored: list[tuple[int, float]], k: int) -> list[tuple[int, float]]:
+    """Select the k highest-scoring (index, score) pairs without sorting them all.
+
+    Keeps a running best-k list ordered by descending score. Most candidates lose
+    to the current k-th best and are rejected with one comparison, so the cost is
+    O(n) plus O(k) per accepted candidate — versus O(n log n) for a full sort.
+    Signpost: a binary heap (heapq) gives the same O(n log k) bound for large k;
+    with k=5 this linear insertion is just as fast and easier to follow."""
+    best: list[tuple[int, float]] = []
+    for idx, score in scored:
+        if len(best) == k and score <= best[-1][1]:
+            continue
+        position = len(best)
+        while position > 0 and best[position - 1][1] < score:
+            position -= 1
+        best.insert(position, (idx, score))
+        if len(best) > k:
+            best.pop()
+    return best
+
+
+def build_ann_index(
+    cache: dict,
+    num_tables: int,
+    num_hash_bits: int,
+) -> None:
+    """Attach a random-hyperplane LSH index to the cache's embedding matrix.
+
+    Each table hashes an embedding to num_hash_bits bits, one per hyperplane:
+    bit i = [e · r_i >= 0]. Unit vectors at a small angle fall on the same side
+    of most hyperplanes, so near neighbors tend to share buckets. A query then
+    scores only the union of its buckets instead of the full candidate set.
+    See 03-systems/microvectorsearch.py for the full LSH walkthrough."""
+    dim = len(cache["matrix"][0])
+    hyperplanes = [
+        [[random.gauss(0.0, 1.0) for _ in range(dim)] for _ in range(num_hash_bits)]
+        for _ in range(num_tables)
+    ]
+    tables: list[dict[int, list[int]]] = []
+    for planes in hyperplanes:
+        buckets: dict[int, list[int]] = {}
+        for idx, emb in enumerate(cache["matrix"]):
+            buckets.setdefault(lsh_hash(emb, planes), []).append(idx)
+        tables.append(buckets)
+    cache["ann"] = {"hyperplanes": hyperplanes, "tables": tables}
+
+
+def lsh_hash(emb: list[float], planes: list[list[float]]) -> int:
+    """Pack the sign of each hyperplane projection into one integer bucket id."""
+    bucket = 0
+    for bit, plane in enumerate(planes):
+        if sum(e * r for e, r in zip(emb, plane)) >= 0.0:
+            bucket |= 1 << bit
+    return bucket
+
+
+def find_nearest_neighbors(
+    query: str,
+    cache: dict,
+    vocab: dict[str, int],
+    W: list[list[float]],
+    k: int = 5,
+    use_ann: bool = False,
+) -> list[tuple[str, float]]:
+    """Find k nearest neighbors by cosine similarity, served from the embedding cache.
+
+    Exact mode scores every cached row; ANN mode (requires build_ann_index) scores
+    only candidates sharing an LSH bucket with the query in at least one table.
+    Both paths skip all per-candidate string and projection work.
+
+    The cache is checked against W's fingerprint first. If W changed, the cache is
+    rebuilt in place, which also drops its now-stale ANN index."""
+    fresh = refresh_embedding_cache(cache, cache["candidates"], vocab, W)
+    if fresh is not cache:
+        cache.clear()
+        cache.update(fresh)
+
+    q_emb = encode_sparse(encode_ngrams_sparse(query, vocab), W)
+    candidates = cache["candidates"]
+    matrix = cache["matrix"]
+
+    if use_ann:
+        ann = cache["ann"]
+        if ann is None:
+            raise ValueError("use_ann=True needs an ANN index: call build_ann_index(cache, ...) "
+                             "first (a cache rebuilt after W changed has none)")
+        row_ids: set[int] = set()
+        for planes, buckets in zip(ann["hyperplanes"], ann["tables"]):
+            row_ids.update(buckets.get(lsh_hash(q_emb, planes), ()))
+    else:
+        row_ids = range(len(matrix))
+
+    scored = (
+        (idx, cosine_similarity(q_emb, matrix[idx]))
+        for idx in row_ids
+        if candidates[idx] != query
+    )
+    return [(candidates[idx], sim) for idx, sim in top_k_scored(scored, k)]
+
+
 # === MAIN ===
 
 if __name__ == "__main__":
@@ -405,8 +752,9 @@ if __name__ == "__main__":
     all_names = load_data(DATA_URL, DATA_FILE)
     print(f"Loaded {len(all_names):,} names")
 
-    # Use a training subset for speed; keep all names for nearest-neighbor search
-    train_names = all_names[:TRAIN_SIZE]
+    # Train on the full name set: CSR featurization and sparse updates make an
+    # epoch over all 32K names affordable in a single process.
+    train_names = all_names
     print(f"Training on {len(train_names):,} names\n")
 
     # Build n-gram vocabulary from training set (capped at MAX_VOCAB)
@@ -423,8 +771,9 @@ if __name__ == "__main__":
     print(f"Model: linear projection ({EMBEDDING_DIM} x {len(vocab)} = {num_params:,} params)\n")
 
     # Train
-    print(f"Training (epochs={NUM_EPOCHS}, batch={BATCH_SIZE}, temp={TEMPERATURE})...")
-    train(train_names, vocab, W, NUM_EPOCHS, BATCH_SIZE, LEARNING_RATE)
+    print(f"Training (epochs={NUM_EPOCHS}, batch={BATCH_SIZE}, workers={NUM_WORKERS}, "
+          f"temp={TEMPERATURE}, {NUM_EPOCHS * len(train_names):,} pairs)...")
+    train(train_names, vocab, W, NUM_EPOCHS, BATCH_SIZE, LEARNING_RATE, NUM_WORKERS)
     print()
 
     # === EVALUATION ===
@@ -464,12 +813,47 @@ if __name__ == "__main__":
     print(f"\nAverage positive pair similarity: {avg_pos:.3f}")
     print(f"Average random pair similarity:   {avg_rand:.3f}")
 
-    # Nearest neighbor retrieval demo
-    # Search over a larger pool for more interesting results
-    search_pool = all_names[:10000]
+    # Nearest neighbor retrieval demo.
+    # The cache is built once over the full name set; every query after that is a
+    # pass of dot products over precomputed unit vectors.
+    search_pool = all_names
     query_names = ["anna", "john", "elizabeth", "michael"]
-    print("\nNearest neighbor retrieval:")
+
+    start = time.time()
+    find_nearest_neighbors_uncached(query_names[0], search_pool, vocab, W, k=5)
+    uncached_time = time.time() - start
+
+    start = time.time()
+    cache = refresh_embedding_cache(None, search_pool, vocab, W)
+    cache_build_time = time.time() - start
+
+    print(f"\nNearest neighbor retrieval over {len(search_pool):,} names:")
+    exact_results = {}
+    start = time.time()
     for query in query_names:
-        neighbors = find_nearest_neighbors(query, search_pool, vocab, W, k=5)
+        neighbors = find_nearest_neighbors(query, cache, vocab, W, k=5)
+        exact_results[query] = neighbors
         neighbor_str = ", ".join(f"{n} ({s:.2f})" for n, s in neighbors)
         print(f"  {query:<12} -> {neighbor_str}")
+    cached_time = (time.time() - start) / len(query_names)
+
+    # Approximate index: trades a little recall for scoring a fraction of the rows.
+    start = time.time()
+    build_ann_index(cache, ANN_TABLES, ANN_HASH_BITS)
+    ann_build_time = time.time() - start
+
+    start = time.time()
+    recall_hits = 0
+    for query in query_names:
+        approx = find_nearest_neighbors(query, cache, vocab, W, k=5, use_ann=True)
+        true_names = {name for name, _ in exact_results[query]}
+        recall_hits += sum(1 for name, _ in approx if name in true_names)
+    ann_time = (time.time() - start) / len(query_names)
+
+    print(f"\nQuery latency ({len(search_pool):,} candidates):")
+    print(f"  re-encode every candidate:  {uncached_time * 1000:>8.1f} ms/query")
+    print(f"  embedding cache (exact):    {cached_time * 1000:>8.1f} ms/query  "
+          f"(one-time build {cache_build_time:.2f}s)")
+    print(f"  cache + LSH ({ANN_TABLES} tables):     {ann_time * 1000:>8.1f} ms/query  "
+          f"(one-time build {ann_build_time:.2f}s, "
+          f"recall@5 {recall_hits / (5 * len(query_names)):.2f})")
@@ -42,6 +42,9 @@ BLOCK_SIZE = 16
 LEARNING_RATE, BETA1, BETA2, EPS_ADAM = 0.01, 0.85, 0.99, 1e-8
 TARGET_STEPS, DRAFT_STEPS = 700, 500
 
+# Tree speculation: top-k draft children per node at each depth (depth 4 = draft_k)
+TREE_BRANCHING = [3, 2, 1, 1]
+
 # Data
 DATA_URL = "https://raw.githubusercontent.com/karpathy/makemore/master/names.txt"
 DATA_FILE = "names.txt"
@@ -239,9 +242,8 @@ def forward_float(tok: int, pos: int, kv: list[dict[str, list[list[float]]]],
         q = linear_f(x, wf[f'l{li}.wq'])
         k = linear_f(x, wf[f'l{li}.wk'])
         v = linear_f(x, wf[f'l{li}.wv'])
-        kv[li]['k'].append(k); kv[li]['v'].append(v)
+        clen = kv_append(kv[li], k, v)
         head_cat: list[float] = []
-        clen = len(kv[li]['k'])
         hd = c['head_dim']
         for h in range(c['n_head']):
             hs = h * hd
@@ -261,12 +263,30 @@ def forward_float(tok: int, pos: int, kv: list[dict[str, list[list[float]]]],
         x = [a + b for a, b in zip(x, x_res)]
     return linear_f(x, wf['lm_head'])
 
-def make_kv(c: Cfg) -> list[dict[str, list[list[float]]]]:
-    return [{'k': [], 'v': []} for _ in range(c['n_layer'])]
+# KV caches carry a length cursor: entries at or beyond 'len' are stale, so undoing
+# speculative tokens is an O(1) cursor move and a checkpoint is a saved length.
+def make_kv(c: Cfg) -> list[dict]:
+    return [{'k': [], 'v': [], 'len': 0} for _ in range(c['n_layer'])]
+
+def kv_append(layer: dict, k: list[float], v: list[float]) -> int:
+    """Write K/V at the cursor (overwriting a stale slot if any); return new length."""
+    n = layer['len']
+    if n < len(layer['k']): layer['k'][n] = k; layer['v'][n] = v
+    else: layer['k'].append(k); layer['v'].append(v)
+    layer['len'] = n + 1
+    return n + 1
+
+def kv_len(cache: list[dict]) -> int:
+    return cache[0]['len']
 
-def clone_kv(cache: list[dict[str, list[list[float]]]]) -> list[dict[str, list[list[float]]]]:
+def kv_truncate(cache: list[dict], length: int) -> None:
+    """Roll back to a checkpoint length by moving the cursor — no copying."""
+    for layer in cache: layer['len'] = length
+
+def clone_kv(cache: list[dict]) -> list[dict]:
     """Deep copy KV cache so beam branches don't share mutable state."""
-    return [{'k': [r[:] for r in l['k']], 'v': [r[:] for r in l['v']]} for l in cache]
+    return [{'k': [r[:] for r in l['k'][:l['len']]], 'v': [r[:] for r in l['v'][:l['len']]],
+             'len': l['len']} for l in cache]
 
 def feed_prompt(toks: list[int], wf: dict[str, list[list[float]]],
                 c: Cfg) -> tuple[list[dict[str, list[list[float]]]], list[float]]:
@@ -278,6 +298,52 @@ def feed_prompt(toks: list[int], wf: dict[str, list[list[float]]],
     return kv, logits
 
 
+# === PARTIAL SELECTION ===
+# Sampling and search only ever need the few best tokens, never a full ranking of
+# the vocabulary. A size-k min-heap keeps the k best of n scores in O(n log k).
+
+def top_k(scores: list[float], k: int) -> list[int]:
+    """Indices of the k largest scores, best first (ties: lower index first), via a
+    hand-rolled size-k min-heap on (score, -index)."""
+    heap: list[tuple[float, int]] = []
+    for i, sc in enumerate(scores):
+        item = (sc, -i)
+        if len(heap) < k:
+            heap.append(item)
+            j = len(heap) - 1
+            while j > 0 and heap[(j - 1) // 2] > heap[j]:  # sift up
+                parent = (j - 1) // 2
+                heap[parent], heap[j] = heap[j], heap[parent]
+                j = parent
+        elif item > heap[0]:
+            heap[0] = item
+            j = 0
+            while True:  # sift down
+                m, l, r = j, 2 * j + 1, 2 * j + 2
+                if l < len(heap) and heap[l] < heap[m]:
+                    m = l
+                if r < len(heap) and heap[r] < heap[m]:
+                    m = r
+                if m == j:
+                    break
+                heap[j], heap[m] = heap[m], heap[j]
+                j = m
+    return [-i for _, i in sorted(heap, reverse=True)]
+
+def nucleus(probs: list[float], p: float) -> list[int]:
+    """Smallest set of most likely tokens whose mass reaches p, best first. Grows k
+    by doubling until the top k cover p, so a confident step looks at very few."""
+    k = 1
+    while True:
+        idxs = top_k(probs, k)
+        cum = 0.0
+        for m, i in enumerate(idxs):
+            cum += probs[i]
+            if cum >= p: return idxs[:m + 1]
+        if k >= len(probs): return idxs
+        k *= 2
+
+
 # === DECODING STRATEGIES ===
 # Each strategy takes a prompt, weights, and config, returns generated tokens
 # plus total log-probability. They differ ONLY in token selection.
@@ -344,8 +410,7 @@ def decode_top_k(prompt: list[int], wf: dict, c: Cfg,
         pos = len(prompt) + len(gen)
         if pos >= BLOCK_SIZE: break
         probs = softmax_f(logits)
-        ranked = sorted(range(len(probs)), key=lambda i: probs[i], reverse=True)
-        top_set = set(ranked[:k])
+        top_set = set(top_k(probs, k))
         filt = [probs[i] if i in top_set else 0.0 for i in range(len(probs))]
         total = sum(filt)
         filt = [p / total for p in filt]
@@ -374,14 +439,8 @@ def decode_top_p(prompt: list[int], wf: dict, c: Cfg,
         pos = len(prompt) + len(gen)
         if pos >= BLOCK_SIZE: break
         probs = softmax_f(logits)
-        ranked = sorted(range(len(probs)), key=lambda i: probs[i], reverse=True)
-        cumsum = 0.0
-        nucleus: set[int] = set()
-        for idx in ranked:
-            nucleus.add(idx)
-            cumsum += probs[idx]
-            if cumsum >= p: break
-        filt = [probs[i] if i in nucleus else 0.0 for i in range(len(probs))]
+        keep = set(nucleus(probs, p))
+        filt = [probs[i] if i in keep else 0.0 for i in range(len(probs))]
         total = sum(filt)
         filt = [pr / total for pr in filt]
         tok = random.choices(range(c['vocab_size']), weights=filt)[0]
@@ -392,16 +451,11 @@ def decode_top_p(prompt: list[int], wf: dict, c: Cfg,
     return gen, lp
 
 
-def decode_beam(prompt: list[int], wf: dict, c: Cfg,
-                max_len: int = 12, beam_width: int = 3) -> tuple[list[int], float]:
-    """Maintain top-B candidate sequences, expand and prune at each step.
-
-    Finds higher log-probability sequences than greedy by exploring multiple
-    paths simultaneously. Beam search is NOT sampling — it is a deterministic
-    search algorithm. Two runs with the same input produce identical output.
-    The key tradeoff: beam_width * cost_per_step compute for potentially much
-    better global solutions. Used heavily in machine translation.
-    """
+def decode_beam_naive(prompt: list[int], wf: dict, c: Cfg,
+                      max_len: int = 12, beam_width: int = 3) -> tuple[list[int], float]:
+    """Beam search the straightforward way: clone the KV cache and run a forward
+    for every one of the beam_width^2 candidates, most of which are pruned right
+    after. Kept as the baseline decode_beam is checked and timed against."""
     # Each beam: (cumulative_log_prob, generated_tokens, kv_cache, pending_logits)
     init_kv, init_logits = feed_prompt(prompt, wf, c)
     beams: list[tuple[float, list[int], list[dict[str, list[list[float]]]], list[float]]] = [
@@ -438,6 +492,198 @@ def decode_beam(prompt: list[int], wf: dict, c: Cfg,
     return best[1], best[0]
 
 
+# === BEAM SEARCH WITH SHARED-PREFIX KV ===
+# Three things make naive beam search slow: a full vocabulary sort per beam, a KV
+# copy per candidate, and a forward per candidate -- beam_width^2 of them, of which
+# all but beam_width are thrown away. Instead:
+# 1. Select first, forward later. A candidate's score is just parent log-prob plus
+#    token log-prob, so the top beam_width can be picked from beam x vocab scores
+#    before any forward; only the survivors run the model, once each.
+# 2. Partial selection (top_k). We never need the order of the rest.
+# 3. Shared prefixes. Each position's K/V lives in one node that points at its
+#    parent node, so a beam is just a pointer to its newest node and siblings share
+#    everything before their fork. Extending a beam adds one node; pruning a beam
+#    drops its pointer (Python's refcounts free nodes no survivor reaches).
+
+# A KV node: (parent_node | None, [k per layer], [v per layer])
+KVNode = tuple[object, list, list]
+
+def kv_from_chain(node: KVNode | None, c: Cfg) -> list[dict]:
+    """Cursor-style KV cache over a node chain. Holds references to the shared
+    K/V vectors; no floats are copied."""
+    path: list[KVNode] = []
+    while node is not None:
+        path.append(node)
+        node = node[0]
+    path.reverse()
+    return [{'k': [n[1][li] for n in path], 'v': [n[2][li] for n in path], 'len': len(path)}
+            for li in range(c['n_layer'])]
+
+def forward_node(tok: int, pos: int, parent: KVNode | None, wf: dict,
+                 c: Cfg) -> tuple[KVNode, list[float]]:
+    """forward_float on top of a shared prefix; returns (new node, logits)."""
+    kv = kv_from_chain(parent, c)
+    logits = forward_float(tok, pos, kv, wf, c)
+    return (parent, [l['k'][-1] for l in kv], [l['v'][-1] for l in kv]), logits
+
+def decode_beam(prompt: list[int], wf: dict, c: Cfg,
+                max_len: int = 12, beam_width: int = 3) -> tuple[list[int], float]:
+    """Maintain top-B candidate sequences, expand and prune at each step.
+
+    Finds higher log-probability sequences than greedy by exploring multiple
+    paths simultaneously. Beam search is NOT sampling — it is a deterministic
+    search algorithm. Two runs with the same input produce identical output.
+    The key tradeoff: beam_width * cost_per_step compute for potentially much
+    better global solutions. Used heavily in machine translation.
+
+    Same search as decode_beam_naive (each beam offers its top beam_width tokens,
+    the best beam_width non-BOS candidates survive), but only survivors run a
+    forward, and all beams share prefix KV through parent pointers.
+    """
+    kv, init_logits = feed_prompt(prompt, wf, c)
+    root: KVNode | None = None
+    for t in range(kv_len(kv)):
+        root = (root, [l['k'][t] for l in kv], [l['v'][t] for l in kv])
+    # Each beam: (cumulative_log_prob, generated_tokens, kv_node, pending_logits)
+    beams: list[tuple[float, list[int], KVNode | None, list[float]]] = [
+        (0.0, [], root, init_logits)]
+    completed: list[tuple[float, list[int]]] = []
+
+    for _ in range(max_len):
+        # (score, beam index, token) for each beam's top beam_width tokens
+        candidates: list[tuple[float, int, int]] = []
+        for bi, (blp, btoks, _, blogits) in enumerate(beams):
+            if len(prompt) + len(btoks) >= BLOCK_SIZE:
+                completed.append((blp, btoks))
+                continue
+            probs = softmax_f(blogits)
+            for idx in top_k(probs, beam_width):
+                token_lp = math.log(max(probs[idx], 1e-10))
+                if idx == c['bos']: completed.append((blp + token_lp, btoks))
+                else: candidates.append((blp + token_lp, bi, idx))
+        if not candidates: break
+        # Select the survivors over all beam x token scores, then one forward each
+        survivors = [candidates[i] for i in top_k([cd[0] for cd in candidates], beam_width)]
+        new_beams: list[tuple[float, list[int], KVNode | None, list[float]]] = []
+        for score, bi, idx in survivors:
+            _, btoks, bnode, _ = beams[bi]
+            node, logits = forward_node(idx, len(prompt) + len(btoks), bnode, wf, c)
+            new_beams.append((score, btoks + [idx], node, logits))
+        beams = new_beams
+
+    all_results = completed + [(lp, toks) for lp, toks, _, _ in beams]
+    if not all_results: return [], 0.0
+    best = max(all_results, key=lambda r: r[0])
+    return best[1], best[0]
+
+
+# === BATCHED SAMPLING ENGINE ===
+# The decode_* functions above run one sequence at a time: a prompt feed, then one
+# forward per token, each walking every weight matrix on its own. generate_batch
+# advances all sequences in lockstep instead. Every step does a single forward over
+# the batch, and each weight row is loaded once and applied to every sequence's
+# activation (linear_batch). Only attention stays per-sequence, because each
+# sequence has its own KV cache. Prompts may differ in length: a sequence still
+# inside its prompt just consumes the next prompt token instead of sampling.
+# Strategy and parameters are per sequence, so one batch can mix greedy, temperature,
+# top-k and top-p requests -- what a serving engine sees.
+
+SAMPLING_DEFAULTS = {'greedy': {}, 'temperature': {'temperature': 0.8},
+                     'top_k': {'k': 5}, 'top_p': {'p': 0.9}}
+
+def linear_batch(xs: list[list[float]], w: list[list[float]]) -> list[list[float]]:
+    """linear_f over a batch with the weight row on the outer loop: each row is
+    fetched once per step and applied to every sequence's activation. The products
+    and summation order per output match linear_f, so results are bit-identical."""
+    outs: list[list[float]] = [[] for _ in xs]
+    for row in w:
+        for out, x in zip(outs, xs):
+            out.append(sum(a * b for a, b in zip(row, x)))
+    return outs
+
+def forward_batch(toks: list[int], positions: list[int], kvs: list[list[dict]],
+                  wf: dict[str, list[list[float]]], c: Cfg) -> list[list[float]]:
+    """forward_float for a batch of sequences, one token each. Returns logits per sequence."""
+    xs = [rmsnorm_f([wf['wte'][t][j] + wf['wpe'][p][j] for j in range(c['n_embd'])])
+          for t, p in zip(toks, positions)]
+    hd = c['head_dim']
+    for li in range(c['n_layer']):
+        x_res = xs
+        xs = [rmsnorm_f(x) for x in xs]
+        qs = linear_batch(xs, wf[f'l{li}.wq'])
+        ks = linear_batch(xs, wf[f'l{li}.wk'])
+        vs = linear_batch(xs, wf[f'l{li}.wv'])
+        heads: list[list[float]] = []
+        for q, k, v, kv in zip(qs, ks, vs, kvs):
+            clen = kv_append(kv[li], k, v)
+            keys, vals = kv[li]['k'], kv[li]['v']
+            head_cat: list[float] = []
+            for h in range(c['n_head']):
+                hs = h * hd
+                q_h = q[hs:hs + hd]
+                scores = [sum(q_h[j] * keys[t][hs + j] for j in range(hd)) / (hd ** 0.5)
+                          for t in range(clen)]
+                w = softmax_f(scores)
+                for j in range(hd):
+                    head_cat.append(sum(w[t] * vals[t][hs + j] for t in range(clen)))
+            heads.append(head_cat)
+        attn_out = linear_batch(heads, wf[f'l{li}.wo'])
+        xs = [[a + b for a, b in zip(x, r)] for x, r in zip(attn_out, x_res)]
+        x_res = xs
+        hs_ = linear_batch([rmsnorm_f(x) for x in xs], wf[f'l{li}.fc1'])
+        hs_ = linear_batch([[max(0.0, v) for v in h] for h in hs_], wf[f'l{li}.fc2'])
+        xs = [[a + b for a, b in zip(x, r)] for x, r in zip(hs_, x_res)]
+    return linear_batch(xs, wf['lm_head'])
+
+def sample_token(logits: list[float], strategy: str, params: dict) -> tuple[int, float]:
+    """Pick one token; returns (token, probability under the unfiltered distribution)."""
+    if strategy == 'greedy':
+        probs = softmax_f(logits)
+        tok = max(range(len(probs)), key=lambda i: probs[i])
+        return tok, probs[tok]
+    probs = softmax_f([l / params.get('temperature', 1.0) for l in logits])
+    if strategy == 'temperature': idxs = list(range(len(probs)))
+    elif strategy == 'top_k': idxs = top_k(probs, params['k'])
+    elif strategy == 'top_p': idxs = nucleus(probs, params['p'])
+    else: raise ValueError(f"unknown strategy: {strategy}")
+    tok = random.choices(idxs, weights=[probs[i] for i in idxs])[0]
+    return tok, probs[tok]
+
+def generate_batch(prompts: list[list[int]], strategy: str | list[str], n: int,
+                   wf: dict, c: Cfg, params: dict | list[dict] | None = None,
+                   max_len: int = 12) -> list[tuple[list[int], float]]:
+    """Generate n samples per prompt, all sequences in lockstep.
+
+    strategy and params may be one value for the whole batch or a list with one
+    entry per sequence (len(prompts) * n, prompt-major). Missing params fall back
+    to SAMPLING_DEFAULTS. Returns (tokens, log_prob) per sequence, like decode_*.
+    """
+    seqs = [pr for pr in prompts for _ in range(n)]
+    strats = strategy if isinstance(strategy, list) else [strategy] * len(seqs)
+    plist = params if isinstance(params, list) else [params or {}] * len(seqs)
+    plist = [{**SAMPLING_DEFAULTS[st], **pp} for st, pp in zip(strats, plist)]
+    kvs = [make_kv(c) for _ in seqs]
+    pos = [0] * len(seqs)
+    gens: list[list[int]] = [[] for _ in seqs]
+    lps = [0.0] * len(seqs)
+    active = [i for i in range(len(seqs)) if seqs[i]]
+    while active:
+        logits = forward_batch([(seqs[i] + gens[i])[pos[i]] for i in active],
+                               [pos[i] for i in active], [kvs[i] for i in active], wf, c)
+        still: list[int] = []
+        for i, lg in zip(active, logits):
+            pos[i] += 1
+            if pos[i] < len(seqs[i]): still.append(i); continue  # still prefilling
+            if pos[i] >= BLOCK_SIZE or len(gens[i]) >= max_len: continue
+            tok, pr = sample_token(lg, strats[i], plist[i])
+            if tok == c['bos']: continue
+            lps[i] += math.log(max(pr, 1e-10))
+            gens[i].append(tok)
+            if len(gens[i]) < max_len and pos[i] + 1 < BLOCK_SIZE: still.append(i)
+        active = still
+    return list(zip(gens, lps))
+
+
 def decode_speculative(
     prompt: list[int], t_wf: dict, d_wf: dict, tc: Cfg, dc: Cfg,
     max_len: int = 12, draft_k: int = 4,
@@ -469,10 +715,12 @@ def decode_speculative(
         if cur >= BLOCK_SIZE or remaining <= 0: break
 
         # Phase 1: Draft model proposes k tokens greedily (fast, small model)
+        # The draft writes into its real cache from a checkpoint (just its length)
         draft_toks: list[int] = []
         draft_probs: list[list[float]] = []
-        tmp_d_kv = clone_kv(d_kv)
-        tmp_d_logits = d_logits[:]
+        draft_logits: list[list[float]] = []
+        d_checkpoint = kv_len(d_kv)
+        tmp_d_logits = d_logits
         for di in range(remaining):
             pos = cur + di
             if pos >= BLOCK_SIZE: break
@@ -481,7 +729,8 @@ def decode_speculative(
             dtok = max(range(dc['vocab_size']), key=lambda i: dp[i])
             if dtok == dc['bos']: break
             draft_toks.append(dtok)
-            tmp_d_logits = forward_float(dtok, pos, tmp_d_kv, d_wf, dc)
+            tmp_d_logits = forward_float(dtok, pos, d_kv, d_wf, dc)
+            draft_logits.append(tmp_d_logits)
 
         if not draft_toks:
             # Draft produced BOS — fall back to one target greedy step
@@ -499,9 +748,11 @@ def decode_speculative(
         # Phase 2: Target model verifies each draft token
         # On GPU this would be one batched forward pass. The acceptance logic is
         # identical to the parallel version regardless of serial/parallel execution.
+        # The target only runs on tokens it keeps, so its cache never needs rollback.
         accepted: list[int] = []
-        tmp_t_kv = clone_kv(t_kv)
-        tmp_t_logits = t_logits[:]
+        n_draft_ok = 0
+        tmp_t_kv = t_kv
+        tmp_t_logits = t_logits
 
         for vi in range(len(draft_toks)):
             tp = softmax_f(tmp_t_logits)
@@ -510,7 +761,7 @@ def decode_speculative(
             # Rejection sampling: accept with p = min(1, p_target/p_draft)
             ratio = min(1.0, tp[dtok] / max(dp[dtok], 1e-10))
             if random.random() < ratio:
-                accepted.append(dtok)
+                accepted.append(dtok); n_draft_ok += 1
                 lp += math.log(max(tp[dtok], 1e-10))
                 tmp_t_logits = forward_float(dtok, cur + vi, tmp_t_kv, t_wf, tc)
             else:
@@ -525,16 +776,19 @@ def decode_speculative(
                 if rtok != tc['bos']:
                     accepted.append(rtok)
                     lp += math.log(max(tp[rtok], 1e-10))
-                    forward_float(rtok, cur + vi, tmp_t_kv, t_wf, tc)
+                    tmp_t_logits = forward_float(rtok, cur + vi, tmp_t_kv, t_wf, tc)
                 break  # Discard all remaining draft tokens after rejection
 
         total_accepted += len(accepted)
 
-        # Commit accepted tokens to both real KV caches
-        for ai, atok in enumerate(accepted):
-            t_logits = forward_float(atok, cur + ai, t_kv, t_wf, tc)
-            d_logits = forward_float(atok, cur + ai, d_kv, d_wf, dc)
-            gen.append(atok)
+        # Commit: target cache is already exact; the draft keeps its accepted
+        # prefix, drops the rejected tail, and catches up on a resampled token.
+        t_logits = tmp_t_logits
+        kv_truncate(d_kv, d_checkpoint + n_draft_ok)
+        if n_draft_ok: d_logits = draft_logits[n_draft_ok - 1]
+        if len(accepted) > n_draft_ok:
+            d_logits = forward_float(accepted[-1], cur + n_draft_ok, d_kv, d_wf, dc)
+        gen.extend(accepted)
 
         if not accepted:
             tp = softmax_f(t_logits)
@@ -548,6 +802,133 @@ def decode_speculative(
     return gen, lp, total_proposed, total_accepted
 
 
+# Tree speculation (SpecInfer, Miao et al., 2023): keep the draft's top-k tokens at
+# each step as sibling branches and score the whole tree in ONE target pass. A tree
+# attention mask lets each node see the prefix cache plus its own root path only, so
+# its logits equal a sequential decode of that path. Acceptance stays lossless: at
+# each node, sample from the target; if the sample is a drafted child, descend,
+# otherwise it is the round's final token. (min(1, p/q) with point-mass proposals,
+# checked against each sibling in turn, reduces to exactly this.)
+
+def tree_mask(parents: list[int]) -> list[list[bool]]:
+    """mask[i][j]: may tree node i attend to tree node j? Only if j is on i's root path."""
+    mask = [[False] * len(parents) for _ in parents]
+    for i in range(len(parents)):
+        j = i
+        while j != -1: mask[i][j] = True; j = parents[j]
+    return mask
+
+def forward_tree(toks: list[int], parents: list[int], start_pos: int,
+                 kv: list[dict[str, list[list[float]]]],
+                 tree_kv: list[dict[str, list[list[float]]]],
+                 wf: dict[str, list[list[float]]], c: Cfg) -> list[list[float]]:
+    """One pass over the tree nodes not yet in tree_kv (parents before children).
+    Tree K/V go to tree_kv, leaving the prefix cache untouched. Returns logits per node."""
+    mask = tree_mask(parents)
+    depth = [0] * len(toks)
+    for i in range(1, len(toks)): depth[i] = depth[parents[i]] + 1
+    out: list[list[float]] = []
+    for i in range(kv_len(tree_kv), len(toks)):
+        x = [wf['wte'][toks[i]][j] + wf['wpe'][start_pos + depth[i]][j] for j in range(c['n_embd'])]
+        x = rmsnorm_f(x)
+        for li in range(c['n_layer']):
+            x_res = x[:]
+            x = rmsnorm_f(x)
+            q = linear_f(x, wf[f'l{li}.wq'])
+            kv_append(tree_kv[li], linear_f(x, wf[f'l{li}.wk']), linear_f(x, wf[f'l{li}.wv']))
+            visible = [j for j in range(i + 1) if mask[i][j]]
+            n = kv[li]['len']
+            keys = kv[li]['k'][:n] + [tree_kv[li]['k'][j] for j in visible]
+            vals = kv[li]['v'][:n] + [tree_kv[li]['v'][j] for j in visible]
+            head_cat: list[float] = []
+            hd = c['head_dim']
+            for h in range(c['n_head']):
+                hs = h * hd
+                q_h = q[hs:hs + hd]
+                scores = [sum(q_h[j] * key[hs + j] for j in range(hd)) / (hd ** 0.5)
+                          for key in keys]
+                w = softmax_f(scores)
+                for j in range(hd):
+                    head_cat.append(sum(w[t] * vals[t][hs + j] for t in range(len(vals))))
+            x = linear_f(head_cat, wf[f'l{li}.wo'])
+            x = [a + b for a, b in zip(x, x_res)]
+            x_res = x[:]
+            x = rmsnorm_f(x)
+            x = linear_f(x, wf[f'l{li}.fc1'])
+            x = [max(0.0, v) for v in x]
+            x = linear_f(x, wf[f'l{li}.fc2'])
+            x = [a + b for a, b in zip(x, x_res)]
+        out.append(linear_f(x, wf['lm_head']))
+    return out
+
+def decode_tree_speculative(
+    prompt: list[int], t_wf: dict, d_wf: dict, tc: Cfg, dc: Cfg,
+    max_len: int = 12, branching: list[int] = TREE_BRANCHING, temperature: float = 0.8,
+) -> tuple[list[int], float, int, int]:
+    """Draft a token tree (branching[d] children per node at depth d), verify it in
+    one target pass, commit the accepted path's K/V straight from the tree. Both
+    models sample at temperature, as in microspeculative.py, so the two scripts'
+    tokens/pass figures are comparable.
+
+    Returns: (tokens, log_prob, target_passes, total_accepted)
+    """
+    t_kv, _ = feed_prompt(prompt[:-1], t_wf, tc)
+    d_kv, _ = feed_prompt(prompt[:-1], d_wf, dc)
+    pending = prompt[-1]  # last emitted token, not yet cached: the next tree's root
+    gen: list[int] = []
+    lp = 0.0
+    passes = total_accepted = 0
+
+    while len(gen) < max_len:
+        cur = len(prompt) - 1 + len(gen)
+        if cur >= BLOCK_SIZE: break
+        depth_budget = min(len(branching), max_len - len(gen) - 1, BLOCK_SIZE - 1 - cur)
+
+        # Draft grows the tree one level per pass
+        toks, parents, frontier = [pending], [-1], [0]
+        d_tree = make_kv(dc)
+        for depth in range(depth_budget):
+            level_logits = forward_tree(toks, parents, cur, d_kv, d_tree, d_wf, dc)
+            next_frontier: list[int] = []
+            for node, logits in zip(frontier, level_logits):
+                dp = softmax_f([l / temperature for l in logits])
+                # One extra candidate covers BOS, which never becomes a branch
+                best = top_k(dp, branching[depth] + 1)
+                for tok in [t for t in best if t != dc['bos']][:branching[depth]]:
+                    toks.append(tok); parents.append(node); next_frontier.append(len(toks) - 1)
+            frontier = next_frontier
+
+        # Target scores every node in one pass, then we walk down the tree
+        t_tree = make_kv(tc)
+        t_logits = forward_tree(toks, parents, cur, t_kv, t_tree, t_wf, tc)
+        passes += 1
+        path = [0]
+        while True:
+            tp = softmax_f([l / temperature for l in t_logits[path[-1]]])
+            y = random.choices(range(tc['vocab_size']), weights=tp)[0]
+            if y != tc['bos']: lp += math.log(max(tp[y], 1e-10))
+            child = next((i for i in range(len(toks))
+                          if parents[i] == path[-1] and toks[i] == y), None)
+            if child is None: break
+            path.append(child); gen.append(y); total_accepted += 1
+
+        # Commit the accepted path; the draft never ran the deepest level
+        for d, node in enumerate(path):
+            for li in range(tc['n_layer']):
+                kv_append(t_kv[li], t_tree[li]['k'][node], t_tree[li]['v'][node])
+            if node < kv_len(d_tree):
+                for li in range(dc['n_layer']):
+                    kv_append(d_kv[li], d_tree[li]['k'][node], d_tree[li]['v'][node])
+            else:
+                forward_float(toks[node], cur + d, d_kv, d_wf, dc)
+
+        if y == tc['bos']: break
+        gen.append(y)
+        pending = y
+
+    return gen, lp, passes, total_accepted
+
+
 # === MODEL INIT AND TRAINING ===
 
 def init_params(vocab_size: int, n_embd: int, n_head: int,
@@ -676,6 +1057,10 @@ if __name__ == "__main__":
         tps = sa / max(1, sp / 4) if sp > 0 else 1.0
         print(f"{'Speculative (k=4)':<22} {tok2str(s):<16} {slp:>10.2f} {tps:>12.1f}")
 
+        ts, tslp, tpasses, _ = decode_tree_speculative(ptoks, twf, dwf, tc, dc)
+        print(f"{'Tree spec (3,2,1,1)':<22} {tok2str(ts):<16} {tslp:>10.2f} "
+              f"{len(ts) / max(tpasses, 1):>12.1f}")
+
     # === DIVERSITY ANALYSIS ===
     # Deterministic strategies (greedy, beam) produce the same output for the same
     # prompt. Stochastic strategies (temperature, top-k, top-p) produce diversity —
@@ -705,6 +1090,61 @@ if __name__ == "__main__":
               f"{sum(len(n) for n in names) / n_samp:>11.1f} "
               f"{sum(lps) / n_samp:>13.2f}")
 
+    # === BEAM SEARCH THROUGHPUT ===
+    # decode_beam_naive runs beam_width^2 cloned forwards per step (capped by the
+    # vocabulary); decode_beam selects over beam x vocab first and runs beam_width.
+    print("\n=== Beam Search Throughput: Naive vs Select-Then-Forward ===\n")
+    bprompt = [BOS, unique_chars.index(seeds[0])]
+    bsteps = min(12, BLOCK_SIZE - len(bprompt))
+    print(f"{'Width':<7} {'Naive steps/s':>14} {'Shared steps/s':>15} {'Speedup':>8} "
+          f"{'Same result':>12}")
+    print("-" * 60)
+    for width in [4, 16, 64]:
+        t0 = time.perf_counter()
+        nb = decode_beam_naive(bprompt, twf, tc, beam_width=width)
+        naive_t = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        sb = decode_beam(bprompt, twf, tc, beam_width=width)
+        shared_t = time.perf_counter() - t0
+        print(f"{width:<7} {bsteps / naive_t:>14.1f} {bsteps / shared_t:>15.1f} "
+              f"{naive_t / shared_t:>7.1f}x {str(nb == sb):>12}")
+    # Signpost: a GPU beam search does the same: one batched forward over the surviving
+    # beams, a top-k kernel over the flattened beam x vocab scores, and paged KV with
+    # copy-on-write blocks (vLLM) so forked beams share their prefix pages.
+
+    # === BATCHED SAMPLING ENGINE ===
+    # A mixed batch (greedy / temperature / top-k / top-p, cycling) generated one
+    # sequence at a time with the decode_* functions vs in lockstep with generate_batch.
+    print("\n=== Batched Sampling Engine: Sequential vs Lockstep ===\n")
+    gprompts = [[BOS, unique_chars.index(ch)] for ch in seeds]
+    assert [g for g, _ in generate_batch(gprompts, 'greedy', 1, twf, tc)] == \
+           [decode_greedy(pt, twf, tc)[0] for pt in gprompts]
+    print("generate_batch greedy == decode_greedy for every prompt: yes\n")
+    mix = ['greedy', 'temperature', 'top_k', 'top_p']
+    sequential = {'greedy': lambda pt: decode_greedy(pt, twf, tc),
+                  'temperature': lambda pt: decode_temperature(pt, twf, tc, temperature=0.8),
+                  'top_k': lambda pt: decode_top_k(pt, twf, tc, k=5),
+                  'top_p': lambda pt: decode_top_p(pt, twf, tc, p=0.9)}
+    print(f"{'Batch':<7} {'Sequential seq/s':>17} {'Batched seq/s':>14} {'Speedup':>8}")
+    print("-" * 50)
+    for bsz in [1, 4, 16, 64, 256]:
+        bprompts = [gprompts[i % len(gprompts)] for i in range(bsz)]
+        bstrats = [mix[i % len(mix)] for i in range(bsz)]
+        t0 = time.perf_counter()
+        for pt, st in zip(bprompts, bstrats):
+            sequential[st](pt)
+        seq_t = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        generate_batch(bprompts, bstrats, 1, twf, tc)
+        batch_t = time.perf_counter() - t0
+        print(f"{bsz:<7} {bsz / seq_t:>17.1f} {bsz / batch_t:>14.1f} {seq_t / batch_t:>7.2f}x")
+    # Signpost: in pure Python the arithmetic per sequence is unchanged; lockstep
+    # only saves the per-row fetch and the per-step loop and call overhead, so small
+    # batches are within timing noise and the gain appears as B grows. On a GPU the
+    # lockstep forward turns B matrix-vector products into one matrix-matrix product
+    # that reads each weight once per step, which is where batch serving gets its
+    # throughput.
+
     # === SPECULATIVE DECODING STATS ===
     print("\n=== Speculative Decoding Stats ===")
     tot_prop = tot_acc = 0
@@ -725,3 +1165,16 @@ if __name__ == "__main__":
     # 70-90% are common. The real GPU speedup comes from batching the k verification
     # forward passes into a single kernel launch — our scalar Python cannot show that
     # parallelism, but the acceptance rate is the hardware-independent metric.
+
+    # Chain vs tree under the same one-pass verification: the chain keeps only the
+    # draft's top token per step, the tree also keeps its runners-up.
+    print("\nTree vs chain (tokens emitted per target pass, same draft, depth 4, T=0.8):")
+    for sname, branching in [("chain", [1, 1, 1, 1]), ("tree", TREE_BRANCHING)]:
+        n_tok = n_pass = n_acc = 0
+        for i in range(n_samp):
+            pt = [BOS, unique_chars.index(seeds[i])]
+            toks, _, passes, acc = decode_tree_speculative(pt, twf, dwf, tc, dc,
+                                                           branching=branching)
+            n_tok += len(toks); n_pass += passes; n_acc += acc
+        print(f"  {sname:<6} {str(branching):<14} tokens/pass {n_tok / n_pass:.2f} | "
+              f"accepted drafts/pass {n_acc / n_pass:.2f}")
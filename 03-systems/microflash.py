@@ -48,6 +48,11 @@ MEMORY_BLOCK_SIZES: list[int] = [4, 8, 16]
 BLOCK_EFFECT_N = 64
 BLOCK_EFFECT_SIZES: list[int] = [4, 8, 16, 32]
 
+# Packed batch for the causal / variable-length comparison: sequences of unequal
+# length, as a serving batch would contain. Padding would stretch each to the max.
+VARLEN_SEQ_LENS: list[int] = [64, 12, 37, 50, 23, 64, 8, 30]
+VARLEN_BLOCK_SIZE = 8
+
 # Signpost: these are tiny dimensions chosen for instant execution and readable output.
 # Production Flash Attention operates on d=128, N=8192+, block_size=64-256 (tuned per
 # GPU SRAM capacity). The algorithm is identical; only the constants differ.
@@ -67,17 +72,8 @@ def rand_matrix(rows: int, cols: int) -> list[list[float]]:
 
 
 def matmul(a: list[list[float]], b: list[list[float]]) -> list[list[float]]:
-    """A[m,k] @ B[k,n] -> C[m,n]."""
-    m = len(a)
-    k = len(a[0])
-    n = len(b[0])
-    # Transpose B so inner loop accesses contiguous rows (cache-friendly in C;
-    # irrelevant in Python, but mirrors the pattern Flash Attention exploits on GPU)
-    bt = [[b[r][c] for r in range(k)] for c in range(n)]
-    return [
-        [sum(a[i][p] * bt[j][p] for p in range(k)) for j in range(n)]
-        for i in range(m)
-    ]
+    """A[m,k] @ B[k,n] -> C[m,n]. Transposes B, then runs the tiled engine below."""
+    return matmul_bt(a, transpose(b))
 
 
 def transpose(mat: list[list[float]]) -> list[list[float]]:
@@ -110,12 +106,25 @@ def max_abs_diff(a: list[list[float]], b: list[list[float]]) -> float:
     )
 
 
+# === MATMUL ENGINE ===
+# One list-comprehension dot product per output over a pre-transposed B. The rationale
+# and the benchmark against the generator matmul it replaced live in microroofline.py.
+
+
+def matmul_bt(a: list[list[float]], bt: list[list[float]]) -> list[list[float]]:
+    """A[m,k] @ B[k,n] -> C[m,n], given B already transposed as bt[n,k].
+
+    Q @ K^T is exactly this shape, so attention scores need no transpose at all."""
+    return [[sum([x * y for x, y in zip(a_row, b_row)]) for b_row in bt] for a_row in a]
+
+
 # === STANDARD ATTENTION ===
 # The textbook formulation that Flash Attention replaces. Computing this requires
 # materializing the full N*N score matrix in memory -- the bottleneck.
 
 def standard_attention(
-    q: list[list[float]], k: list[list[float]], v: list[list[float]]
+    q: list[list[float]], k: list[list[float]], v: list[list[float]],
+    causal: bool = False,
 ) -> tuple[list[list[float]], int]:
     """Compute attention by materializing the full N*N score matrix.
 
@@ -128,16 +137,22 @@ def standard_attention(
     This O(N^2) memory is the reason standard attention breaks on long sequences.
     At N=128K with float16, the score matrix alone is 32 GB.
 
+    causal=True masks S[i][j] = -inf for j > i (query i sees keys 0..i) -- computed
+    in full and then discarded, which is exactly the waste flash attention skips.
+
     Returns (output, peak_memory_floats)."""
     n = len(q)
     d = len(q[0])
     scale = 1.0 / math.sqrt(d)
 
-    # S = Q @ K^T -- the N*N matrix we want to avoid materializing
-    scores = matmul(q, transpose(k))
+    # S = Q @ K^T -- the N*N matrix we want to avoid materializing.
+    # K's rows are already K^T's columns, so the engine takes K as-is.
+    scores = matmul_bt(q, k)
 
     # Scale before softmax (equivalent to scaling Q beforehand, but clearer)
     scores = [[v * scale for v in row] for row in scores]
+    if causal:
+        scores = [row[:i + 1] + [float("-inf")] * (n - i - 1) for i, row in enumerate(scores)]
 
     # P = softmax(S) -- still N*N
     weights = softmax_rows(scores)
@@ -191,7 +206,7 @@ def standard_attention(
 
 def flash_attention(
     q: list[list[float]], k: list[list[float]], v: list[list[float]],
-    block_size: int,
+    block_size: int, causal: bool = False, stats: dict[str, int] | None = None,
 ) -> tuple[list[list[float]], int]:
     """Flash Attention: compute exact attention WITHOUT materializing the N*N matrix.
 
@@ -202,6 +217,11 @@ def flash_attention(
     Peak memory: block_size * block_size floats (one tile of scores at a time).
     Compare to N*N for standard attention.
 
+    causal=True applies the autoregressive mask at tile granularity: key blocks that
+    start after a query block ends are skipped without computing anything, and only
+    the diagonal tiles (which straddle the mask boundary) are masked element-wise.
+    If given, stats accumulates 'tiles' processed and matmul 'flops' spent on them.
+
     Returns (output, peak_memory_floats)."""
     n = len(q)
     d = len(q[0])
@@ -223,32 +243,53 @@ def flash_attention(
 
         # Inner loop: for each query block, sweep over ALL key/value blocks.
         # This is the "tiling" -- only one bq * bk tile of scores exists at a time.
-        for k_start in range(0, n, block_size):
+        # Causal: a key block starting at or after q_end is entirely in the future of
+        # every query in this block, so the sweep stops there. For long sequences
+        # this skips almost half the tiles.
+        k_stop = q_end if causal else n
+        for k_start in range(0, k_stop, block_size):
             k_end = min(k_start + block_size, n)
             k_block = k[k_start:k_end]
             v_block = v[k_start:k_end]
             bk = k_end - k_start
+            if stats is not None:
+                # QK^T and P@V: each 2*bq*bk*d FLOPs (multiply + add)
+                stats["tiles"] = stats.get("tiles", 0) + 1
+                stats["flops"] = stats.get("flops", 0) + 4 * bq * bk * d
 
             # Track simulated memory: the score tile is the largest temporary
             peak_memory = max(peak_memory, bq * bk)
 
             # Step 1: Compute partial scores S_ij = Q_block @ K_block^T / sqrt(d)
-            # This is a bq * bk matrix -- NOT N*N.
-            scores_tile: list[list[float]] = []
-            for qi in range(bq):
-                row: list[float] = []
-                for ki in range(bk):
-                    dot = sum(q_block[qi][c] * k_block[ki][c] for c in range(d))
-                    row.append(dot * scale)
-                scores_tile.append(row)
-
-            # Step 2: For each query row in this block, apply the online softmax update
+            # This is a bq * bk matrix -- NOT N*N. One engine call per tile.
+            scores_tile = [[s * scale for s in row] for row in matmul_bt(q_block, k_block)]
+
+            # Diagonal tile: key k_start + ki is visible to query q_start + qi only if
+            # ki <= q_start + qi - k_start. Everything right of that becomes -inf,
+            # which exp() turns into an exact zero weight.
+            if causal and k_end - 1 > q_start:
+                for qi in range(bq):
+                    visible = max(0, q_start + qi - k_start + 1)
+                    if visible < bk:
+                        scores_tile[qi][visible:] = [float("-inf")] * (bk - visible)
+
+            # Step 2: For each query row in this block, compute the online softmax
+            # statistics and the unnormalized tile probabilities P_ij = exp(S_ij - m_new)
+            exp_tile: list[list[float]] = []
+            rescales: list[float] = []
+            inv_ls: list[float] = []
             for qi in range(bq):
                 global_i = q_start + qi  # index into the full output
 
                 # Local max for this tile row
                 #   m_ij = max(S_ij[qi, :])
                 m_tile = max(scores_tile[qi])
+                if m_tile == float("-inf"):
+                    # Row fully masked in this tile: it contributes nothing
+                    exp_tile.append([0.0] * bk)
+                    rescales.append(1.0)
+                    inv_ls.append(0.0)
+                    continue
 
                 # Combined max: max of running max and this tile's max
                 #   m_new = max(m_old, m_tile)
@@ -278,29 +319,28 @@ def flash_attention(
                 l_old = row_sum[global_i]
                 l_new = l_old * old_scale + new_sum
 
-                # Update output accumulator:
-                #   O_i = O_i * (l_old * old_scale / l_new) + (1/l_new) * P_ij @ V_block
-                #
-                # The first term rescales previous output (correcting for the new max
-                # and reweighting by the updated denominator). The second term adds
-                # this tile's weighted contribution, already normalized.
-                if l_new > 0.0:
-                    # Rescale previous accumulator
-                    rescale = (l_old * old_scale) / l_new
-                    for c in range(d):
-                        output[global_i][c] *= rescale
-
-                    # Add new contribution: (1/l_new) * sum_ki(exp_scores[ki] * V[ki, c])
-                    inv_l = 1.0 / l_new
-                    for ki in range(bk):
-                        w = exp_scores[ki] * inv_l
-                        for c in range(d):
-                            output[global_i][c] += w * v_block[ki][c]
+                exp_tile.append(exp_scores)
+                rescales.append((l_old * old_scale) / l_new)
+                inv_ls.append(1.0 / l_new)
 
                 # Update running statistics
                 row_max[global_i] = m_new
                 row_sum[global_i] = l_new
 
+            # Step 3: Update output accumulators:
+            #   O_i = O_i * (l_old * old_scale / l_new) + (1/l_new) * P_ij @ V_block
+            #
+            # The first term rescales previous output (correcting for the new max
+            # and reweighting by the updated denominator). The second term adds
+            # this tile's weighted contribution, already normalized. P_ij @ V_block
+            # for the whole tile is a single [bq, bk] @ [bk, d] engine call.
+            pv_tile = matmul(exp_tile, v_block)
+            for qi in range(bq):
+                out_row = output[q_start + qi]
+                rescale, inv_l = rescales[qi], inv_ls[qi]
+                output[q_start + qi] = [o * rescale + p * inv_l
+                                        for o, p in zip(out_row, pv_tile[qi])]
+
     # No final normalization needed -- output is already correctly normalized at each
     # step because we divide by l (the running denominator) incrementally. This is
     # different from some presentations that defer normalization to the end; here
@@ -309,10 +349,51 @@ def flash_attention(
     return output, peak_memory
 
 
+# === VARIABLE-LENGTH (PACKED) BATCHES ===
+# A serving batch holds sequences of different lengths. Padding every sequence to
+# the longest one wastes (max_len^2 - len^2) score computations per sequence --
+# attention over padding that is then masked away. The varlen layout used by
+# FlashAttention's flash_attn_varlen_func instead concatenates the sequences into
+# one [total_tokens, d] tensor and passes cu_seqlens, the cumulative offsets:
+#
+#   lengths    = [3, 5, 2]
+#   cu_seqlens = [0, 3, 8, 10]   -- sequence b occupies rows cu_seqlens[b]:cu_seqlens[b+1]
+#
+# Tiles never straddle a sequence boundary, so no tile ever mixes tokens of two
+# sequences, and no padding token is ever computed.
+
+def make_cu_seqlens(seq_lens: list[int]) -> list[int]:
+    """Cumulative sequence offsets: [0, l0, l0+l1, ...]."""
+    cu = [0]
+    for length in seq_lens:
+        cu.append(cu[-1] + length)
+    return cu
+
+
+def flash_attention_varlen(
+    q: list[list[float]], k: list[list[float]], v: list[list[float]],
+    cu_seqlens: list[int], block_size: int, causal: bool = True,
+    stats: dict[str, int] | None = None,
+) -> tuple[list[list[float]], int]:
+    """Flash attention over a packed batch: each sequence attends only to itself.
+
+    q, k, v are [total_tokens, d] with sequence b in rows cu_seqlens[b]:cu_seqlens[b+1].
+    On GPU every (sequence, query block) pair is one thread block of a single launch;
+    here we loop over sequences. Returns (packed output, peak_memory_floats)."""
+    output: list[list[float]] = []
+    peak_memory = 0
+    for start, end in zip(cu_seqlens, cu_seqlens[1:]):
+        out_seq, mem = flash_attention(q[start:end], k[start:end], v[start:end],
+                                       block_size, causal, stats)
+        output.extend(out_seq)
+        peak_memory = max(peak_memory, mem)
+    return output, peak_memory
+
+
 # === VERIFICATION ===
 
 def verify(
-    n: int, d: int, block_size: int, tolerance: float = 1e-6
+    n: int, d: int, block_size: int, tolerance: float = 1e-6, causal: bool = False,
 ) -> tuple[bool, float, int, int]:
     """Run standard and flash attention on identical inputs, check outputs match.
 
@@ -321,8 +402,8 @@ def verify(
     k = rand_matrix(n, d)
     v = rand_matrix(n, d)
 
-    out_std, mem_std = standard_attention(q, k, v)
-    out_flash, mem_flash = flash_attention(q, k, v, block_size)
+    out_std, mem_std = standard_attention(q, k, v, causal)
+    out_flash, mem_flash = flash_attention(q, k, v, block_size, causal)
 
     diff = max_abs_diff(out_std, out_flash)
     passed = diff < tolerance
@@ -415,6 +496,81 @@ if __name__ == "__main__":
 
     print(f"\nOverall: {'all configurations passed' if all_passed else 'SOME CONFIGURATIONS FAILED'}")
 
+    # --- Causal Verification ---
+    # Same configs with the autoregressive mask. Flash skips future key blocks and
+    # masks only the diagonal tiles; standard computes all N*N scores, then masks.
+    print("\n--- Causal Verification ---")
+    causal_passed = True
+    for n, block_size in VERIFY_CONFIGS:
+        passed, diff, _, _ = verify(n, D_HEAD, block_size, causal=True)
+        n_blocks = math.ceil(n / block_size)
+        print(f"  N={n:>3}, block_size={block_size:>2}: max diff {diff:.2e}, "
+              f"tiles {n_blocks * (n_blocks + 1) // 2}/{n_blocks * n_blocks} "
+              f"{'PASS' if passed else 'FAIL'}")
+        causal_passed = causal_passed and passed
+    causal_verdict = 'all configurations passed' if causal_passed else 'SOME CONFIGURATIONS FAILED'
+    print(f"Causal: {causal_verdict}")
+
+    # --- Packed Variable-Length Batch ---
+    # One packed batch of unequal sequences, three ways. The padded baseline pads
+    # every sequence to the longest and attends over all of it -- what a dense
+    # [batch, max_len, d] kernel without masking support computes.
+    print("\n--- Packed Variable-Length Batch (causal, block skipping) ---")
+    cu_seqlens = make_cu_seqlens(VARLEN_SEQ_LENS)
+    total_tokens = cu_seqlens[-1]
+    max_len = max(VARLEN_SEQ_LENS)
+    print(f"Sequence lengths: {VARLEN_SEQ_LENS}")
+    print(f"cu_seqlens: {cu_seqlens}")
+    print(f"Packed tokens: {total_tokens}, padded tokens: {len(VARLEN_SEQ_LENS) * max_len}, "
+          f"block_size={VARLEN_BLOCK_SIZE}\n")
+    q_packed = rand_matrix(total_tokens, D_HEAD)
+    k_packed = rand_matrix(total_tokens, D_HEAD)
+    v_packed = rand_matrix(total_tokens, D_HEAD)
+
+    # Correctness: varlen causal output must equal per-sequence causal standard attention
+    out_varlen, _ = flash_attention_varlen(q_packed, k_packed, v_packed, cu_seqlens,
+                                           VARLEN_BLOCK_SIZE, causal=True)
+    varlen_diff = 0.0
+    for start, end in zip(cu_seqlens, cu_seqlens[1:]):
+        ref, _ = standard_attention(q_packed[start:end], k_packed[start:end],
+                                    v_packed[start:end], causal=True)
+        varlen_diff = max(varlen_diff, max_abs_diff(ref, out_varlen[start:end]))
+    print(f"Varlen causal vs per-sequence standard causal: max diff {varlen_diff:.2e} "
+          f"{'PASS' if varlen_diff < 1e-6 else 'FAIL'}\n")
+
+    def pad(mat: list[list[float]], start: int, end: int) -> list[list[float]]:
+        return mat[start:end] + [[0.0] * D_HEAD for _ in range(max_len - (end - start))]
+
+    def run_padded(stats: dict[str, int]) -> None:
+        for start, end in zip(cu_seqlens, cu_seqlens[1:]):
+            flash_attention(pad(q_packed, start, end), pad(k_packed, start, end),
+                            pad(v_packed, start, end), VARLEN_BLOCK_SIZE, False, stats)
+
+    runs = [
+        ("Padded, unmasked", run_padded),
+        ("Varlen, unmasked", lambda st: flash_attention_varlen(
+            q_packed, k_packed, v_packed, cu_seqlens, VARLEN_BLOCK_SIZE, False, st)),
+        ("Varlen, causal skip", lambda st: flash_attention_varlen(
+            q_packed, k_packed, v_packed, cu_seqlens, VARLEN_BLOCK_SIZE, True, st)),
+    ]
+    header = (f"{'Run':<22} {'Tiles':>7} {'FLOPs':>12} {'FLOPs saved':>12} "
+              f"{'Time (ms)':>10} {'Time saved':>11}")
+    print(header)
+    print("-" * len(header))
+    base_flops = base_time = 0.0
+    for name, fn in runs:
+        run_stats: dict[str, int] = {}
+        t0 = time.time()
+        fn(run_stats)
+        elapsed = time.time() - t0
+        if not base_flops:
+            base_flops, base_time = run_stats["flops"], elapsed
+        print(f"{name:<22} {run_stats['tiles']:>7} {run_stats['flops']:>12,} "
+              f"{1 - run_stats['flops'] / base_flops:>11.0%} {elapsed * 1000:>10.1f} "
+              f"{1 - elapsed / base_time:>10.0%}")
+    print("\nVarlen removes the padding work; causal skipping then removes the")
+    print("upper-triangle tiles. Only diagonal tiles pay for masked-out scores.")
+
     # --- Memory Comparison ---
     # This table is the core result: standard attention memory grows as O(N^2)
     # while flash attention memory stays at O(B^2) regardless of sequence length.
@@ -439,8 +595,9 @@ if __name__ == "__main__":
     print(f"fitting B~128 for d=128 in float16. Pure Python has no SRAM,")
     print(f"so block size affects only iteration count here.")
 
-    # Signpost: no runtime benchmark section. Flash Attention's speedup comes from
-    # GPU memory hierarchy (SRAM vs HBM), not from reducing FLOPs. In pure Python,
-    # interpreter overhead per operation dominates, making flash SLOWER than standard.
-    # On GPU, Flash Attention is 2-4x faster because it reduces HBM reads from O(N^2)
-    # to O(N). The memory comparison tables above are the meaningful result here.
+    # Signpost: no standard-vs-flash runtime benchmark. Flash Attention's own speedup
+    # comes from GPU memory hierarchy (SRAM vs HBM), not from reducing FLOPs. In pure
+    # Python, interpreter overhead per operation dominates, making flash SLOWER than
+    # standard. On GPU, Flash Attention is 2-4x faster because it reduces HBM reads
+    # from O(N^2) to O(N). The varlen table is the exception: skipped tiles are work
+    # never done, so its time savings carry over to any hardware.
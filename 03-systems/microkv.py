@@ -51,6 +51,26 @@ NUM_STEPS = 300
 GEN_LEN = 16  # characters to generate for the comparison
 PAGE_BLOCK_SIZE = 4  # positions per block in paged attention simulation
 
+# Chunked prefill serving: each step runs at most TOKEN_BUDGET tokens, decodes first,
+# then prompt chunks of up to CHUNK_SIZE tokens per request fill the rest.
+CHUNK_SIZE = 8
+TOKEN_BUDGET = 16
+CHUNK_SIZES = [1, 4, 8, 16]  # 1 = token-by-token prefill
+SERVE_NUM_REQUESTS = 24
+SERVE_ARRIVAL_RATE = 200.0   # Poisson arrivals, requests per second of server time
+SERVE_PROMPT_LEN = (12, 24)  # prompt + generation must fit in BLOCK_SIZE positions
+SERVE_GEN_LEN = (4, 8)
+
+# Bounded cache policies: teacher-forced perplexity on held-out names, and a long
+# paged run showing memory stays flat once the window is full
+EVAL_NUM_SEQS = 20
+LONG_SEQ_LEN = 64
+
+# Quantized KV cache: storage scheme per cached K/V vector, and how many values
+# share one scale -- the whole vector ("token") or one head's slice ("head")
+KV_QUANT_SCHEMES = ["int8", "int8-zp", "int4"]
+KV_SCALE_GRANULARITIES = ["token", "head"]
+
 # Data
 DATA_URL = "https://raw.githubusercontent.com/karpathy/makemore/master/names.txt"
 DATA_FILE = "names.txt"
@@ -224,6 +244,119 @@ def rmsnorm_f(x: list[float]) -> list[float]:
     return [xi * scale for xi in x]
 
 
+# === QUANTIZED KV STORAGE ===
+# The cache holds every past K and V vector as N_EMBD floats -- and as Python lists,
+# each float is a separate 24-byte object. Quantizing them to int8 (or int4, packed two
+# per byte) shrinks each cached position to N_EMBD bytes (N_EMBD / 2) plus its scales,
+# and attention dequantizes the rows it reads on the fly.
+#
+# K/V are activations, not weights: every token has its own range, and a few heads
+# carry outliers. So scales are per token (one per vector) or per head (one per
+# HEAD_DIM slice) -- finer scales cost 4 bytes each but shrink the rounding error.
+#
+# The quantizers below are copied from microquant.py (each script is standalone);
+# a K/V slice is passed as a one-row matrix.
+
+def quantize_absmax_int8(weights_float: list[list[float]]) -> tuple[list[list[int]], float]:
+    """Absmax quantization: scale = max(|W|) / 127, q = round(W / scale)."""
+    max_abs = max(abs(w) for row in weights_float for w in row)
+    if max_abs == 0:
+        return [[0] * len(row) for row in weights_float], 1.0
+    scale = max_abs / 127.0
+    quantized = [[max(-127, min(127, round(w / scale))) for w in row] for row in weights_float]
+    return quantized, scale
+
+
+def quantize_absmax_int4(weights_float: list[list[float]]) -> tuple[list[list[int]], float]:
+    """INT4 quantization: maps to [-8, +7] (4-bit signed integer range)."""
+    max_abs = max(abs(w) for row in weights_float for w in row)
+    if max_abs == 0:
+        return [[0] * len(row) for row in weights_float], 1.0
+    scale = max_abs / 7.0
+    quantized = [[max(-8, min(7, round(w / scale))) for w in row] for row in weights_float]
+    return quantized, scale
+
+
+def quantize_zeropoint_int8(
+    weights_float: list[list[float]],
+) -> tuple[list[list[int]], float, int]:
+    """Zero-point (asymmetric) quantization: maps [min_W, max_W] to [0, 255]."""
+    all_weights = [w for row in weights_float for w in row]
+    w_min = min(all_weights)
+    w_max = max(all_weights)
+    if w_max == w_min:
+        return [[0] * len(row) for row in weights_float], 1.0, 0
+    scale = (w_max - w_min) / 255.0
+    zero_point = round(-w_min / scale)
+    quantized = [
+        [max(0, min(255, round(w / scale) + zero_point)) for w in row]
+        for row in weights_float
+    ]
+    return quantized, scale, zero_point
+
+
+def dequantize_absmax(quantized: list[list[int]], scale: float) -> list[list[float]]:
+    """w_hat = q * scale. Simple multiplication recovers approximate floats."""
+    return [[q * scale for q in row] for row in quantized]
+
+
+def dequantize_zeropoint(
+    quantized: list[list[int]], scale: float, zero_point: int,
+) -> list[list[float]]:
+    """w_hat = (q - zero_point) * scale. Undo the asymmetric shift."""
+    return [[(q - zero_point) * scale for q in row] for row in quantized]
+
+
+def quantize_kv(vec: list[float], kv_quant: str, granularity: str) -> dict:
+    """Quantize one cached K or V vector. Codes are stored as raw bytes: int8 as
+    two's complement, zero-point int8 unsigned, int4 as (q + 8) nibbles, two per byte."""
+    group = HEAD_DIM if granularity == "head" else len(vec)
+    codes: list[int] = []
+    scales: list[float] = []
+    zeros: list[int] = []
+    for g in range(0, len(vec), group):
+        if kv_quant == "int8-zp":
+            (q,), scale, zero = quantize_zeropoint_int8([vec[g:g + group]])
+            zeros.append(zero)
+        elif kv_quant == "int4":
+            (q,), scale = quantize_absmax_int4([vec[g:g + group]])
+        else:
+            (q,), scale = quantize_absmax_int8([vec[g:g + group]])
+        codes.extend(q)
+        scales.append(scale)
+    if kv_quant == "int4":
+        packed = bytes((codes[i] + 8) | (codes[i + 1] + 8) << 4 for i in range(0, len(codes), 2))
+    else:
+        packed = bytes(c & 0xFF for c in codes)
+    return {'codes': packed, 'scales': scales, 'zeros': zeros}
+
+
+def read_kv_head(entry: list[float] | dict, hs: int, kv_quant: str | None) -> list[float]:
+    """The HEAD_DIM values of one cached vector starting at hs, dequantized if needed.
+    Only the slice attention is about to use gets decoded."""
+    if kv_quant is None:
+        return entry[hs:hs + HEAD_DIM]
+    group = len(entry['codes']) * (2 if kv_quant == "int4" else 1) // len(entry['scales'])
+    scale = entry['scales'][hs // group]
+    if kv_quant == "int4":
+        raw = entry['codes'][hs // 2:(hs + HEAD_DIM) // 2]
+        q = [n - 8 for b in raw for n in (b & 0x0F, b >> 4)]
+        return dequantize_absmax([q], scale)[0]
+    if kv_quant == "int8-zp":
+        q = list(entry['codes'][hs:hs + HEAD_DIM])
+        return dequantize_zeropoint([q], scale, entry['zeros'][hs // group])[0]
+    q = memoryview(entry['codes'][hs:hs + HEAD_DIM]).cast('b').tolist()
+    return dequantize_absmax([q], scale)[0]
+
+
+def kv_entry_bytes(entry: list[float] | dict) -> int:
+    """Bytes one cached vector occupies: float32 values, or codes + float32 scales
+    + one byte per zero point."""
+    if isinstance(entry, list):
+        return 4 * len(entry)
+    return len(entry['codes']) + 4 * len(entry['scales']) + len(entry['zeros'])
+
+
 # === INFERENCE WITHOUT KV CACHE ===
 # At each generation step, recompute Q/K/V projections for ALL positions from scratch.
 # This is how attention would work if we treated every step as independent: feed the
@@ -315,85 +448,450 @@ def generate_no_cache(
 # The insight: K and V projections for past tokens never change in autoregressive decoding.
 # Recomputing them is pure waste — the KV cache is memoization of linear projections.
 
+# Even with the cache, memory grows by one entry per generated token. A cache policy
+# bounds it: after every append the decoder asks the policy which positions to keep
+# and evicts the rest, trading attention over distant context for constant memory.
+# A window policy is the decode-time form of sliding_window_attention in
+# microattention.py: same attention pattern, but evicted K/V is actually freed.
+
+class CachePolicy:
+    """Which cached positions the decoder keeps after each append: all of them (full),
+    the last `window` (sliding window), or the first `sinks` plus the last `window`.
+
+    Sinks come from StreamingLLM (Xiao et al., 2023): softmax needs somewhere to put
+    attention mass that no recent token claims, and models learn to dump it on the
+    first tokens. Evicting those tokens shifts that mass onto real ones and degrades
+    the output far more than their share of the context suggests."""
+
+    def __init__(self, window: int | None = None, sinks: int = 0) -> None:
+        self.window = window
+        self.sinks = sinks
+
+    def keep(self, pos: int, length: int) -> bool:
+        """Is position pos still attended to once the sequence has `length` tokens?"""
+        return self.window is None or pos < self.sinks or pos >= length - self.window
+
+    def __str__(self) -> str:
+        if self.window is None:
+            return "full"
+        if self.sinks:
+            return f"{self.sinks} sink + win {self.window}"
+        return f"window {self.window}"
+
+
+def apply_cache_policy(
+    layer_cache: dict[str, list], policy: CachePolicy, length: int, page_size: int | None,
+) -> None:
+    """Evict what policy no longer keeps. Without pages every evicted position goes
+    at once; with pages a page goes only when none of its positions is kept, so a
+    position can linger (masked out of attention) until its page frees as a whole."""
+    positions = layer_cache['pos']
+    if page_size is None:
+        drop = [not policy.keep(p, length) for p in positions]
+    else:
+        drop = [not any(policy.keep(q, length)
+                        for q in range(p - p % page_size, p - p % page_size + page_size))
+                for p in positions]
+    if any(drop):
+        for key in ('k', 'v', 'pos'):
+            layer_cache[key] = [e for e, d in zip(layer_cache[key], drop) if not d]
+
+
+def cache_memory(
+    kv_cache: list[dict[str, list]], kv_quant: str | None, page_size: int | None,
+) -> int:
+    """Cache footprint: floats (float cache) or bytes (quantized), counting whole
+    pages -- partially filled or not -- when paged."""
+    if page_size is not None:
+        pages = len({p // page_size for p in kv_cache[0]['pos']})
+        per_pos = (kv_entry_bytes(kv_cache[0]['k'][0]) if kv_quant else N_EMBD)
+        return 2 * N_LAYER * per_pos * pages * page_size
+    if kv_quant is None:
+        return 2 * N_LAYER * N_EMBD * len(kv_cache[0]['k'])
+    return sum(kv_entry_bytes(e) for layer in kv_cache for e in layer['k'] + layer['v'])
+
+
+def decode_step(
+    token: int, pos: int, wf: dict[str, list[list[float]]],
+    kv_cache: list[dict[str, list]], counter: list[int],
+    kv_quant: str | None = None, granularity: str = "head",
+    policy: CachePolicy | None = None, page_size: int | None = None,
+) -> list[float]:
+    """One cached forward pass for the token at pos. Returns logits."""
+    # Embed only the NEW token — previous embeddings don't need recomputation
+    x = [wf['wte'][token][j] + wf['wpe'][pos][j] for j in range(N_EMBD)]
+    x = rmsnorm_f(x)
+
+    for li in range(N_LAYER):
+        x_res = x[:]
+        x = rmsnorm_f(x)
+
+        # Project ONLY the new token — this is where the cache saves work.
+        # Without cache: project all t tokens. With cache: project 1 token.
+        q = linear_f(x, wf[f'l{li}.wq'], counter)
+        k = linear_f(x, wf[f'l{li}.wk'], counter)
+        v = linear_f(x, wf[f'l{li}.wv'], counter)
+
+        # Append new K, V to cache (the cache grows by one entry per step),
+        # then let the policy evict what has left its window
+        layer_cache = kv_cache[li]
+        if kv_quant is None:
+            layer_cache['k'].append(k)
+            layer_cache['v'].append(v)
+        else:
+            layer_cache['k'].append(quantize_kv(k, kv_quant, granularity))
+            layer_cache['v'].append(quantize_kv(v, kv_quant, granularity))
+        layer_cache['pos'].append(pos)
+        visible = range(len(layer_cache['k']))
+        if policy is not None:
+            apply_cache_policy(layer_cache, policy, pos + 1, page_size)
+            visible = [t for t, p in enumerate(layer_cache['pos']) if policy.keep(p, pos + 1)]
+
+        # Attention: Q from new token attends to ALL cached K/V (that the policy keeps)
+        head_cat: list[float] = []
+        for h in range(N_HEAD):
+            hs = h * HEAD_DIM
+            q_h = q[hs:hs + HEAD_DIM]
+            scores: list[float] = []
+            for t in visible:
+                k_h = read_kv_head(layer_cache['k'][t], hs, kv_quant)
+                dot = sum(q_h[j] * k_h[j] for j in range(HEAD_DIM))
+                counter[0] += HEAD_DIM
+                scores.append(dot / (HEAD_DIM ** 0.5))
+            weights = softmax_f(scores)
+            v_h = [read_kv_head(layer_cache['v'][t], hs, kv_quant) for t in visible]
+            for j in range(HEAD_DIM):
+                val = 0.0
+                for w, v_t in zip(weights, v_h):
+                    val += w * v_t[j]
+                    counter[0] += 1
+                head_cat.append(val)
+
+        x = linear_f(head_cat, wf[f'l{li}.wo'], counter)
+        x = [a + b for a, b in zip(x, x_res)]
+        x_res = x[:]
+        x = rmsnorm_f(x)
+        x = linear_f(x, wf[f'l{li}.fc1'], counter)
+        x = [max(0.0, v) for v in x]
+        x = linear_f(x, wf[f'l{li}.fc2'], counter)
+        x = [a + b for a, b in zip(x, x_res)]
+
+    return linear_f(x, wf['lm_head'], counter)
+
+
 def generate_with_cache(
     prompt_tok: int, wf: dict[str, list[list[float]]],
     vocab_size: int, gen_len: int,
+    kv_quant: str | None = None, granularity: str = "head",
+    policy: CachePolicy | None = None, page_size: int | None = None,
 ) -> tuple[list[int], list[int], list[int]]:
-    """Generate tokens WITH KV cache. Returns (tokens, muls_per_step, cache_sizes)."""
+    """Generate tokens WITH KV cache. Returns (tokens, muls_per_step, cache_sizes).
+    kv_quant (one of KV_QUANT_SCHEMES) stores the cache quantized; cache_sizes then
+    counts bytes instead of floats. policy bounds the cache; with page_size it is
+    freed a whole page at a time."""
     tokens: list[int] = []
     muls_per_step: list[int] = []
     cache_sizes: list[int] = []
 
     # KV cache: stores projected K and V vectors for each layer and position.
-    # Shape: kv_cache[layer] = {'k': list of vectors, 'v': list of vectors}
-    kv_cache: list[dict[str, list[list[float]]]] = [
-        {'k': [], 'v': []} for _ in range(N_LAYER)
+    # Shape: kv_cache[layer] = {'k': list of vectors, 'v': list of vectors,
+    #                           'pos': position of each entry (eviction leaves gaps)}
+    kv_cache: list[dict[str, list]] = [
+        {'k': [], 'v': [], 'pos': []} for _ in range(N_LAYER)
     ]
 
     current_tok = prompt_tok
     for step in range(gen_len):
         counter = [0]
-        pos = step
+        logits = decode_step(current_tok, step, wf, kv_cache, counter,
+                             kv_quant, granularity, policy, page_size)
+        probs = softmax_f(logits)
+        next_tok = max(range(vocab_size), key=lambda i: probs[i])
+        tokens.append(next_tok)
+        current_tok = next_tok
+        muls_per_step.append(counter[0])
 
-        # Embed only the NEW token — previous embeddings don't need recomputation
-        x = [wf['wte'][current_tok][j] + wf['wpe'][pos][j] for j in range(N_EMBD)]
-        x = rmsnorm_f(x)
+        # Cache memory: 2 (K+V) * n_layer * n_embd floats per cached position
+        cache_sizes.append(cache_memory(kv_cache, kv_quant, page_size))
 
-        for li in range(N_LAYER):
-            x_res = x[:]
-            x = rmsnorm_f(x)
+    return tokens, muls_per_step, cache_sizes
 
-            # Project ONLY the new token — this is where the cache saves work.
-            # Without cache: project all t tokens. With cache: project 1 token.
-            q = linear_f(x, wf[f'l{li}.wq'], counter)
-            k = linear_f(x, wf[f'l{li}.wk'], counter)
-            v = linear_f(x, wf[f'l{li}.wv'], counter)
 
-            # Append new K, V to cache (the cache grows by one entry per step)
-            kv_cache[li]['k'].append(k)
-            kv_cache[li]['v'].append(v)
+# === CHUNKED PREFILL ===
+# generate_with_cache feeds its input one token per forward pass. That is the only
+# option for generated tokens (each depends on the previous one), but every prompt
+# token is known up front. Chunked prefill (Agrawal et al., "SARATHI", 2023) runs C
+# prompt tokens through the model at once: the C x N_EMBD chunk is projected with one
+# matrix multiply per weight, all C keys/values are written to the cache in one go,
+# and query i of the chunk attends causally to the cache plus chunk positions <= i.
+# Only the last position needs logits, so C-1 lm_head projections are skipped too.
+#
+# The arithmetic per position is exactly that of generate_with_cache -- same products,
+# summed in the same order -- so chunked and token-by-token generation agree exactly.
+
+def matmul_f(xs: list[list[float]], w: list[list[float]], counter: list[int]) -> list[list[float]]:
+    """Project a whole chunk at once: xs @ w^T. Counts every scalar multiply."""
+    counter[0] += len(xs) * len(w) * len(xs[0])
+    return [[sum(wi * xj for wi, xj in zip(row, x)) for row in w] for x in xs]
+
+
+def forward_chunk(
+    chunk: list[int], start_pos: int, wf: dict[str, list[list[float]]],
+    kv_cache: list[dict[str, list[list[float]]]], counter: list[int],
+) -> list[float]:
+    """Run chunk (positions start_pos..start_pos+C-1) through the model, appending its
+    K/V to kv_cache. Returns the logits of the chunk's last position."""
+    xs = [rmsnorm_f([wf['wte'][tok][j] + wf['wpe'][start_pos + i][j] for j in range(N_EMBD)])
+          for i, tok in enumerate(chunk)]
 
-            # Attention: Q from new token attends to ALL cached K/V
+    for li in range(N_LAYER):
+        residuals = xs
+        normed = [rmsnorm_f(x) for x in xs]
+        qs = matmul_f(normed, wf[f'l{li}.wq'], counter)
+        ks = matmul_f(normed, wf[f'l{li}.wk'], counter)
+        vs = matmul_f(normed, wf[f'l{li}.wv'], counter)
+
+        # Write the whole chunk's K/V before attending: causality comes from limiting
+        # each query to the positions before it, not from the write order
+        cache_k = kv_cache[li]['k']
+        cache_v = kv_cache[li]['v']
+        cache_k.extend(ks)
+        cache_v.extend(vs)
+
+        attn_out: list[list[float]] = []
+        for i, q in enumerate(qs):
+            visible = start_pos + i + 1
             head_cat: list[float] = []
-            cached_len = len(kv_cache[li]['k'])
             for h in range(N_HEAD):
                 hs = h * HEAD_DIM
                 q_h = q[hs:hs + HEAD_DIM]
-                scores: list[float] = []
-                for t in range(cached_len):
-                    k_h = kv_cache[li]['k'][t][hs:hs + HEAD_DIM]
-                    dot = sum(q_h[j] * k_h[j] for j in range(HEAD_DIM))
-                    counter[0] += HEAD_DIM
-                    scores.append(dot / (HEAD_DIM ** 0.5))
+                scores = [sum(q_h[j] * cache_k[t][hs + j] for j in range(HEAD_DIM))
+                          / (HEAD_DIM ** 0.5) for t in range(visible)]
+                counter[0] += HEAD_DIM * visible
                 weights = softmax_f(scores)
                 for j in range(HEAD_DIM):
                     val = 0.0
-                    for t in range(cached_len):
-                        val += weights[t] * kv_cache[li]['v'][t][hs + j]
-                        counter[0] += 1
+                    for t in range(visible):
+                        val += weights[t] * cache_v[t][hs + j]
                     head_cat.append(val)
-
-            x = linear_f(head_cat, wf[f'l{li}.wo'], counter)
-            x = [a + b for a, b in zip(x, x_res)]
-            x_res = x[:]
-            x = rmsnorm_f(x)
-            x = linear_f(x, wf[f'l{li}.fc1'], counter)
-            x = [max(0.0, v) for v in x]
-            x = linear_f(x, wf[f'l{li}.fc2'], counter)
-            x = [a + b for a, b in zip(x, x_res)]
-
-        logits = linear_f(x, wf['lm_head'], counter)
-        probs = softmax_f(logits)
-        next_tok = max(range(vocab_size), key=lambda i: probs[i])
-        tokens.append(next_tok)
-        current_tok = next_tok
-        muls_per_step.append(counter[0])
-
-        # Cache memory: 2 (K+V) * n_layer * n_embd floats per cached position
-        total_cached_floats = 2 * N_LAYER * N_EMBD * len(kv_cache[0]['k'])
-        cache_sizes.append(total_cached_floats)
-
-    return tokens, muls_per_step, cache_sizes
+                counter[0] += HEAD_DIM * visible
+            attn_out.append(head_cat)
+
+        xs = [[a + b for a, b in zip(proj, res)]
+              for proj, res in zip(matmul_f(attn_out, wf[f'l{li}.wo'], counter), residuals)]
+        residuals = xs
+        hidden = matmul_f([rmsnorm_f(x) for x in xs], wf[f'l{li}.fc1'], counter)
+        hidden = [[max(0.0, v) for v in row] for row in hidden]
+        xs = [[a + b for a, b in zip(proj, res)]
+              for proj, res in zip(matmul_f(hidden, wf[f'l{li}.fc2'], counter), residuals)]
+
+    return linear_f(xs[-1], wf['lm_head'], counter)
+
+
+def generate_chunked(
+    prompt: list[int], wf: dict[str, list[list[float]]],
+    vocab_size: int, gen_len: int, chunk_size: int,
+) -> list[int]:
+    """Greedy generation: prefill prompt in chunks of chunk_size, then decode."""
+    kv_cache: list[dict[str, list[list[float]]]] = [{'k': [], 'v': []} for _ in range(N_LAYER)]
+    counter = [0]
+    for start in range(0, len(prompt), chunk_size):
+        logits = forward_chunk(prompt[start:start + chunk_size], start, wf, kv_cache, counter)
+    tokens: list[int] = []
+    for step in range(gen_len):
+        tokens.append(max(range(vocab_size), key=lambda i: logits[i]))
+        if step < gen_len - 1:
+            logits = forward_chunk(tokens[-1:], len(prompt) + step, wf, kv_cache, counter)
+    return tokens
+
+
+# === MIXED PREFILL + DECODE SCHEDULING ===
+# A server step has a token budget. Decodes go first -- one token each, so running
+# requests never stall behind a long prompt -- and the leftover budget is filled with
+# prompt chunks from requests still prefilling, oldest first. With chunk size 1 this is
+# token-by-token prefill: a P-token prompt needs P steps before its first output token.
+#
+# Time is simulated as in micropaged.py: Poisson arrivals, a clock advanced by each
+# step's measured CPU time. TTFT = first generated token - arrival.
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile: the smallest value with >= pct% of values at or below."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def serve_mixed(
+    trace: list[dict], wf: dict[str, list[list[float]]], vocab_size: int,
+    chunk_size: int, token_budget: int,
+) -> dict[str, float]:
+    """Serve the trace with chunked prefill mixed into decode steps; return metrics."""
+    requests = [dict(req, cache=[{'k': [], 'v': []} for _ in range(N_LAYER)],
+                     pos=0, output=[], first_token=None) for req in trace]
+    pending = list(requests)
+    active: list[dict] = []
+    clock = 0.0
+    steps = 0
+
+    while pending or active:
+        while pending and pending[0]["arrival"] <= clock:
+            active.append(pending.pop(0))
+        if not active:
+            clock = pending[0]["arrival"]  # idle: jump to the next arrival
+            continue
+
+        step_start = time.process_time()
+        budget = token_budget
+        # Decodes are admitted first (one token each) but never past the budget; the
+        # rest wait for the next step. Served decodes rotate to the back of the active
+        # list, so with more decodes than budget every request still advances in turn.
+        decoding = [r for r in active if r["pos"] >= len(r["prompt"])][:budget]
+        prefilling = [r for r in active if r["pos"] < len(r["prompt"])]
+        produced: list[tuple[dict, list[float]]] = []
+        for req in decoding:
+            logits = forward_chunk(req["output"][-1:], req["pos"], wf, req["cache"], [0])
+            req["pos"] += 1
+            produced.append((req, logits))
+            budget -= 1
+        for req in prefilling:
+            n = min(chunk_size, len(req["prompt"]) - req["pos"], budget)
+            if n <= 0:
+                break
+            logits = forward_chunk(req["prompt"][req["pos"]:req["pos"] + n], req["pos"],
+                                   wf, req["cache"], [0])
+            req["pos"] += n
+            budget -= n
+            if req["pos"] == len(req["prompt"]):  # prompt done: its logits give token 1
+                produced.append((req, logits))
+        assert budget >= 0, "a step must never exceed its token budget"
+        for req in decoding:
+            active.remove(req)
+            active.append(req)
+        clock += time.process_time() - step_start
+        steps += 1
+
+        for req, logits in produced:
+            req["output"].append(max(range(vocab_size), key=lambda i: logits[i]))
+            if req["first_token"] is None:
+                req["first_token"] = clock
+            if len(req["output"]) == req["gen_len"]:
+                req["finish"] = clock
+                active.remove(req)
+
+    ttfts = [r["first_token"] - r["arrival"] for r in requests]
+    processed = sum(len(r["prompt"]) + r["gen_len"] - 1 for r in requests)
+    makespan = max(r["finish"] for r in requests) - trace[0]["arrival"]
+    return {
+        "tokens_per_sec": processed / makespan,
+        "ttft_p50": percentile(ttfts, 50), "ttft_p99": percentile(ttfts, 99),
+        "steps": steps, "outputs": [r["output"] for r in requests],
+    }
+
+
+def make_serving_trace(docs: list[str], chars: list[str], bos: int) -> list[dict]:
+    """Poisson arrivals; each prompt is a run of BOS-separated names from docs."""
+    trace = []
+    clock = 0.0
+    for i in range(SERVE_NUM_REQUESTS):
+        clock += random.expovariate(SERVE_ARRIVAL_RATE)
+        prompt = [bos]
+        target = random.randint(*SERVE_PROMPT_LEN)
+        while len(prompt) < target:
+            prompt += [chars.index(ch) for ch in random.choice(docs)] + [bos]
+        trace.append({"rid": i, "arrival": clock, "prompt": prompt[:target],
+                      "gen_len": random.randint(*SERVE_GEN_LEN)})
+    return trace
+
+
+# === QUANTIZED KV EVALUATION ===
+# Attention error is measured teacher-forced: the float and quantized caches see the
+# same tokens, so the difference isolates storage precision from generation drift.
+# With one layer, the query/key/value of every position follow from its token alone.
+
+def kv_quant_attention_error(
+    tokens: list[int], wf: dict[str, list[list[float]]], kv_quant: str, granularity: str,
+) -> float:
+    """Max |attention output (float cache) - attention output (quantized cache)| over
+    every position and head of tokens."""
+    cache_f: dict[str, list] = {'k': [], 'v': []}
+    cache_q: dict[str, list] = {'k': [], 'v': []}
+    counter = [0]
+    worst = 0.0
+    for pos, tok in enumerate(tokens):
+        x = rmsnorm_f(rmsnorm_f([wf['wte'][tok][j] + wf['wpe'][pos][j] for j in range(N_EMBD)]))
+        q = linear_f(x, wf['l0.wq'], counter)
+        k = linear_f(x, wf['l0.wk'], counter)
+        v = linear_f(x, wf['l0.wv'], counter)
+        cache_f['k'].append(k)
+        cache_f['v'].append(v)
+        cache_q['k'].append(quantize_kv(k, kv_quant, granularity))
+        cache_q['v'].append(quantize_kv(v, kv_quant, granularity))
+        for hs in range(0, N_EMBD, HEAD_DIM):
+            outs = []
+            for cache, scheme in [(cache_f, None), (cache_q, kv_quant)]:
+                weights = softmax_f([
+                    sum(a * b for a, b in zip(q[hs:hs + HEAD_DIM], read_kv_head(kt, hs, scheme)))
+                    / (HEAD_DIM ** 0.5) for kt in cache['k']])
+                vals = [read_kv_head(vt, hs, scheme) for vt in cache['v']]
+                outs.append([sum(w * vt[j] for w, vt in zip(weights, vals))
+                             for j in range(HEAD_DIM)])
+            worst = max(worst, max(abs(a - b) for a, b in zip(*outs)))
+    return worst
+
+
+# === BOUNDED CACHE EVALUATION ===
+# Perplexity is measured teacher-forced on held-out text packed into BLOCK_SIZE-token
+# sequences of BOS-separated names, so every policy scores the same predictions.
+# Memory is the peak cache size a single sequence reaches.
+
+def evaluate_with_policy(
+    seqs: list[list[int]], wf: dict[str, list[list[float]]],
+    policy: CachePolicy, page_size: int | None = None,
+) -> tuple[float, int]:
+    """Returns (perplexity, peak cache floats per sequence) under policy."""
+    nll = 0.0
+    count = 0
+    peak = 0
+    for seq in seqs:
+        kv_cache: list[dict[str, list]] = [{'k': [], 'v': [], 'pos': []} for _ in range(N_LAYER)]
+        for pos in range(len(seq) - 1):
+            logits = decode_step(seq[pos], pos, wf, kv_cache, [0],
+                                 policy=policy, page_size=page_size)
+            nll -= math.log(max(softmax_f(logits)[seq[pos + 1]], 1e-10))
+            count += 1
+            peak = max(peak, cache_memory(kv_cache, None, page_size))
+    return math.exp(nll / count), peak
+
+
+def simulate_windowed_paging(seq_len: int, block_size: int, policy: CachePolicy) -> None:
+    """Page allocation under a bounded policy over an arbitrarily long sequence.
+    The decoder itself stops at BLOCK_SIZE (learned position table); allocation only
+    needs positions, so this runs past it to show that memory stops growing."""
+    free_list = list(range(seq_len))  # more physical blocks than could ever be needed
+    free_list.reverse()
+    page_table: dict[int, int] = {}   # logical block -> physical block, resident only
+    resident_trace: list[int] = []
+    events: list[str] = []
+    for pos in range(seq_len):
+        logical = pos // block_size
+        if logical not in page_table:
+            page_table[logical] = free_list.pop()
+        for lb in list(page_table):
+            if not any(policy.keep(p, pos + 1)
+                       for p in range(lb * block_size, (lb + 1) * block_size)):
+                free_list.append(page_table.pop(lb))
+                events.append(f"pos {pos}: free logical {lb}")
+        resident_trace.append(len(page_table))
+
+    print(f"\nPolicy {policy}, block size {block_size}, {seq_len} positions:")
+    for e in events[:4]:
+        print(f"  {e}")
+    if len(events) > 4:
+        print(f"  ... {len(events) - 4} more frees")
+    print(f"  Resident pages every {block_size * 2} positions: "
+          f"{resident_trace[block_size * 2 - 1::block_size * 2]}")
+    print(f"  Peak {max(resident_trace)} pages vs {math.ceil(seq_len / block_size)} "
+          f"with a full cache")
 
 
 # === PAGED ATTENTION SIMULATION ===
@@ -574,3 +1072,86 @@ if __name__ == "__main__":
 
     # -- Paged attention --
     simulate_paged_attention(GEN_LEN, PAGE_BLOCK_SIZE)
+
+    # -- Chunked prefill --
+    # Chunking changes how many positions one forward pass covers, not the math:
+    # every chunk size must reproduce token-by-token generation exactly.
+    print(f"\n=== Chunked Prefill ===")
+    toks_chunked = generate_chunked([prompt_tok], wf, VOCAB_SIZE, GEN_LEN, CHUNK_SIZE)
+    assert toks_chunked == toks_cached, "chunked path diverged from generate_with_cache"
+    trace = make_serving_trace(docs, unique_chars, BOS)
+    long_prompt = trace[0]["prompt"]
+    reference = generate_chunked(long_prompt, wf, VOCAB_SIZE, 4, 1)
+    for c in CHUNK_SIZES:
+        assert generate_chunked(long_prompt, wf, VOCAB_SIZE, 4, c) == reference
+    print(f"Outputs identical for chunk sizes {CHUNK_SIZES} "
+          f"(prompt of {len(long_prompt)} tokens)")
+
+    print(f"\nServing {SERVE_NUM_REQUESTS} requests (prompts {SERVE_PROMPT_LEN[0]}-"
+          f"{SERVE_PROMPT_LEN[1]} tokens, Poisson {SERVE_ARRIVAL_RATE:.0f} req/s), "
+          f"budget {TOKEN_BUDGET} tokens/step, decodes first\n")
+    print(f"{'Chunk':>5}  {'tok/s':>8}  {'TTFT p50':>9}  {'TTFT p99':>9}  {'Steps':>6}")
+    print("-" * 45)
+    results = {c: serve_mixed(trace, wf, VOCAB_SIZE, c, TOKEN_BUDGET) for c in CHUNK_SIZES}
+    for c, m in results.items():
+        assert m["outputs"] == results[1]["outputs"]
+        label = "1*" if c == 1 else str(c)
+        print(f"{label:>5}  {m['tokens_per_sec']:>8.0f}  {m['ttft_p50'] * 1000:>7.1f}ms  "
+              f"{m['ttft_p99'] * 1000:>7.1f}ms  {m['steps']:>6}")
+    print(f"* token-by-token prefill. Bigger chunks finish prompts in fewer steps (TTFT)")
+    print(f"and skip per-token overhead and lm_head work on prompt positions (tok/s).")
+
+    # -- Quantized KV cache --
+    # Memory per token counts K and V for every layer; the float baseline is float32
+    # (the Python lists above are far larger still). "Seqs" is how many sequences of
+    # BLOCK_SIZE tokens fit in the memory the float32 cache needs for 64 of them.
+    print(f"\n=== Quantized KV Cache ===")
+    eval_tokens = long_prompt + generate_chunked(long_prompt, wf, VOCAB_SIZE, 8, CHUNK_SIZE)
+    float_bytes = 2 * N_LAYER * N_EMBD * 4
+    budget = 64 * BLOCK_SIZE * float_bytes
+    print(f"Attention error teacher-forced over {len(eval_tokens)} positions; "
+          f"generation from BOS ({GEN_LEN} tokens)\n")
+    print(f"{'Scheme':<8} {'Scales':<6} {'B/token':>8} {'Ratio':>6} {'Max attn err':>13} "
+          f"{'Seqs':>5} {'Same output':>12}")
+    print("-" * 64)
+    print(f"{'float32':<8} {'-':<6} {float_bytes:>8} {1.0:>5.1f}x {0.0:>13.2e} "
+          f"{budget // (BLOCK_SIZE * float_bytes):>5} {'yes':>12}")
+    for scheme in KV_QUANT_SCHEMES:
+        for granularity in KV_SCALE_GRANULARITIES:
+            toks_q, _, sizes_q = generate_with_cache(prompt_tok, wf, VOCAB_SIZE, GEN_LEN,
+                                                     kv_quant=scheme, granularity=granularity)
+            per_token = sizes_q[-1] // GEN_LEN
+            err = kv_quant_attention_error(eval_tokens, wf, scheme, granularity)
+            same = "yes" if toks_q == toks_cached else "no"
+            print(f"{scheme:<8} {granularity:<6} {per_token:>8} "
+                  f"{float_bytes / per_token:>5.1f}x {err:>13.2e} "
+                  f"{budget // (BLOCK_SIZE * per_token):>5} {same:>12}")
+    print(f"\nPer-head scales cost {4 * (N_HEAD - 1)} bytes more per vector than one scale")
+    print(f"per token but track each head's range. At real head counts (32+ heads of")
+    print(f"128 dims) scales add ~3% to int8 and ~6% to int4 storage.")
+
+    # -- Bounded cache policies --
+    # Training saw docs[:NUM_STEPS]; evaluate on names after those.
+    print(f"\n=== Bounded KV Cache: Perplexity vs Memory ===")
+    held_out = docs[NUM_STEPS:]
+    eval_seqs: list[list[int]] = []
+    for i in range(EVAL_NUM_SEQS):
+        seq = [BOS]
+        while len(seq) < BLOCK_SIZE:
+            seq += [unique_chars.index(ch) for ch in held_out.pop()] + [BOS]
+        eval_seqs.append(seq[:BLOCK_SIZE])
+    policies = [CachePolicy(), CachePolicy(window=16), CachePolicy(window=8),
+                CachePolicy(window=4), CachePolicy(window=8, sinks=1),
+                CachePolicy(window=4, sinks=1)]
+    print(f"{EVAL_NUM_SEQS} held-out sequences of {BLOCK_SIZE} tokens; peak cache per "
+          f"sequence in floats (paged: whole pages of {PAGE_BLOCK_SIZE})\n")
+    print(f"{'Policy':<18} {'Perplexity':>10} {'Peak cache':>11} {'Paged peak':>11}")
+    print("-" * 53)
+    for policy in policies:
+        ppl, peak = evaluate_with_policy(eval_seqs, wf, policy)
+        ppl_paged, peak_paged = evaluate_with_policy(eval_seqs, wf, policy, PAGE_BLOCK_SIZE)
+        assert abs(ppl - ppl_paged) < 1e-9  # page-granular freeing never changes outputs
+        print(f"{str(policy):<18} {ppl:>10.3f} {peak:>11,} {peak_paged:>11,}")
+    print(f"\nNames are short, so a window covering one name loses little. The BOS sink")
+    print(f"keeps the sequence start in view for one extra position of memory.")
+    simulate_windowed_paging(LONG_SEQ_LEN, PAGE_BLOCK_SIZE, CachePolicy(window=8, sinks=1))
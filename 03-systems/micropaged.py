@@ -21,9 +21,13 @@ and the OS principles behind scalable LLM serving.
 
 from __future__ import annotations
 
+import hashlib
 import math
+import os
 import random
+import struct
 import time
+from collections import OrderedDict
 
 random.seed(42)
 
@@ -44,6 +48,57 @@ MAX_SEQ_LEN = 20
 NUM_REQUESTS = 8
 MAX_GEN_LEN = 12
 
+# Storage benchmark: list-of-tuples pages vs the preallocated block pool, at a
+# production-like head width so per-object overhead is visible in the numbers.
+BENCH_KV_DIM = 64
+BENCH_SEQ_LEN = 256
+BENCH_BLOCK_SIZE = 16
+
+# Batched attention benchmark: every sequence shares a prompt prefix (as after a fork
+# or a prefix-cache hit) and owns a short private suffix.
+BATCH_SIZES = [1, 4, 16, 64]
+BATCH_PREFIX_LEN = 64
+BATCH_SUFFIX_LEN = 16
+
+# Serving model: the same float transformer as microkv.py (1 layer, 2 heads of
+# HEAD_DIM, pre-norm attention + ReLU MLP), so a decode step costs a real forward.
+MODEL_EMBD = N_HEADS * HEAD_DIM
+MODEL_VOCAB = 27        # a-z plus BOS, as in microkv.py
+MODEL_MAX_POS = 48      # learned position table size; prompt + generation must fit
+
+# Continuous-batching server
+SERVE_NUM_REQUESTS = 40
+SERVE_ARRIVAL_RATE = 160.0   # Poisson arrivals, requests per second of server time
+SERVE_NUM_PAGES = 32         # KV page budget for the server
+SERVE_MAX_BATCH = 8          # max sequences decoded together in one step
+SERVE_PROMPT_LEN = (3, 8)    # prompt length range (tokens)
+SERVE_GEN_LEN = (2, 20)      # generated tokens range -- wide, so lengths vary a lot
+
+# Preemption policies. A preempted sequence's pages are either discarded and its
+# tokens replayed through the model on resume (recompute), or written to a file-backed
+# swap store and read back (swap). The scheduler recomputes sequences no longer than
+# RECOMPUTE_MAX_SEQ_LEN -- they fit in one page, so replay is a handful of forwards --
+# and swaps longer ones, whose replay cost grows with every token generated.
+PREEMPT_RECOMPUTE = "recompute"
+PREEMPT_SWAP = "swap"
+PREEMPT_BY_LENGTH = "by length"
+RECOMPUTE_MAX_SEQ_LEN = PAGE_BLOCK_SIZE
+# One swap file per process, so concurrent runs never share (and clobber) a file.
+SWAP_FILE = f"kv_swap_{os.getpid()}.bin"
+# Swap I/O is charged to the serving clock at this device bandwidth (a SATA SSD's
+# sequential rate). Timing the file calls alone would measure the OS page cache,
+# which absorbs these small writes and serves the reads back as a memcpy.
+SWAP_BYTES_PER_SEC = 500e6
+
+# Quantized KV pool: K/V stored as int8 or packed int4 codes with one float32 scale
+# per head slice (KV_SCALE_GROUP values) of each vector
+KV_QUANT_SCHEMES = ["int8", "int4"]
+KV_SCALE_GROUP = HEAD_DIM
+
+# Prefix caching: requests open with one of a few shared "system prompts"
+NUM_SYSTEM_PROMPTS = 3
+SYSTEM_PROMPT_LEN = 16
+
 # Signpost: production vLLM manages thousands of physical blocks across 80GB GPU memory
 # with block_size=16 and head_dim=128. Our toy numbers preserve every algorithmic detail
 # while keeping the simulation readable in a terminal.
@@ -71,6 +126,10 @@ def vec_add(a: list[float], b: list[float]) -> list[float]:
     return [x + y for x, y in zip(a, b)]
 
 
+def pages_needed(num_tokens: int, block_size: int) -> int:
+    return math.ceil(num_tokens / block_size)
+
+
 def softmax(scores: list[float]) -> list[float]:
     """Stable softmax: subtract max to prevent exp() overflow.
     softmax(x_i) = exp(x_i - max(x)) / sum_j(exp(x_j - max(x)))"""
@@ -86,7 +145,71 @@ def softmax(scores: list[float]) -> list[float]:
 # Intuition: just like OS physical memory is divided into fixed-size frames (typically 4KB),
 # GPU memory for KV-cache is divided into fixed-size blocks. The indirection through page
 # tables is what enables efficient, non-contiguous allocation.
-PhysicalPage = list[tuple[list[float], list[float]]]  # (key_vec, value_vec) per position
+#
+# vLLM allocates the whole KV budget as ONE tensor at startup and never allocates again:
+# a "page" is just an index into that tensor. We do the same with a single bytearray
+# viewed as float32, laid out row-major as [num_pages, block_size, 2, kv_dim]:
+#
+#   key   of (page p, slot s) starts at float offset ((p * block_size + s) * 2) * kv_dim
+#   value of (page p, slot s) starts kv_dim floats later
+#
+# Writing a token packs its K and V straight into those slots; reading returns a
+# memoryview slice into the buffer. No per-token Python list or tuple ever exists,
+# and freeing a page is just returning its index — stale bytes are overwritten on reuse.
+
+class KVBlockPool:
+    """Preallocated float32 storage for every physical KV page."""
+
+    def __init__(self, num_pages: int, block_size: int, kv_dim: int) -> None:
+        self.num_pages = num_pages
+        self.block_size = block_size
+        self.kv_dim = kv_dim
+        self.page_floats = block_size * 2 * kv_dim
+        self.page_nbytes = self.page_floats * 4
+        self.buffer = bytearray(num_pages * self.page_nbytes)
+        # memoryview.cast reinterprets the bytes as C floats without copying.
+        # Signpost: vLLM uses fp16/bf16 for the pool; float32 is the smallest
+        # float type the stdlib can view memory as.
+        self.floats = memoryview(self.buffer).cast("f")
+        self.vector = struct.Struct(f"{kv_dim}f")
+        self.rows_read = 0  # key()/value() calls: K/V rows gathered by attention
+
+    def key_offset(self, page: int, slot: int) -> int:
+        return (page * self.block_size + slot) * 2 * self.kv_dim
+
+    def write(self, page: int, slot: int, k: list[float], v: list[float]) -> None:
+        """Store one position's K and V in place (the only write path)."""
+        offset = self.key_offset(page, slot) * 4
+        self.vector.pack_into(self.buffer, offset, *k)
+        self.vector.pack_into(self.buffer, offset + self.kv_dim * 4, *v)
+
+    def key(self, page: int, slot: int, start: int = 0, stop: int | None = None) -> memoryview:
+        """One position's K, or its [start:stop) columns (one head's slice)."""
+        self.rows_read += 1
+        base = self.key_offset(page, slot)
+        return self.floats[base + start:base + (self.kv_dim if stop is None else stop)]
+
+    def value(self, page: int, slot: int, start: int = 0, stop: int | None = None) -> memoryview:
+        self.rows_read += 1
+        base = self.key_offset(page, slot) + self.kv_dim
+        return self.floats[base + start:base + (self.kv_dim if stop is None else stop)]
+
+    def page_bytes(self, page: int) -> bytes:
+        """Snapshot one page (used when its contents must outlive the page)."""
+        start = page * self.page_nbytes
+        return bytes(self.buffer[start:start + self.page_nbytes])
+
+    def load_page(self, page: int, data: bytes) -> None:
+        start = page * self.page_nbytes
+        self.buffer[start:start + len(data)] = data
+
+    def copy_page(self, src: int, dst: int) -> None:
+        """Page-to-page copy: one memmove of block_size * 2 * kv_dim floats."""
+        size = self.page_nbytes
+        self.buffer[dst * size:(dst + 1) * size] = self.buffer[src * size:(src + 1) * size]
+
+    def nbytes(self) -> int:
+        return len(self.buffer)
 
 
 # === NAIVE KV-CACHE ALLOCATOR (BASELINE) ===
@@ -129,6 +252,186 @@ class NaiveAllocator:
         return sum(self.used.values()) / a if a > 0 else 0.0
 
 
+# === QUANTIZED BLOCK POOL ===
+# The float32 pool spends 4 bytes per cached value. Storing codes instead -- int8, or
+# int4 packed two per byte -- with one float32 scale per head slice cuts a page to
+# roughly 1/3 or 1/4 of that, so the same memory holds 3-4x the pages and therefore
+# that many more concurrent sequences. Attention dequantizes each K/V row as it reads
+# it; the float values never exist in the pool.
+#
+# Layout mirrors KVBlockPool: codes are [num_pages, block_size, 2, code_bytes] in one
+# bytearray and scales [num_pages, block_size, 2, groups] in a float32 view, so a page
+# is still an index and page copies are still two memmoves. The class implements the
+# same pool interface rather than subclassing KVBlockPool, which would allocate the
+# float32 buffer this pool exists to avoid. A read of one head's columns decodes only
+# the scale groups that head covers, not the whole kv_dim row.
+#
+# The quantizers are copied from microquant.py (each script is standalone); a head
+# slice is passed as a one-row matrix.
+
+def quantize_absmax_int8(weights_float: list[list[float]]) -> tuple[list[list[int]], float]:
+    """Absmax quantization: scale = max(|W|) / 127, q = round(W / scale)."""
+    max_abs = max(abs(w) for row in weights_float for w in row)
+    if max_abs == 0:
+        return [[0] * len(row) for row in weights_float], 1.0
+    scale = max_abs / 127.0
+    quantized = [[max(-127, min(127, round(w / scale))) for w in row] for row in weights_float]
+    return quantized, scale
+
+
+def quantize_absmax_int4(weights_float: list[list[float]]) -> tuple[list[list[int]], float]:
+    """INT4 quantization: maps to [-8, +7] (4-bit signed integer range)."""
+    max_abs = max(abs(w) for row in weights_float for w in row)
+    if max_abs == 0:
+        return [[0] * len(row) for row in weights_float], 1.0
+    scale = max_abs / 7.0
+    quantized = [[max(-8, min(7, round(w / scale))) for w in row] for row in weights_float]
+    return quantized, scale
+
+
+def dequantize_absmax(quantized: list[list[int]], scale: float) -> list[list[float]]:
+    """w_hat = q * scale. Simple multiplication recovers approximate floats."""
+    return [[q * scale for q in row] for row in quantized]
+
+
+class QuantizedKVBlockPool:
+    """The KVBlockPool interface over int8 / packed-int4 codes plus per-group float32
+    scales."""
+
+    def __init__(
+        self, num_pages: int, block_size: int, kv_dim: int, kv_quant: str,
+        group_size: int = KV_SCALE_GROUP,
+    ) -> None:
+        self.num_pages = num_pages
+        self.block_size = block_size
+        self.kv_dim = kv_dim
+        self.kv_quant = kv_quant
+        self.group_size = group_size
+        self.groups = kv_dim // group_size
+        self.code_bytes = kv_dim // 2 if kv_quant == "int4" else kv_dim
+        self.page_code_bytes = block_size * 2 * self.code_bytes
+        self.page_scales = block_size * 2 * self.groups
+        self.page_nbytes = self.page_code_bytes + self.page_scales * 4
+        self.codes = bytearray(num_pages * self.page_code_bytes)
+        self.scale_buffer = bytearray(num_pages * self.page_scales * 4)
+        self.scales = memoryview(self.scale_buffer).cast("f")
+        self.rows_read = 0
+
+    def _store(self, row: int, vec: list[float]) -> None:
+        """Quantize vec group by group into code row `row` (= (page*bs + slot)*2 + k|v)."""
+        codes: list[int] = []
+        for g in range(self.groups):
+            group = vec[g * self.group_size:(g + 1) * self.group_size]
+            if self.kv_quant == "int4":
+                (q,), scale = quantize_absmax_int4([group])
+            else:
+                (q,), scale = quantize_absmax_int8([group])
+            codes.extend(q)
+            self.scales[row * self.groups + g] = scale
+        if self.kv_quant == "int4":
+            packed = bytes((codes[i] + 8) | (codes[i + 1] + 8) << 4
+                           for i in range(0, len(codes), 2))
+        else:
+            packed = bytes(c & 0xFF for c in codes)
+        self.codes[row * self.code_bytes:(row + 1) * self.code_bytes] = packed
+
+    def _load(self, row: int, start: int = 0, stop: int | None = None) -> list[float]:
+        """Dequantize columns [start:stop) of code row `row`, decoding only the scale
+        groups that overlap them."""
+        self.rows_read += 1
+        stop = self.kv_dim if stop is None else stop
+        gs = self.group_size
+        g0, g1 = start // gs, -(-stop // gs)
+        base = row * self.code_bytes
+        if self.kv_quant == "int4":
+            raw = memoryview(self.codes)[base + g0 * gs // 2:base + g1 * gs // 2]
+            q = [n - 8 for b in raw for n in (b & 0x0F, b >> 4)]
+        else:
+            q = memoryview(self.codes)[base + g0 * gs:base + g1 * gs].cast("b").tolist()
+        out: list[float] = []
+        for g in range(g0, g1):
+            group = q[(g - g0) * gs:(g - g0 + 1) * gs]
+            out.extend(dequantize_absmax([group], self.scales[row * self.groups + g])[0])
+        return out[start - g0 * gs:stop - g0 * gs]
+
+    def write(self, page: int, slot: int, k: list[float], v: list[float]) -> None:
+        row = (page * self.block_size + slot) * 2
+        self._store(row, k)
+        self._store(row + 1, v)
+
+    def key(self, page: int, slot: int, start: int = 0, stop: int | None = None) -> list[float]:
+        return self._load((page * self.block_size + slot) * 2, start, stop)
+
+    def value(
+        self, page: int, slot: int, start: int = 0, stop: int | None = None,
+    ) -> list[float]:
+        return self._load((page * self.block_size + slot) * 2 + 1, start, stop)
+
+    def page_bytes(self, page: int) -> bytes:
+        codes = self.codes[page * self.page_code_bytes:(page + 1) * self.page_code_bytes]
+        scale_bytes = self.page_scales * 4
+        scales = self.scale_buffer[page * scale_bytes:(page + 1) * scale_bytes]
+        return bytes(codes) + bytes(scales)
+
+    def load_page(self, page: int, data: bytes) -> None:
+        scale_bytes = self.page_scales * 4
+        self.codes[page * self.page_code_bytes:(page + 1) * self.page_code_bytes] = \
+            data[:self.page_code_bytes]
+        self.scale_buffer[page * scale_bytes:(page + 1) * scale_bytes] = \
+            data[self.page_code_bytes:]
+
+    def copy_page(self, src: int, dst: int) -> None:
+        self.load_page(dst, self.page_bytes(src))
+
+    def nbytes(self) -> int:
+        return len(self.codes) + len(self.scale_buffer)
+
+
+# === SWAP STORE ===
+# Swapping to host memory (the old behavior: keep page bytes in a dict) frees pool
+# pages but not memory overall. A swap store on disk does: each swapped page occupies
+# one page-sized slot of a file, like an OS swap partition. Freed slots are reused, so
+# the file only grows to the peak number of pages swapped out at once.
+#
+# Signpost: vLLM swaps to pinned CPU memory over PCIe, and an OS would mmap the swap
+# file. mmap is off limits here, so slots are moved with seek + read/write on a
+# regular file -- the same layout, with the OS page cache doing the buffering.
+
+class DiskSwapStore:
+    """Page-sized slots in one file; swap_out returns a slot, swap_in frees it."""
+
+    def __init__(self, path: str, page_nbytes: int) -> None:
+        self.path = path
+        self.page_nbytes = page_nbytes
+        self.file = open(path, "w+b")
+        self.free_slots: list[int] = []
+        self.num_slots = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def swap_out(self, data: bytes) -> int:
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = self.num_slots
+            self.num_slots += 1
+        self.file.seek(slot * self.page_nbytes)
+        self.file.write(data)
+        self.bytes_written += len(data)
+        return slot
+
+    def swap_in(self, slot: int) -> bytes:
+        self.file.seek(slot * self.page_nbytes)
+        data = self.file.read(self.page_nbytes)
+        self.bytes_read += len(data)
+        self.free_slots.append(slot)
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+        os.remove(self.path)
+
+
 # === PAGED KV-CACHE ALLOCATOR ===
 # Each request has a block table mapping logical -> physical pages.
 #
@@ -145,16 +448,25 @@ class PagedAllocator:
     Key insight: a request generating 5 tokens only consumes ceil(5/4) = 2 pages,
     not the 5 pages (20 slots) that naive allocation would reserve."""
 
-    def __init__(self, num_pages: int, block_size: int) -> None:
+    def __init__(
+        self, num_pages: int, block_size: int, kv_dim: int = HEAD_DIM,
+        swap_path: str = SWAP_FILE, kv_quant: str | None = None,
+    ) -> None:
         self.num_pages = num_pages
         self.block_size = block_size
-        self.physical_memory: list[PhysicalPage] = [[] for _ in range(num_pages)]
+        if kv_quant is None:
+            self.pool = KVBlockPool(num_pages, block_size, kv_dim)
+        else:
+            self.pool = QuantizedKVBlockPool(num_pages, block_size, kv_dim, kv_quant)
         self.free_list: list[int] = list(range(num_pages))  # like OS free frame list
         self.block_tables: dict[str, list[int]] = {}        # the "page tables"
         self.seq_lens: dict[str, int] = {}
         self.peak_pages_used = 0
-        # Preemption: saved state for paused requests (like swap space)
-        self.preempted: dict[str, tuple[int, list[PhysicalPage]]] = {}
+        # Preemption: rid -> (seq_len, swap slots), slots None when recomputing.
+        # The swap file is only created on the first swap-out.
+        self.preempted: dict[str, tuple[int, list[int] | None]] = {}
+        self.swap_path = swap_path
+        self.swap: DiskSwapStore | None = None
 
     def _alloc_page(self) -> int | None:
         if not self.free_list:
@@ -164,7 +476,6 @@ class PagedAllocator:
         return idx
 
     def _free_page(self, idx: int) -> None:
-        self.physical_memory[idx] = []
         self.free_list.append(idx)
 
     def allocate_request(self, rid: str) -> bool:
@@ -188,7 +499,7 @@ class PagedAllocator:
                 return False
             self.block_tables[rid].append(phys)
         # Production vLLM stores heads in separate pools for coalescing
-        self.physical_memory[self.block_tables[rid][logical_page]].append((k, v))
+        self.pool.write(self.block_tables[rid][logical_page], seq_len % self.block_size, k, v)
         self.seq_lens[rid] = seq_len + 1
         return True
 
@@ -199,40 +510,65 @@ class PagedAllocator:
             self._free_page(p)
         return len(pages)
 
-    def preempt(self, rid: str) -> bool:
-        """Save KV data and free pages -- like OS swapping a process to disk.
-        vLLM uses recomputation-based preemption (cheaper); we copy for clarity."""
+    def preempt(self, rid: str, policy: str = PREEMPT_SWAP) -> bool:
+        """Free rid's pages. PREEMPT_SWAP writes them to the swap file first, like an
+        OS swapping a process out; PREEMPT_RECOMPUTE just drops them (vLLM's default)
+        and leaves the caller to replay rid's tokens after resume."""
         if rid not in self.block_tables:
             return False
-        pages = self.block_tables.pop(rid)
-        saved = [list(self.physical_memory[p]) for p in pages]
-        for p in pages:
-            self._free_page(p)
-        self.preempted[rid] = (self.seq_lens.pop(rid, 0), saved)
+        seq_len = self.seq_lens[rid]
+        slots = None
+        if policy == PREEMPT_SWAP:
+            if self.swap is None:
+                self.swap = DiskSwapStore(self.swap_path, self.pool.page_nbytes)
+            slots = [self.swap.swap_out(self.pool.page_bytes(p))
+                     for p in self.block_tables[rid]]
+        self.free_request(rid)
+        self.preempted[rid] = (seq_len, slots)
         return True
 
     def resume(self, rid: str) -> bool:
-        """Allocate new pages and restore saved KV data."""
+        """Give rid its pages back. A swapped request returns at its old length; a
+        recomputed one restarts empty (seq_lens[rid] == 0) and must be replayed."""
         if rid not in self.preempted:
             return False
-        seq_len, saved = self.preempted.pop(rid)
+        seq_len, slots = self.preempted.pop(rid)
+        if slots is None:
+            return self.allocate_request(rid)
         new_pages: list[int] = []
-        for page_data in saved:
+        for _ in slots:
             phys = self._alloc_page()
-            if phys is None:  # still OOM -- re-shelve
+            if phys is None:  # still OOM -- re-shelve, pages stay on disk
                 for p in new_pages:
                     self._free_page(p)
-                self.preempted[rid] = (seq_len, saved)
+                self.preempted[rid] = (seq_len, slots)
                 return False
-            self.physical_memory[phys] = list(page_data)
             new_pages.append(phys)
+        for phys, slot in zip(new_pages, slots):
+            self.pool.load_page(phys, self.swap.swap_in(slot))
         self.block_tables[rid] = new_pages
         self.seq_lens[rid] = seq_len
         return True
 
+    def swap_bytes(self) -> int:
+        """Bytes moved through the swap file so far, both directions."""
+        if self.swap is None:
+            return 0
+        return self.swap.bytes_written + self.swap.bytes_read
+
+    def close_swap(self) -> None:
+        """Delete the swap file, if one was created."""
+        if self.swap is not None:
+            self.swap.close()
+            self.swap = None
+
     def pages_used(self) -> int:
         return self.num_pages - len(self.free_list)
 
+    def free_pages(self) -> int:
+        """Pages a new allocation could obtain right now."""
+        return len(self.free_list)
+
     def slots_allocated(self) -> int:
         return self.pages_used() * self.block_size
 
@@ -280,45 +616,223 @@ class CopyOnWriteManager:
         new = self.allocator._alloc_page()
         if new is None:
             return None
-        self.allocator.physical_memory[new] = list(self.allocator.physical_memory[old])
+        self.allocator.pool.copy_page(old, new)
         bt[logical_page] = new
         self.ref_counts[old] = rc - 1
         self.ref_counts[new] = 1
         return new
 
 
+# === PREFIX CACHING ===
+# Many requests start with the same tokens (a system prompt, few-shot examples, a long
+# shared document). Their KV for that prefix is identical, so computing and storing it
+# once per request wastes both prefill compute and pages.
+#
+# vLLM's automatic prefix caching names every FULL page by the content it holds:
+#
+#   hash(page i) = H(hash(page i-1), tokens in page i)
+#
+# Chaining the parent hash makes the name depend on the entire prefix, not just the
+# page's own tokens -- the same 4 tokens after different histories have different KV.
+# A global hash -> page map then lets a new request adopt every leading page whose hash
+# already exists, skipping prefill for those tokens. Shared pages are reference-counted;
+# when the count drops to zero the page stays cached (not freed) in an LRU list, and is
+# only evicted when an allocation finds the free list empty.
+#
+# Only full pages are shared: they are immutable, because decoding appends only to a
+# sequence's last, partially filled page. That is why no copy-on-write is needed here.
+
+def block_hash(parent_hash: str, tokens: list[int]) -> str:
+    """Content address of a full page: chains the prefix hash with this page's tokens.
+    A cryptographic hash keeps collisions (which would silently serve wrong KV) out of
+    reach; vLLM offers sha256 for the same reason."""
+    return hashlib.sha256(f"{parent_hash}|{tokens}".encode()).hexdigest()
+
+
+class PrefixCachingAllocator(PagedAllocator):
+    """PagedAllocator whose full pages are content-addressed and shared across requests."""
+
+    def __init__(
+        self, num_pages: int, block_size: int, kv_dim: int = HEAD_DIM,
+        kv_quant: str | None = None,
+    ) -> None:
+        super().__init__(num_pages, block_size, kv_dim, kv_quant=kv_quant)
+        self.cached_pages: dict[str, int] = {}      # block hash -> physical page
+        self.page_hashes: dict[int, str] = {}       # physical page -> block hash
+        self.ref_counts: dict[int, int] = {}        # cached page -> live block tables
+        self.evictable: OrderedDict[int, None] = OrderedDict()  # refcount 0, LRU order
+        self.block_hashes: dict[str, list[str]] = {}  # rid -> hashes of its full pages
+        self.blocks_looked_up = 0
+        self.blocks_hit = 0
+
+    def _alloc_page(self) -> int | None:
+        if not self.free_list and self.evictable:
+            # Memory pressure: evict the least recently used unreferenced page
+            victim, _ = self.evictable.popitem(last=False)
+            del self.cached_pages[self.page_hashes.pop(victim)]
+            del self.ref_counts[victim]
+            self.free_list.append(victim)
+        return super()._alloc_page()
+
+    def _release_page(self, page: int) -> None:
+        """Drop one reference. Cached pages park in the LRU list; private pages free."""
+        if page not in self.page_hashes:
+            self._free_page(page)
+            return
+        self.ref_counts[page] -= 1
+        if self.ref_counts[page] == 0:
+            self.evictable[page] = None
+
+    def free_pages(self) -> int:
+        return len(self.free_list) + len(self.evictable)
+
+    def allocate_with_prefix(self, rid: str, prompt: list[int]) -> int:
+        """Start rid with every cached leading page of its prompt already in its block
+        table. Returns how many prompt tokens are cached (prefill starts there).
+
+        At least the last prompt token is always left uncached: its forward pass
+        produces the logits for the first generated token."""
+        self.allocate_request(rid)
+        hashes: list[str] = []
+        parent = ""
+        for i in range((len(prompt) - 1) // self.block_size):
+            self.blocks_looked_up += 1
+            h = block_hash(parent, prompt[i * self.block_size:(i + 1) * self.block_size])
+            page = self.cached_pages.get(h)
+            if page is None:
+                break
+            self.blocks_hit += 1
+            self.ref_counts[page] += 1
+            self.evictable.pop(page, None)
+            self.block_tables[rid].append(page)
+            hashes.append(h)
+            parent = h
+        self.block_hashes[rid] = hashes
+        self.seq_lens[rid] = len(hashes) * self.block_size
+        return self.seq_lens[rid]
+
+    def cache_full_pages(self, rid: str, tokens: list[int]) -> None:
+        """Publish rid's newly completed pages under their content hashes.
+        If another request already published the same content, ours stays private."""
+        hashes = self.block_hashes.setdefault(rid, [])
+        table = self.block_tables[rid]
+        while len(hashes) < self.seq_lens[rid] // self.block_size:
+            i = len(hashes)
+            parent = hashes[-1] if hashes else ""
+            h = block_hash(parent, tokens[i * self.block_size:(i + 1) * self.block_size])
+            hashes.append(h)
+            page = table[i]
+            if h not in self.cached_pages and page not in self.page_hashes:
+                self.cached_pages[h] = page
+                self.page_hashes[page] = h
+                self.ref_counts[page] = 1
+
+    def free_request(self, rid: str) -> int:
+        """Also the release step of preempt: shared pages stay cached for the other
+        requests, and rid's pages come back private on resume, to be re-published by
+        cache_full_pages if their content is no longer cached."""
+        pages = self.block_tables.pop(rid, [])
+        self.seq_lens.pop(rid, None)
+        self.block_hashes.pop(rid, None)
+        for p in pages:
+            self._release_page(p)
+        return len(pages)
+
+    def hit_rate(self) -> float:
+        return self.blocks_hit / self.blocks_looked_up if self.blocks_looked_up else 0.0
+
+
 # === PAGED ATTENTION COMPUTATION ===
 # attention(q, K, V) = softmax(qK^T / sqrt(d)) V
 # Identical math to standard attention; only difference is K,V rows live in
 # non-contiguous physical pages, gathered through block table indirection.
 
 def paged_attention(
-    query: list[float], block_table: list[int],
-    phys_mem: list[PhysicalPage], seq_len: int, block_size: int,
+    query: list[float], block_table: list[int], pool: KVBlockPool | QuantizedKVBlockPool,
+    seq_len: int, head_start: int = 0,
 ) -> list[float]:
-    """Attention against paged KV-cache. Real vLLM fuses gather+attention in a
-    single CUDA kernel for memory bandwidth efficiency."""
+    """Attention against paged KV-cache, reading K,V in place through the block table.
+    Real vLLM fuses gather+attention in a single CUDA kernel for memory bandwidth
+    efficiency; here the "gather" is just offset arithmetic into the pool.
+
+    With multi-head slots, head_start selects which len(query)-wide slice of each
+    stored K/V vector this head attends over."""
     d = len(query)
+    head_end = head_start + d
     scale = 1.0 / math.sqrt(d)
+    block_size = pool.block_size
 
-    # Gather K,V from scattered pages -- the core PagedAttention operation
-    keys: list[list[float]] = []
-    vals: list[list[float]] = []
-    for pos in range(seq_len):
-        phys_page = block_table[pos // block_size]
-        k, v = phys_mem[phys_page][pos % block_size]
-        keys.append(k)
-        vals.append(v)
-
+    # Walk the block table page by page -- the core PagedAttention operation.
     # Standard scaled dot-product: scores_i = q . k_i / sqrt(d)
-    scores = [dot(query, k) * scale for k in keys]
+    scores: list[float] = []
+    for logical_page, phys_page in enumerate(block_table):
+        filled = min(block_size, seq_len - logical_page * block_size)
+        for slot in range(filled):
+            scores.append(dot(query, pool.key(phys_page, slot, head_start, head_end)) * scale)
     weights = softmax(scores)
+
+    # Weighted sum of values, accumulated in place (no per-token temporaries)
     out = [0.0] * d
-    for w, v in zip(weights, vals):
-        out = vec_add(out, vec_scale(v, w))
+    for pos, w in enumerate(weights):
+        v = pool.value(block_table[pos // block_size], pos % block_size, head_start, head_end)
+        for i in range(d):
+            out[i] += v[i] * w
     return out
 
 
+def paged_attention_batch(
+    queries: list[list[float]], block_tables: list[list[int]], seq_lens: list[int],
+    pool: KVBlockPool | QuantizedKVBlockPool, head_start: int = 0,
+) -> list[list[float]]:
+    """paged_attention for a whole decode step: one query per sequence, one pass.
+
+    Work is grouped by physical page: at each logical page index, every page is
+    gathered from the pool once and then used by all sequences whose block table
+    points at it, so a prefix shared by the batch is read once per step instead of
+    once per sequence. Walking logical pages in order keeps each sequence's scores
+    and value sums in position order, so outputs are bit-identical to paged_attention."""
+    d = len(queries[0])
+    head_end = head_start + d
+    scale = 1.0 / math.sqrt(d)
+    block_size = pool.block_size
+
+    # readers[lp]: physical page -> sequences reading it at logical page lp
+    readers: list[dict[int, list[int]]] = []
+    for lp in range(max(pages_needed(n, block_size) for n in seq_lens)):
+        by_page: dict[int, list[int]] = {}
+        for b, table in enumerate(block_tables):
+            if lp * block_size < seq_lens[b]:
+                by_page.setdefault(table[lp], []).append(b)
+        readers.append(by_page)
+
+    def filled(b: int, lp: int) -> int:
+        return min(block_size, seq_lens[b] - lp * block_size)
+
+    scores: list[list[float]] = [[] for _ in queries]
+    for lp, by_page in enumerate(readers):
+        for phys, seqs in by_page.items():
+            keys = [list(pool.key(phys, slot, head_start, head_end))
+                    for slot in range(max(filled(b, lp) for b in seqs))]
+            for b in seqs:
+                q = queries[b]
+                scores[b].extend([sum([x * y for x, y in zip(q, k)]) * scale
+                                  for k in keys[:filled(b, lp)]])
+    weights = [softmax(s) for s in scores]
+
+    outs = [[0.0] * d for _ in queries]
+    for lp, by_page in enumerate(readers):
+        for phys, seqs in by_page.items():
+            vals = [list(pool.value(phys, slot, head_start, head_end))
+                    for slot in range(max(filled(b, lp) for b in seqs))]
+            for b in seqs:
+                out = outs[b]
+                base = lp * block_size
+                for w, v in zip(weights[b][base:base + filled(b, lp)], vals):
+                    out = [o + x * w for o, x in zip(out, v)]
+                outs[b] = out
+    return outs
+
+
 def contiguous_attention(
     query: list[float], keys: list[list[float]], vals: list[list[float]],
 ) -> list[float]:
@@ -332,9 +846,86 @@ def contiguous_attention(
     return out
 
 
+# === SERVING MODEL ===
+# A scheduler is only as realistic as the work it schedules, so the server runs the
+# float forward pass from microkv.py: embed -> RMSNorm -> multi-head attention ->
+# residual -> ReLU MLP -> residual -> logits. The only change is where K and V live:
+# microkv appends them to per-sequence Python lists, here they go into the shared
+# page pool through the sequence's block table.
+#
+# Signpost: weights are random rather than trained -- throughput, latency and memory
+# behavior don't depend on weight values, and microkv.py already shows training.
+# With more layers, vLLM keeps one pool per layer indexed by the same block table.
+
+def linear_f(x: list[float], w: list[list[float]]) -> list[float]:
+    """Matrix-vector multiply on plain floats: y = W @ x."""
+    return [sum(w_row[j] * x[j] for j in range(len(x))) for w_row in w]
+
+
+def rmsnorm_f(x: list[float]) -> list[float]:
+    mean_sq = sum(xi * xi for xi in x) / len(x)
+    scale = (mean_sq + 1e-5) ** -0.5
+    return [xi * scale for xi in x]
+
+
+def init_serving_model() -> dict[str, list[list[float]]]:
+    def matrix(nrows: int, ncols: int) -> list[list[float]]:
+        return [[random.gauss(0, 0.08) for _ in range(ncols)] for _ in range(nrows)]
+    return {
+        'wte': matrix(MODEL_VOCAB, MODEL_EMBD),
+        'wpe': matrix(MODEL_MAX_POS, MODEL_EMBD),
+        'wq': matrix(MODEL_EMBD, MODEL_EMBD),
+        'wk': matrix(MODEL_EMBD, MODEL_EMBD),
+        'wv': matrix(MODEL_EMBD, MODEL_EMBD),
+        'wo': matrix(MODEL_EMBD, MODEL_EMBD),
+        'fc1': matrix(4 * MODEL_EMBD, MODEL_EMBD),
+        'fc2': matrix(MODEL_EMBD, 4 * MODEL_EMBD),
+        'lm_head': matrix(MODEL_VOCAB, MODEL_EMBD),
+    }
+
+
+def forward_paged(
+    model: dict[str, list[list[float]]], alloc: PagedAllocator, rid: str,
+    token: int, pos: int,
+) -> list[float] | None:
+    """One-token forward pass that writes K,V into rid's pages. Returns logits, or
+    None if no page was available for the new position (caller must preempt)."""
+    x = rmsnorm_f([t + p for t, p in zip(model['wte'][token], model['wpe'][pos])])
+    x_res = x
+    x = rmsnorm_f(x)
+    q = linear_f(x, model['wq'])
+    k = linear_f(x, model['wk'])
+    v = linear_f(x, model['wv'])
+    if not alloc.append_token(rid, k, v):
+        return None
+
+    # Each head reads its HEAD_DIM-wide slice of every cached K/V slot
+    seq_len = alloc.seq_lens[rid]
+    block_table = alloc.block_tables[rid]
+    head_cat: list[float] = []
+    for h in range(N_HEADS):
+        hs = h * HEAD_DIM
+        head_cat.extend(paged_attention(q[hs:hs + HEAD_DIM], block_table, alloc.pool,
+                                        seq_len, head_start=hs))
+
+    x = [a + b for a, b in zip(linear_f(head_cat, model['wo']), x_res)]
+    x_res = x
+    h = [max(0.0, hi) for hi in linear_f(rmsnorm_f(x), model['fc1'])]
+    x = [a + b for a, b in zip(linear_f(h, model['fc2']), x_res)]
+    return linear_f(x, model['lm_head'])
+
+
 # === CORRECTNESS VERIFICATION ===
 # Proves paged attention = contiguous attention to floating-point precision.
 # The block table is transparent indirection -- math doesn't know K,V are scattered.
+# The pool stores float32, so the reference uses the same float32-rounded vectors:
+# any difference left over would come from paging, not from storage precision.
+
+def to_float32(v: list[float]) -> list[float]:
+    """Round a vector to float32 precision (what the pool actually stores)."""
+    fmt = f"{len(v)}f"
+    return list(struct.unpack(fmt, struct.pack(fmt, *v)))
+
 
 def verify_correctness() -> None:
     print("=" * 60)
@@ -349,14 +940,13 @@ def verify_correctness() -> None:
     seq_len = 13  # non-multiple of PAGE_BLOCK_SIZE to test remainder handling
 
     for _ in range(seq_len):
-        k, v = rand_vec(HEAD_DIM), rand_vec(HEAD_DIM)
+        k, v = to_float32(rand_vec(HEAD_DIM)), to_float32(rand_vec(HEAD_DIM))
         all_k.append(k)
         all_v.append(v)
         alloc.append_token("v", k, v)
 
     q = rand_vec(HEAD_DIM)
-    paged_out = paged_attention(q, alloc.block_tables["v"], alloc.physical_memory,
-                                seq_len, PAGE_BLOCK_SIZE)
+    paged_out = paged_attention(q, alloc.block_tables["v"], alloc.pool, seq_len)
     contig_out = contiguous_attention(q, all_k, all_v)
     diff = max(abs(a - b) for a, b in zip(paged_out, contig_out))
 
@@ -475,6 +1065,170 @@ def simulate_serving() -> None:
     if avg_n > 0:
         print(f"\n  Utilization improvement: {(avg_p - avg_n) / avg_n * 100:+.1f}%")
     print(f"  Naive rejected {len(n_rejected)} requests; paged served all {len(p_done)}.")
+    paged.close_swap()
+
+
+# === STORAGE BENCHMARK: LIST-OF-TUPLES VS BLOCK POOL ===
+# The pre-pool design stored each page as a Python list of (k, v) tuples, where k and
+# v are themselves lists of boxed floats. Every cached position cost a tuple, two
+# lists, and 2 * kv_dim float objects (24 bytes each) -- and attention had to gather
+# them into fresh lists first. The pool stores the same data as 4 bytes per float.
+
+def tuple_page_attention(
+    query: list[float], block_table: list[int],
+    pages: list[list[tuple[list[float], list[float]]]], seq_len: int, block_size: int,
+) -> list[float]:
+    """Attention over the old list-of-tuples pages (gather, then compute)."""
+    keys: list[list[float]] = []
+    vals: list[list[float]] = []
+    for pos in range(seq_len):
+        k, v = pages[block_table[pos // block_size]][pos % block_size]
+        keys.append(k)
+        vals.append(v)
+    return contiguous_attention(query, keys, vals)
+
+
+# Fixed 64-bit CPython object sizes: storage is estimated from element counts.
+PY_POINTER_BYTES = 8   # one slot in a list or tuple
+PY_FLOAT_BYTES = 24    # a boxed float object
+PY_LIST_BYTES = 56     # empty list header, including the GC header
+PY_TUPLE_BYTES = 40    # empty tuple header, including the GC header
+
+
+def python_object_bytes(pages: list[list[tuple[list[float], list[float]]]]) -> int:
+    """Bytes held by list-of-tuples pages, counting every container and float.
+
+    A list of n floats costs a header, n pointers and n float objects; list
+    over-allocation from append() is ignored, so this is a lower bound."""
+    total = PY_LIST_BYTES + PY_POINTER_BYTES * len(pages)
+    for page in pages:
+        total += PY_LIST_BYTES + PY_POINTER_BYTES * len(page)
+        for entry in page:
+            total += PY_TUPLE_BYTES + PY_POINTER_BYTES * len(entry)
+            for vec in entry:
+                total += PY_LIST_BYTES + (PY_POINTER_BYTES + PY_FLOAT_BYTES) * len(vec)
+    return total
+
+
+def benchmark_kv_storage() -> None:
+    print("\n" + "=" * 60)
+    print("KV STORAGE: LIST-OF-TUPLES PAGES VS PREALLOCATED POOL")
+    print(f"  {BENCH_SEQ_LEN} positions, kv_dim={BENCH_KV_DIM}, "
+          f"block_size={BENCH_BLOCK_SIZE}")
+    print("=" * 60)
+
+    num_pages = math.ceil(BENCH_SEQ_LEN / BENCH_BLOCK_SIZE)
+    block_table = list(range(num_pages))
+    kv = [(to_float32(rand_vec(BENCH_KV_DIM)), to_float32(rand_vec(BENCH_KV_DIM)))
+          for _ in range(BENCH_SEQ_LEN)]
+    queries = [rand_vec(BENCH_KV_DIM) for _ in range(20)]
+
+    # Old design: pages grow by appending (k, v) tuples
+    t0 = time.time()
+    tuple_pages: list[list[tuple[list[float], list[float]]]] = [[] for _ in range(num_pages)]
+    for pos, (k, v) in enumerate(kv):
+        tuple_pages[pos // BENCH_BLOCK_SIZE].append((list(k), list(v)))
+    tuple_write = time.time() - t0
+    t0 = time.time()
+    tuple_outs = [tuple_page_attention(q, block_table, tuple_pages, BENCH_SEQ_LEN,
+                                       BENCH_BLOCK_SIZE) for q in queries]
+    tuple_attn = time.time() - t0
+
+    # New design: one buffer, written in place
+    t0 = time.time()
+    alloc = PagedAllocator(num_pages, BENCH_BLOCK_SIZE, BENCH_KV_DIM)
+    alloc.allocate_request("bench")
+    for k, v in kv:
+        alloc.append_token("bench", k, v)
+    pool_write = time.time() - t0
+    t0 = time.time()
+    pool_outs = [paged_attention(q, alloc.block_tables["bench"], alloc.pool, BENCH_SEQ_LEN)
+                 for q in queries]
+    pool_attn = time.time() - t0
+
+    diff = max(abs(a - b) for x, y in zip(tuple_outs, pool_outs) for a, b in zip(x, y))
+    tuple_bytes = python_object_bytes(tuple_pages)
+    pool_bytes = alloc.pool.nbytes()
+
+    print(f"\n  {'':<22} {'tuples':>12} {'pool':>12}")
+    print(f"  {'append (tokens/s)':<22} {BENCH_SEQ_LEN / tuple_write:>12,.0f} "
+          f"{BENCH_SEQ_LEN / pool_write:>12,.0f}")
+    print(f"  {'attention (queries/s)':<22} {len(queries) / tuple_attn:>12,.0f} "
+          f"{len(queries) / pool_attn:>12,.0f}")
+    print(f"  {'KV memory (bytes)':<22} {tuple_bytes:>12,} {pool_bytes:>12,}")
+    print(f"\n  Memory: pool is {tuple_bytes / pool_bytes:.1f}x smaller | "
+          f"outputs match: {'PASS' if diff < 1e-10 else 'FAIL'} (max diff {diff:.1e})")
+    print("  Signpost: the pool trades per-token allocation for interpreter work per")
+    print("  float read; in a compiled kernel the flat layout is also the fast one.")
+
+
+# === BATCHED PAGED ATTENTION BENCHMARK ===
+# One decode step for a batch that shares a prompt prefix. Per-sequence calls gather
+# every prefix page once per sequence; the batched kernel gathers it once per step.
+# "page reads" is measured: the pool counts every K or V row it hands out, and a
+# page gather is block_size rows (every page here is full).
+
+def benchmark_batched_attention() -> None:
+    print("\n" + "=" * 60)
+    print("BATCHED PAGED ATTENTION (shared prefix pages read once per step)")
+    print(f"  prefix={BATCH_PREFIX_LEN} shared + {BATCH_SUFFIX_LEN} private tokens, "
+          f"kv_dim={BENCH_KV_DIM}, block_size={BENCH_BLOCK_SIZE}")
+    print("=" * 60)
+
+    seq_len = BATCH_PREFIX_LEN + BATCH_SUFFIX_LEN
+    suffix_pages = pages_needed(BATCH_SUFFIX_LEN, BENCH_BLOCK_SIZE)
+    prefix = [(to_float32(rand_vec(BENCH_KV_DIM)), to_float32(rand_vec(BENCH_KV_DIM)))
+              for _ in range(BATCH_PREFIX_LEN)]
+
+    print(f"\n  {'batch':>5} {'per-seq':>10} {'batched':>10} {'speedup':>8} "
+          f"{'page reads':>12} {'max diff':>9}")
+    for batch in BATCH_SIZES:
+        alloc = PagedAllocator(pages_needed(BATCH_PREFIX_LEN, BENCH_BLOCK_SIZE)
+                               + batch * suffix_pages, BENCH_BLOCK_SIZE, BENCH_KV_DIM)
+        cow = CopyOnWriteManager(alloc)
+        alloc.allocate_request("prefix")
+        for k, v in prefix:
+            alloc.append_token("prefix", k, v)
+        rids = [f"s{b}" for b in range(batch)]
+        contiguous: list[tuple[list[list[float]], list[list[float]]]] = []
+        for rid in rids:
+            cow.fork("prefix", rid)  # prefix ends on a page boundary: no COW needed
+            suffix = [(to_float32(rand_vec(BENCH_KV_DIM)), to_float32(rand_vec(BENCH_KV_DIM)))
+                      for _ in range(BATCH_SUFFIX_LEN)]
+            for k, v in suffix:
+                alloc.append_token(rid, k, v)
+            kv = prefix + suffix
+            contiguous.append(([k for k, _ in kv], [v for _, v in kv]))
+        queries = [rand_vec(BENCH_KV_DIM) for _ in rids]
+        tables = [alloc.block_tables[rid] for rid in rids]
+
+        t_single = t_batched = float("inf")
+        for _ in range(3):  # best of 3: a single step is short enough to be noisy
+            rows_before = alloc.pool.rows_read
+            t0 = time.perf_counter()
+            single = [paged_attention(q, t, alloc.pool, seq_len)
+                      for q, t in zip(queries, tables)]
+            t_single = min(t_single, time.perf_counter() - t0)
+            rows_single = alloc.pool.rows_read - rows_before
+            rows_before = alloc.pool.rows_read
+            t0 = time.perf_counter()
+            batched = paged_attention_batch(queries, tables, [seq_len] * batch, alloc.pool)
+            t_batched = min(t_batched, time.perf_counter() - t0)
+            rows_batched = alloc.pool.rows_read - rows_before
+
+        diff = max(abs(a - b)
+                   for q, out, (keys, vals) in zip(queries, batched, contiguous)
+                   for a, b in zip(out, contiguous_attention(q, keys, vals)))
+        diff = max(diff, max(abs(a - b) for x, y in zip(single, batched)
+                             for a, b in zip(x, y)))
+        reads_single = rows_single // BENCH_BLOCK_SIZE
+        reads_batched = rows_batched // BENCH_BLOCK_SIZE
+        print(f"  {batch:>5} {t_single * 1000:>8.1f}ms {t_batched * 1000:>8.1f}ms "
+              f"{t_single / t_batched:>7.2f}x {reads_single:>5} -> {reads_batched:<4} "
+              f"{diff:>9.1e}")
+    print("\n  Outputs equal contiguous_attention per sequence. The shared pages are")
+    print("  gathered once however large the batch, so page reads grow only with the")
+    print("  private suffixes -- on a GPU that is HBM traffic, the decode bottleneck.")
 
 
 # === COPY-ON-WRITE BEAM SEARCH DEMO ===
@@ -525,43 +1279,315 @@ def demo_cow() -> None:
     print(f"  COW avoids duplicating ~3072 KV positions worth of pages.")
 
 
-# === CONTINUOUS BATCHING DEMO ===
-# Paging enables fine-grained memory release, synergistic with Orca-style continuous
-# batching: new requests start as soon as pages free, no waiting for the full batch.
+# === CONTINUOUS-BATCHING SERVER ===
+# Orca-style iteration-level scheduling on top of the paged allocator. Every step:
+#
+#   1. arrivals join the waiting queue
+#   2. every running sequence about to cross a page boundary needs one new page; if
+#      the pool can't cover them all, preempt the most recently admitted sequences
+#      (LIFO, as vLLM does) until it can
+#   3. resume preempted sequences first, then admit waiting ones, while pages allow;
+#      a sequence preempted by recompute restarts at position 0 and replays its
+#      prompt and generated tokens (no output) before decoding again
+#   4. run ONE forward per running sequence -- a prompt token (prefill) or the last
+#      generated token (decode) -- and finish sequences that hit their length
+#
+# Static batching is the same loop with admission closed until the whole batch has
+# finished: short requests wait on the longest one, and new arrivals wait on all.
+#
+# Time is simulated: arrivals follow a Poisson trace in seconds, and the clock
+# advances by the measured wall time of each step plus the swap bytes it moved at
+# SWAP_BYTES_PER_SEC, or jumps to the next arrival when idle. Time-to-first-token
+# (TTFT) = first generated token - arrival; per-token latency = gap between
+# consecutive generated tokens of one request.
+
+def make_poisson_trace(
+    num_requests: int, rate: float, system_prompts: list[list[int]] | None = None,
+) -> list[dict]:
+    """Requests with exponential inter-arrival gaps (a Poisson process). With
+    system_prompts, each prompt is a random system prompt followed by its own text."""
+    trace = []
+    clock = 0.0
+    for i in range(num_requests):
+        clock += random.expovariate(rate)
+        prompt = [MODEL_VOCAB - 1] + [random.randint(0, MODEL_VOCAB - 2)
+                                      for _ in range(random.randint(*SERVE_PROMPT_LEN) - 1)]
+        if system_prompts:
+            prompt = random.choice(system_prompts) + prompt[1:]
+        trace.append({"rid": f"R{i}", "arrival": clock, "prompt": prompt,
+                      "gen_len": random.randint(*SERVE_GEN_LEN)})
+    return trace
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile: the smallest value with >= pct% of values at or below."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def choose_preemption(seq_len: int) -> str:
+    """Per-request policy: replay short sequences, swap long ones to disk."""
+    return PREEMPT_RECOMPUTE if seq_len <= RECOMPUTE_MAX_SEQ_LEN else PREEMPT_SWAP
+
+
+def serve(
+    trace: list[dict], model: dict[str, list[list[float]]], num_pages: int,
+    continuous: bool = True, prefix_caching: bool = False,
+    preemption: str = PREEMPT_SWAP, kv_quant: str | None = None,
+) -> dict[str, float]:
+    """Run the trace through the scheduler; return throughput and latency metrics.
+    preemption is PREEMPT_RECOMPUTE, PREEMPT_SWAP, or PREEMPT_BY_LENGTH; kv_quant
+    (one of KV_QUANT_SCHEMES) stores the KV pages quantized.
+
+    Raises ValueError if a request's full KV (prompt + generated tokens, the last
+    generated token never written) needs more than num_pages pages: preemption can
+    free every other page, but it can never fit."""
+    for req in trace:
+        peak_pages = pages_needed(len(req["prompt"]) + req["gen_len"] - 1, PAGE_BLOCK_SIZE)
+        if peak_pages > num_pages:
+            raise ValueError(f"request {req['rid']} needs {peak_pages} KV pages at full "
+                             f"length, more than the pool's {num_pages}")
+    if prefix_caching:
+        alloc = PrefixCachingAllocator(num_pages, PAGE_BLOCK_SIZE, MODEL_EMBD, kv_quant)
+    else:
+        alloc = PagedAllocator(num_pages, PAGE_BLOCK_SIZE, MODEL_EMBD, kv_quant=kv_quant)
+    prefill_tokens_saved = 0
+    requests = {req["rid"]: dict(req, tokens=list(req["prompt"]), pos=0, token_times=[])
+                for req in trace}
+    pending = sorted(trace, key=lambda r: r["arrival"])
+    waiting: list[str] = []
+    running: list[str] = []
+    preempted: list[str] = []
+    finished = 0
+    num_preemptions = 0
+    tokens_recomputed = 0
+    clock = 0.0
+
+    while finished < len(requests):
+        while pending and pending[0]["arrival"] <= clock:
+            waiting.append(pending.pop(0)["rid"])
+
+        # Step 2: make room for this step's page faults by preempting (LIFO)
+        sched_start = time.perf_counter()
+        swapped_before = alloc.swap_bytes()
+        def needs_page(rid: str) -> bool:
+            return alloc.seq_lens[rid] % PAGE_BLOCK_SIZE == 0
+        while running and sum(map(needs_page, running)) > alloc.free_pages():
+            victim = running.pop()
+            policy = preemption
+            if policy == PREEMPT_BY_LENGTH:
+                policy = choose_preemption(alloc.seq_lens[victim])
+            alloc.preempt(victim, policy)
+            preempted.insert(0, victim)
+            num_preemptions += 1
+
+        # Step 3: resume, then admit -- static batching admits only into an empty batch
+        if continuous or not running:
+            while preempted and len(running) < SERVE_MAX_BATCH:
+                rid = preempted[0]
+                seq_len = alloc.preempted[rid][0]
+                spare = alloc.free_pages() - pages_needed(seq_len + 1, PAGE_BLOCK_SIZE)
+                if spare < sum(map(needs_page, running)) or not alloc.resume(rid):
+                    break
+                requests[rid]["pos"] = alloc.seq_lens[rid]  # 0 if dropped: replay
+                tokens_recomputed += seq_len - alloc.seq_lens[rid]
+                running.append(preempted.pop(0))
+            while waiting and not preempted and len(running) < SERVE_MAX_BATCH:
+                rid = waiting[0]
+                prompt_pages = pages_needed(len(requests[rid]["prompt"]), PAGE_BLOCK_SIZE)
+                if alloc.free_pages() - sum(map(needs_page, running)) < prompt_pages:
+                    break
+                waiting.pop(0)
+                if prefix_caching:
+                    cached = alloc.allocate_with_prefix(rid, requests[rid]["prompt"])
+                    requests[rid]["pos"] = cached
+                    prefill_tokens_saved += cached
+                else:
+                    alloc.allocate_request(rid)
+                running.append(rid)
+        clock += time.perf_counter() - sched_start
+        clock += (alloc.swap_bytes() - swapped_before) / SWAP_BYTES_PER_SEC
+
+        if not running:
+            if not pending:  # queued work that cannot be admitted into an empty batch
+                raise RuntimeError(f"scheduler stalled with {len(waiting)} waiting and "
+                                   f"{len(preempted)} preempted requests, none admissible")
+            clock = max(clock, pending[0]["arrival"])  # idle: jump to the next arrival
+            continue
+
+        # Step 4: one forward per running sequence
+        step_start = time.perf_counter()
+        generated: list[str] = []
+        for rid in list(running):
+            req = requests[rid]
+            logits = forward_paged(model, alloc, rid, req["tokens"][req["pos"]], req["pos"])
+            req["pos"] += 1
+            if req["pos"] == len(req["tokens"]):  # past prompt and replay: this is output
+                req["tokens"].append(max(range(MODEL_VOCAB), key=lambda i: logits[i]))
+                generated.append(rid)
+            if prefix_caching:
+                alloc.cache_full_pages(rid, req["tokens"])
+        clock += time.perf_counter() - step_start
+
+        for rid in generated:
+            req = requests[rid]
+            req["token_times"].append(clock)
+            if len(req["token_times"]) == req["gen_len"]:
+                alloc.free_request(rid)
+                running.remove(rid)
+                finished += 1
+
+    swap_bytes = alloc.swap_bytes()
+    alloc.close_swap()
+    ttfts = [r["token_times"][0] - r["arrival"] for r in requests.values()]
+    gaps = [b - a for r in requests.values()
+            for a, b in zip(r["token_times"], r["token_times"][1:])]
+    total_tokens = sum(r["gen_len"] for r in requests.values())
+    makespan = max(r["token_times"][-1] for r in requests.values()) - trace[0]["arrival"]
+    return {
+        "tokens_per_sec": total_tokens / makespan,
+        "ttft_p50": percentile(ttfts, 50), "ttft_p99": percentile(ttfts, 99),
+        "token_p50": percentile(gaps, 50), "token_p99": percentile(gaps, 99),
+        "preemptions": num_preemptions, "peak_pages": alloc.peak_pages_used,
+        "prefill_tokens": sum(len(r["prompt"]) for r in requests.values()),
+        "prefill_tokens_saved": prefill_tokens_saved,
+        "hit_rate": alloc.hit_rate() if prefix_caching else 0.0,
+        "tokens_recomputed": tokens_recomputed, "swap_bytes": swap_bytes,
+    }
+
 
 def demo_continuous_batching() -> None:
     print("\n" + "=" * 60)
-    print("CONTINUOUS BATCHING")
+    print("CONTINUOUS BATCHING SERVER (paged KV + real forward passes)")
+    print(f"  {SERVE_NUM_REQUESTS} requests, Poisson arrivals at "
+          f"{SERVE_ARRIVAL_RATE:.0f} req/s | {SERVE_NUM_PAGES} pages x "
+          f"{PAGE_BLOCK_SIZE} slots | batch <= {SERVE_MAX_BATCH}")
     print("=" * 60)
 
-    alloc = PagedAllocator(NUM_PHYSICAL_PAGES, PAGE_BLOCK_SIZE)
-    b1 = [("S1", 5), ("S2", 3), ("S3", 7)]
-    b2 = [("S4", 4), ("S5", 6)]
-    max_b1 = max(t for _, t in b1)
-    static = max_b1 + max(t for _, t in b2)
-    print(f"\n  Static: batch 2 waits {max_b1} steps -> total {static}")
-
-    active: dict[str, int] = {}
-    done_at: dict[str, int] = {}
-    for rid, toks in b1 + b2:
-        alloc.allocate_request(rid)
-        active[rid] = toks
-
-    for step in range(30):
-        if not active:
-            break
-        for rid in list(active):
-            alloc.append_token(rid, rand_vec(HEAD_DIM), rand_vec(HEAD_DIM))
-            active[rid] -= 1
-            if active[rid] <= 0:
-                freed = alloc.free_request(rid)
-                del active[rid]
-                done_at[rid] = step
-                print(f"    Step {step}: {rid} done (freed {freed} pages)")
-
-    cont = max(done_at.values())
-    print(f"\n  Static: {static} | Continuous: {cont} | "
-          f"Saved: {(static - cont) / static * 100:.0f}%")
+    model = init_serving_model()
+    trace = make_poisson_trace(SERVE_NUM_REQUESTS, SERVE_ARRIVAL_RATE)
+    results = {
+        "static": serve(trace, model, SERVE_NUM_PAGES, continuous=False),
+        "continuous": serve(trace, model, SERVE_NUM_PAGES, continuous=True),
+        # Same trace with half the pages: growth now outruns the pool, so the
+        # scheduler must preempt and later resume sequences to make progress.
+        "cont. 1/2 mem": serve(trace, model, SERVE_NUM_PAGES // 2, continuous=True),
+    }
+
+    print(f"\n  {'':<13} {'tok/s':>8} {'TTFT p50':>10} {'TTFT p99':>10} "
+          f"{'tok p50':>9} {'tok p99':>9} {'preempt':>8}")
+    for name, m in results.items():
+        print(f"  {name:<13} {m['tokens_per_sec']:>8.0f} {m['ttft_p50'] * 1000:>8.1f}ms "
+              f"{m['ttft_p99'] * 1000:>8.1f}ms {m['token_p50'] * 1000:>7.2f}ms "
+              f"{m['token_p99'] * 1000:>7.2f}ms {m['preemptions']:>8}")
+    print("\n  Static batching makes arrivals wait for the slowest request in the batch;")
+    print("  continuous batching admits them as soon as a sequence finishes and frees")
+    print("  its pages, cutting TTFT. The price is per-token latency: fuller batches")
+    print("  mean each step runs more forwards before anyone's next token is out.")
+
+
+def demo_prefix_caching() -> None:
+    print("\n" + "=" * 60)
+    print("PREFIX CACHING (hash-addressed shared pages)")
+    print(f"  {SERVE_NUM_REQUESTS} requests sharing {NUM_SYSTEM_PROMPTS} system prompts of "
+          f"{SYSTEM_PROMPT_LEN} tokens | {SERVE_NUM_PAGES} pages")
+    print("=" * 60)
+
+    model = init_serving_model()
+    system_prompts = [
+        [MODEL_VOCAB - 1] + [random.randint(0, MODEL_VOCAB - 2)
+                             for _ in range(SYSTEM_PROMPT_LEN - 1)]
+        for _ in range(NUM_SYSTEM_PROMPTS)
+    ]
+    trace = make_poisson_trace(SERVE_NUM_REQUESTS, SERVE_ARRIVAL_RATE, system_prompts)
+    baseline = serve(trace, model, SERVE_NUM_PAGES)
+    cached = serve(trace, model, SERVE_NUM_PAGES, prefix_caching=True)
+
+    print(f"\n  {'':<16} {'tok/s':>8} {'TTFT p50':>10} {'TTFT p99':>10} {'prefill run':>12}")
+    for name, m in [("no cache", baseline), ("prefix cache", cached)]:
+        prefill_run = m["prefill_tokens"] - m["prefill_tokens_saved"]
+        print(f"  {name:<16} {m['tokens_per_sec']:>8.0f} {m['ttft_p50'] * 1000:>8.1f}ms "
+              f"{m['ttft_p99'] * 1000:>8.1f}ms {prefill_run:>12}")
+    print(f"\n  Block hit rate:        {cached['hit_rate'] * 100:.1f}% of prompt pages looked up")
+    print(f"  Prefill tokens saved:  {cached['prefill_tokens_saved']} of "
+          f"{cached['prefill_tokens']} "
+          f"({cached['prefill_tokens_saved'] / cached['prefill_tokens'] * 100:.0f}%)")
+
+
+def demo_preemption_policies() -> None:
+    print("\n" + "=" * 60)
+    print("PREEMPTION POLICIES UNDER MEMORY PRESSURE")
+    print(f"  {SERVE_NUM_REQUESTS} requests | {SERVE_NUM_PAGES // 4} pages "
+          f"(1/4 of the server budget) | recompute if seq_len <= {RECOMPUTE_MAX_SEQ_LEN}")
+    print("=" * 60)
+
+    model = init_serving_model()
+    trace = make_poisson_trace(SERVE_NUM_REQUESTS, SERVE_ARRIVAL_RATE)
+    print(f"\n  {'':<11} {'tok/s':>8} {'TTFT p99':>10} {'tok p99':>9} {'preempt':>8} "
+          f"{'replayed':>9} {'swap I/O':>10}")
+    for policy in [PREEMPT_RECOMPUTE, PREEMPT_SWAP, PREEMPT_BY_LENGTH]:
+        m = serve(trace, model, SERVE_NUM_PAGES // 4, preemption=policy)
+        print(f"  {policy:<11} {m['tokens_per_sec']:>8.0f} {m['ttft_p99'] * 1000:>8.1f}ms "
+              f"{m['token_p99'] * 1000:>7.2f}ms {m['preemptions']:>8} "
+              f"{m['tokens_recomputed']:>9} {m['swap_bytes'] / 1024:>8.1f}KB")
+    print(f"\n  Swap I/O is charged at {SWAP_BYTES_PER_SEC / 1e6:.0f} MB/s on top of the timed")
+    print("  file calls. Recompute pays a pure-Python forward per replayed token, far more")
+    print("  than moving a page at that rate, so at this cost ratio swap wins. By length")
+    print("  keeps short sequences out of the swap file for a modest replay cost. On a GPU")
+    print("  the replay is one batched prefill while swap crosses PCIe, which is why vLLM")
+    print("  defaults to recompute.")
+
+
+def demo_quantized_kv() -> None:
+    print("\n" + "=" * 60)
+    print("QUANTIZED KV PAGES (per-head scales, dequantized inside attention)")
+    budget = SERVE_NUM_PAGES // 4 * KVBlockPool(1, PAGE_BLOCK_SIZE, MODEL_EMBD).page_nbytes
+    print(f"  Same memory for every scheme: {budget:,} bytes "
+          f"(= {SERVE_NUM_PAGES // 4} float32 pages)")
+    print("=" * 60)
+
+    # Attention error: one sequence written to a float32 pool and a quantized pool
+    seq_len = 13
+    kv = [(rand_vec(MODEL_EMBD), rand_vec(MODEL_EMBD)) for _ in range(seq_len)]
+    queries = [rand_vec(HEAD_DIM) for _ in range(8)]
+    model = init_serving_model()
+    trace = make_poisson_trace(SERVE_NUM_REQUESTS, SERVE_ARRIVAL_RATE)
+    avg_len = sum(len(r["prompt"]) + r["gen_len"] for r in trace) / len(trace)
+    seq_pages = pages_needed(round(avg_len), PAGE_BLOCK_SIZE)
+
+    print(f"\n  {'':<8} {'B/token':>8} {'pages':>6} {'seqs':>5} {'extra':>6} "
+          f"{'max attn err':>13} {'tok/s':>7} {'preempt':>8}")
+    base_seqs = None
+    for scheme in [None] + KV_QUANT_SCHEMES:
+        probe = PagedAllocator(1, PAGE_BLOCK_SIZE, MODEL_EMBD, kv_quant=scheme)
+        page_nbytes = probe.pool.page_nbytes
+        num_pages = budget // page_nbytes
+        alloc = PagedAllocator(pages_needed(seq_len, PAGE_BLOCK_SIZE), PAGE_BLOCK_SIZE,
+                               MODEL_EMBD, kv_quant=scheme)
+        alloc.allocate_request("e")
+        for k, v in kv:
+            alloc.append_token("e", k, v)
+        err = max(
+            abs(a - b)
+            for q in queries for hs in range(0, MODEL_EMBD, HEAD_DIM)
+            for a, b in zip(
+                paged_attention(q, alloc.block_tables["e"], alloc.pool, seq_len, hs),
+                contiguous_attention(q, [k[hs:hs + HEAD_DIM] for k, _ in kv],
+                                     [v[hs:hs + HEAD_DIM] for _, v in kv])))
+        seqs = num_pages // seq_pages
+        if base_seqs is None:
+            base_seqs = seqs
+        m = serve(trace, model, num_pages, kv_quant=scheme)
+        print(f"  {scheme or 'float32':<8} {page_nbytes // PAGE_BLOCK_SIZE:>8} {num_pages:>6} "
+              f"{seqs:>5} {seqs - base_seqs:>+6} {err:>13.2e} "
+              f"{m['tokens_per_sec']:>7.0f} {m['preemptions']:>8}")
+    print(f"\n  seqs = sequences of the trace's average length ({avg_len:.1f} tokens, "
+          f"{seq_pages} pages) that fit;")
+    print("  extra = sequences beyond float32. Error is vs float64 contiguous attention.")
+    print("  Each head dequantizes only its own scale groups, not the whole row, but the")
+    print("  decode still costs CPU here; on a GPU it hides under the memory-bound decode,")
+    print("  and fewer bytes read makes attention faster too.")
 
 
 # === INTERNAL FRAGMENTATION ANALYSIS ===
@@ -599,8 +1625,13 @@ def main() -> None:
     t0 = time.time()
     verify_correctness()
     simulate_serving()
+    benchmark_kv_storage()
+    benchmark_batched_attention()
     demo_cow()
     demo_continuous_batching()
+    demo_preemption_policies()
+    demo_prefix_caching()
+    demo_quantized_kv()
     analyze_fragmentation()
     print(f"\nTotal runtime: {time.time() - t0:.2f}s")
 
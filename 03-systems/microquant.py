@@ -46,6 +46,19 @@ BETA2 = 0.99
 EPS_ADAM = 1e-8
 NUM_STEPS = 800
 
+# Group-wise quantization and calibration
+GROUP_SIZES = [16, 8, 4]  # weights sharing one scale (16 = a full row for N_EMBD inputs)
+CLIP_RATIOS = [1.0 - 0.05 * i for i in range(10)]  # candidate clip ratios: 1.00 .. 0.55
+NUM_CALIB_DOCS = 64  # calibration docs, disjoint from the eval set
+
+# Parallel evaluation harness
+NUM_EVAL_SHARDS = 8  # eval docs split into this many shards per scheme
+CORE_COUNTS = [1, 2, 4, 8, 16]
+
+# Mixed-precision allocation
+MIXED_BITS = [2, 4, 8]  # per-matrix bit widths the allocator may choose
+NUM_FRONTIER_POINTS = 7  # size budgets swept between all-2-bit and all-8-bit
+
 # Data parameters
 DATA_URL = "https://raw.githubusercontent.com/karpathy/makemore/master/names.txt"
 DATA_FILE = "names.txt"
@@ -259,12 +272,37 @@ def gpt_forward(
 # Structurally identical to gpt_forward but operates on dequantized float weights.
 # This separation keeps autograd overhead out of the quantization evaluation path.
 
+def record_input(calib: dict[str, list[list[float]]] | None, name: str, x: list[float]) -> None:
+    """Accumulate H += x x^T for the matmul named `name` (no-op when calib is None).
+
+    H is the second moment of the layer's input -- the "Hessian" of GPTQ. For a
+    weight error E, the summed squared output error over calibration tokens is
+    sum_i E_i^T H E_i, so H is all the calibration data a layer-wise search needs.
+    """
+    if calib is None:
+        return
+    n = len(x)
+    if name not in calib:
+        calib[name] = [[0.0] * n for _ in range(n)]
+    hessian = calib[name]
+    for i in range(n):
+        xi = x[i]
+        row = hessian[i]
+        for j in range(n):
+            row[j] += xi * x[j]
+
+
 def gpt_forward_float(
     token_id: int, pos_id: int,
     keys: list[list[list[float]]], values: list[list[list[float]]],
     float_params: dict[str, list[list[float]]],
+    calib: dict[str, list[list[float]]] | None = None,
 ) -> list[float]:
-    """Single-token forward pass with plain float weights. No gradient tracking."""
+    """Single-token forward pass with plain float weights. No gradient tracking.
+
+    If calib is given, the input of every matmul is accumulated into it (see
+    record_input) -- this is the calibration pass for group-wise quantization.
+    """
     tok_emb = float_params['wte'][token_id]
     pos_emb = float_params['wpe'][pos_id]
     x = [t + p for t, p in zip(tok_emb, pos_emb)]
@@ -273,6 +311,8 @@ def gpt_forward_float(
     for layer_idx in range(N_LAYER):
         x_residual = x
         x = rmsnorm_float(x)
+        for name in ('attn_wq', 'attn_wk', 'attn_wv'):
+            record_input(calib, f'layer{layer_idx}.{name}', x)
         q = linear_float(x, float_params[f'layer{layer_idx}.attn_wq'])
         k = linear_float(x, float_params[f'layer{layer_idx}.attn_wk'])
         v = linear_float(x, float_params[f'layer{layer_idx}.attn_wv'])
@@ -296,15 +336,19 @@ def gpt_forward_float(
             ]
             x_attn.extend(head_out)
 
+        record_input(calib, f'layer{layer_idx}.attn_wo', x_attn)
         x = linear_float(x_attn, float_params[f'layer{layer_idx}.attn_wo'])
         x = [a + b for a, b in zip(x, x_residual)]
         x_residual = x
         x = rmsnorm_float(x)
+        record_input(calib, f'layer{layer_idx}.mlp_fc1', x)
         x = linear_float(x, float_params[f'layer{layer_idx}.mlp_fc1'])
         x = [max(0.0, xi) for xi in x]  # ReLU on plain floats
+        record_input(calib, f'layer{layer_idx}.mlp_fc2', x)
         x = linear_float(x, float_params[f'layer{layer_idx}.mlp_fc2'])
         x = [a + b for a, b in zip(x, x_residual)]
 
+    record_input(calib, 'lm_head', x)
     return linear_float(x, float_params['lm_head'])
 
 
@@ -431,6 +475,275 @@ def dequantize_per_channel(
     ]
 
 
+# === GROUP-WISE QUANTIZATION WITH CALIBRATION ===
+# Per-channel gives each row one scale; group-wise goes further and gives every
+# run of `group_size` consecutive weights in a row its own scale, so one outlier
+# only coarsens the grid for its group. The cost is one scale per group: with
+# fp16 scales, 4-bit group-8 storage is 4 + 16/8 = 6 bits per weight.
+#
+# Round-to-nearest with scale = absmax / qmax spends grid levels on the single
+# largest weight. Clipping the range (scale = ratio * absmax / qmax) rounds the
+# bulk more finely at the cost of saturating the outliers. Which ratio wins
+# depends on the data flowing through the layer, so -- as in GPTQ and AWQ -- we
+# run calibration docs through gpt_forward_float, accumulate each matmul's input
+# second moment H, and pick per group the ratio minimizing the output error
+# e^T H e instead of the weight error e^T e.
+
+def quantize_groupwise(
+    weights_float: list[list[float]], bits: int, group_size: int,
+    clip_ratios: list[list[float]] | None = None,
+) -> tuple[list[list[int]], list[list[float]]]:
+    """Symmetric absmax quantization with one scale per (row, group of columns).
+
+    clip_ratios[i][g] shrinks the range of group g in row i (default 1.0: no clipping).
+    Returns (quantized, scales) with scales[i][g] the scale of that group.
+    """
+    qmax = 2 ** (bits - 1) - 1
+    quantized: list[list[int]] = []
+    scales: list[list[float]] = []
+    for i, row in enumerate(weights_float):
+        q_row: list[int] = []
+        row_scales: list[float] = []
+        for g, start in enumerate(range(0, len(row), group_size)):
+            group = row[start:start + group_size]
+            ratio = clip_ratios[i][g] if clip_ratios is not None else 1.0
+            scale = ratio * max(abs(w) for w in group) / qmax or 1.0
+            row_scales.append(scale)
+            q_row.extend(max(-qmax - 1, min(qmax, round(w / scale))) for w in group)
+        quantized.append(q_row)
+        scales.append(row_scales)
+    return quantized, scales
+
+
+def dequantize_groupwise(
+    quantized: list[list[int]], scales: list[list[float]], group_size: int,
+) -> list[list[float]]:
+    """w_hat[i][j] = q[i][j] * scales[i][j // group_size]."""
+    return [
+        [q * scales[i][j // group_size] for j, q in enumerate(quantized[i])]
+        for i in range(len(quantized))
+    ]
+
+
+def collect_calibration_stats(
+    float_params: dict[str, list[list[float]]],
+    calib_docs: list[str],
+    unique_chars: list[str],
+    bos: int,
+) -> dict[str, list[list[float]]]:
+    """Run gpt_forward_float over calibration docs, returning H = sum x x^T per matmul."""
+    calib: dict[str, list[list[float]]] = {}
+    for doc in calib_docs:
+        tokens = [bos] + [unique_chars.index(ch) for ch in doc] + [bos]
+        keys: list[list[list[float]]] = [[] for _ in range(N_LAYER)]
+        values: list[list[list[float]]] = [[] for _ in range(N_LAYER)]
+        for pos in range(min(BLOCK_SIZE, len(tokens) - 1)):
+            gpt_forward_float(tokens[pos], pos, keys, values, float_params, calib)
+    return calib
+
+
+def quadratic_error(err: list[float], hessian: list[list[float]] | None, offset: int = 0) -> float:
+    """e^T H e over the columns [offset, offset + len(err)); plain e^T e when H is None."""
+    if hessian is None:
+        return sum(e * e for e in err)
+    return sum(
+        err[a] * sum(hessian[offset + a][offset + b] * err[b] for b in range(len(err)))
+        for a in range(len(err))
+    )
+
+
+def search_clip_ratios(
+    weights_float: list[list[float]], hessian: list[list[float]] | None,
+    bits: int, group_size: int,
+) -> list[list[float]]:
+    """Per (row, group), the CLIP_RATIOS entry minimizing that group's output error.
+
+    Groups are searched independently using the diagonal block of H -- the
+    cross-group terms are ignored, the same approximation AWQ's grid search makes.
+    Embedding tables have no matmul input (hessian=None) and fall back to weight error.
+    """
+    qmax = 2 ** (bits - 1) - 1
+    ratios: list[list[float]] = []
+    for row in weights_float:
+        row_ratios: list[float] = []
+        for start in range(0, len(row), group_size):
+            group = row[start:start + group_size]
+            max_abs = max(abs(w) for w in group)
+            best_ratio, best_err = 1.0, float('inf')
+            for ratio in CLIP_RATIOS:
+                scale = ratio * max_abs / qmax or 1.0
+                err = [w - max(-qmax - 1, min(qmax, round(w / scale))) * scale for w in group]
+                e = quadratic_error(err, hessian, start)
+                if e < best_err:
+                    best_ratio, best_err = ratio, e
+            row_ratios.append(best_ratio)
+        ratios.append(row_ratios)
+    return ratios
+
+
+def compute_output_error(
+    original: dict[str, list[list[float]]],
+    dequantized: dict[str, list[list[float]]],
+    calib: dict[str, list[list[float]]],
+) -> float:
+    """Relative output error sum_i E_i^T H E_i / sum_i W_i^T H W_i over all matmuls.
+
+    Unlike compute_roundtrip_error this weighs each weight error by how strongly the
+    calibration activations excite its input column -- the quantity calibration minimizes.
+    """
+    num = den = 0.0
+    for name, hessian in calib.items():
+        for orig_row, deq_row in zip(original[name], dequantized[name]):
+            num += quadratic_error([o - d for o, d in zip(orig_row, deq_row)], hessian)
+            den += quadratic_error(orig_row, hessian)
+    return num / den
+
+
+# === INTEGER-DOMAIN INFERENCE ===
+# Everything above dequantizes back to float lists before the forward pass, so the
+# quantized model is exactly as big and as slow as the float one. Here the weights
+# stay packed -- int8 as signed bytes (a bytearray viewed through memoryview
+# cast 'b'), int4 as two offset nibbles (q + 8) per byte -- and the matmul runs on
+# the integers:
+#
+#   y_i = s_i * sum_j q_ij * x_j                   (W8A32 / W4A32: weight-only)
+#   y_i = s_i * s_x * sum_j q_ij * xq_j            (W8A8 / W4A8: activations too)
+#
+# The row scale s_i is applied once per output, after the dot product, not once per
+# weight. With int8 activations (xq = round(x / s_x), one absmax scale per vector)
+# the whole dot product is integer arithmetic -- what INT8 tensor cores execute --
+# and the float work per output row is a single multiply.
+
+# Signed nibble decode tables: byte -> low / high 4-bit value in [-8, 7]
+INT4_LO = [(b & 0x0F) - 8 for b in range(256)]
+INT4_HI = [(b >> 4) - 8 for b in range(256)]
+
+
+def pack_int_matrix(quantized: list[list[int]], scales: list[float], bits: int) -> dict:
+    """Pack an integer matrix with one scale per row into a bytearray.
+
+    bits=8: one signed byte per weight. bits=4: two weights per byte, low nibble
+    first, stored as q + 8 so the range [-8, 7] fits in [0, 15].
+    """
+    n_rows, n_cols = len(quantized), len(quantized[0])
+    if bits == 8:
+        data = bytearray(n_rows * n_cols)
+        codes = memoryview(data).cast('b')
+        for i, row in enumerate(quantized):
+            row_codes = memoryview(bytearray(q & 0xFF for q in row)).cast('b')
+            codes[i * n_cols:(i + 1) * n_cols] = row_codes
+    elif bits == 4:
+        assert n_cols % 2 == 0, "int4 packing needs an even number of columns"
+        data = bytearray((q0 + 8) | ((q1 + 8) << 4)
+                         for row in quantized for q0, q1 in zip(row[0::2], row[1::2]))
+    else:
+        raise ValueError(f"unsupported bit width: {bits}")
+    return {'bits': bits, 'rows': n_rows, 'cols': n_cols, 'data': data, 'scales': scales}
+
+
+def quantize_packed(weights_float: list[list[float]], bits: int, per_channel: bool = True) -> dict:
+    """Symmetric absmax quantization straight into packed storage (per row or per tensor)."""
+    qmax = 127 if bits == 8 else 7
+    if per_channel:
+        scales = [max(abs(w) for w in row) / qmax or 1.0 for row in weights_float]
+    else:
+        scale = max(abs(w) for row in weights_float for w in row) / qmax or 1.0
+        scales = [scale] * len(weights_float)
+    quantized = [[max(-qmax - 1, min(qmax, round(w / s))) for w in row]
+                 for row, s in zip(weights_float, scales)]
+    return pack_int_matrix(quantized, scales, bits)
+
+
+def int_row(w: dict, i: int) -> list[int]:
+    """Row i of a packed matrix as Python ints (used for embedding lookups)."""
+    c = w['cols']
+    if w['bits'] == 8:
+        return list(memoryview(w['data']).cast('b')[i * c:(i + 1) * c])
+    out: list[int] = []
+    for b in w['data'][i * c // 2:(i + 1) * c // 2]:
+        out.append(INT4_LO[b])
+        out.append(INT4_HI[b])
+    return out
+
+
+def quantize_activation_int8(x: list[float]) -> tuple[list[int], float]:
+    """Dynamic per-vector absmax int8 quantization of an activation."""
+    s_x = max(abs(v) for v in x) / 127.0 or 1.0
+    return [round(v / s_x) for v in x], s_x
+
+
+def linear_int(x: list[float], w: dict, act_int8: bool = False) -> list[float]:
+    """y = W @ x with W packed int8/int4: integer-weight dot products, one scale per row."""
+    c = w['cols']
+    scales = w['scales']
+    if act_int8:
+        x, s_x = quantize_activation_int8(x)
+        scales = [s * s_x for s in scales]
+    if w['bits'] == 8:
+        codes = memoryview(w['data']).cast('b')
+        return [s * sum(q * xj for q, xj in zip(codes[i * c:(i + 1) * c], x))
+                for i, s in enumerate(scales)]
+    data = w['data']
+    half = c // 2
+    x_even, x_odd = x[0::2], x[1::2]
+    return [s * sum(INT4_LO[b] * x0 + INT4_HI[b] * x1
+                    for b, x0, x1 in zip(data[i * half:(i + 1) * half], x_even, x_odd))
+            for i, s in enumerate(scales)]
+
+
+def gpt_forward_int(
+    token_id: int, pos_id: int,
+    keys: list[list[list[float]]], values: list[list[list[float]]],
+    qmodel: dict,
+) -> list[float]:
+    """gpt_forward_float with every weight kept packed: matmuls through linear_int,
+    embedding rows dequantized on lookup. qmodel['act_int8'] also quantizes the
+    activations entering each matmul."""
+    act = qmodel.get('act_int8', False)
+    wte, wpe = qmodel['wte'], qmodel['wpe']
+    tok_emb = [q * wte['scales'][token_id] for q in int_row(wte, token_id)]
+    pos_emb = [q * wpe['scales'][pos_id] for q in int_row(wpe, pos_id)]
+    x = [t + p for t, p in zip(tok_emb, pos_emb)]
+    x = rmsnorm_float(x)
+
+    for layer_idx in range(N_LAYER):
+        x_residual = x
+        x = rmsnorm_float(x)
+        q = linear_int(x, qmodel[f'layer{layer_idx}.attn_wq'], act)
+        k = linear_int(x, qmodel[f'layer{layer_idx}.attn_wk'], act)
+        v = linear_int(x, qmodel[f'layer{layer_idx}.attn_wv'], act)
+        keys[layer_idx].append(k)
+        values[layer_idx].append(v)
+
+        x_attn: list[float] = []
+        for head in range(N_HEAD):
+            hs = head * HEAD_DIM
+            q_h = q[hs:hs + HEAD_DIM]
+            k_h = [k_t[hs:hs + HEAD_DIM] for k_t in keys[layer_idx]]
+            v_h = [v_t[hs:hs + HEAD_DIM] for v_t in values[layer_idx]]
+            attn_logits = [
+                sum(q_h[j] * k_h[t][j] for j in range(HEAD_DIM)) / (HEAD_DIM ** 0.5)
+                for t in range(len(k_h))
+            ]
+            attn_weights = softmax_float(attn_logits)
+            head_out = [
+                sum(attn_weights[t] * v_h[t][j] for t in range(len(v_h)))
+                for j in range(HEAD_DIM)
+            ]
+            x_attn.extend(head_out)
+
+        x = linear_int(x_attn, qmodel[f'layer{layer_idx}.attn_wo'], act)
+        x = [a + b for a, b in zip(x, x_residual)]
+        x_residual = x
+        x = rmsnorm_float(x)
+        x = linear_int(x, qmodel[f'layer{layer_idx}.mlp_fc1'], act)
+        x = [max(0.0, xi) for xi in x]
+        x = linear_int(x, qmodel[f'layer{layer_idx}.mlp_fc2'], act)
+        x = [a + b for a, b in zip(x, x_residual)]
+
+    return linear_int(x, qmodel['lm_head'], act)
+
+
 # === EVALUATION HELPERS ===
 
 def extract_float_weights(params: dict) -> dict[str, list[list[float]]]:
@@ -469,28 +782,40 @@ def compute_roundtrip_error(
     return max_err
 
 
-def evaluate_loss(
+def token_nlls(
     float_params: dict[str, list[list[float]]],
     eval_docs: list[str],
     unique_chars: list[str],
     bos: int,
-) -> float:
-    """Average cross-entropy loss on evaluation documents using float forward pass."""
-    total_loss = 0.0
-    total_tokens = 0
+    forward=gpt_forward_float,
+) -> list[float]:
+    """Per-token negative log-likelihoods, in document order."""
+    nlls: list[float] = []
     for doc in eval_docs:
         tokens = [bos] + [unique_chars.index(ch) for ch in doc] + [bos]
         seq_len = min(BLOCK_SIZE, len(tokens) - 1)
         keys: list[list[list[float]]] = [[] for _ in range(N_LAYER)]
         values: list[list[list[float]]] = [[] for _ in range(N_LAYER)]
         for pos in range(seq_len):
-            logits = gpt_forward_float(tokens[pos], pos, keys, values, float_params)
+            logits = forward(tokens[pos], pos, keys, values, float_params)
             probs = softmax_float(logits)
             # Cross-entropy: -log(p(target))
             p_target = max(probs[tokens[pos + 1]], 1e-10)
-            total_loss += -math.log(p_target)
-            total_tokens += 1
-    return total_loss / total_tokens if total_tokens > 0 else float('inf')
+            nlls.append(-math.log(p_target))
+    return nlls
+
+
+def evaluate_loss(
+    float_params: dict[str, list[list[float]]],
+    eval_docs: list[str],
+    unique_chars: list[str],
+    bos: int,
+    forward=gpt_forward_float,
+) -> float:
+    """Average cross-entropy loss on evaluation documents using float forward pass
+    (or any forward with the same signature, e.g. gpt_forward_int)."""
+    nlls = token_nlls(float_params, eval_docs, unique_chars, bos, forward)
+    return sum(nlls) / len(nlls) if nlls else float('inf')
 
 
 def generate_sample(
@@ -516,6 +841,174 @@ def generate_sample(
     return ''.join(generated)
 
 
+# === MIXED-PRECISION BIT ALLOCATION ===
+# Uniform quantization gives every matrix the same bits, but matrices are not
+# equally sensitive: the lm_head's errors land directly on the logits, while an
+# embedding row error is diluted by the rmsnorm that follows. Mixed precision
+# spends bits where they buy the most loss.
+#
+# Step 1, sensitivity: quantize ONE matrix at a time (everything else float) to
+# each candidate width and record the loss increase. Step 2, allocation: treating
+# the increases as additive, choose one width per matrix to minimize the summed
+# increase subject to a size budget -- a multiple-choice knapsack, solved exactly
+# by dynamic programming over the reachable model sizes.
+
+def fake_quantize(matrix: list[list[float]], bits: int) -> list[list[float]]:
+    """Per-channel symmetric quantize-dequantize at any bit width (one group per row)."""
+    q, scales = quantize_groupwise(matrix, bits, len(matrix[0]))
+    return dequantize_groupwise(q, scales, len(matrix[0]))
+
+
+def matrix_bytes(matrix: list[list[float]], bits: int) -> int:
+    """Storage for a matrix at `bits` per weight plus one fp16 scale per row."""
+    return len(matrix) * len(matrix[0]) * bits // 8 + 2 * len(matrix)
+
+
+def measure_sensitivity(
+    float_weights: dict[str, list[list[float]]],
+    docs: list[str],
+    unique_chars: list[str],
+    bos: int,
+) -> dict[str, dict[int, float]]:
+    """Loss increase from quantizing each matrix alone to each width in MIXED_BITS.
+
+    Raw differences at 8 and sometimes 4 bits are within evaluation noise and can
+    come out negative. They are clamped at zero and made non-increasing in bits, so
+    fewer bits never looks cheaper than more.
+    """
+    base = evaluate_loss(float_weights, docs, unique_chars, bos)
+    sensitivity: dict[str, dict[int, float]] = {}
+    for name, matrix in float_weights.items():
+        sensitivity[name] = {}
+        floor = 0.0
+        for bits in sorted(MIXED_BITS, reverse=True):
+            trial = dict(float_weights)
+            trial[name] = fake_quantize(matrix, bits)
+            floor = max(floor, evaluate_loss(trial, docs, unique_chars, bos) - base)
+            sensitivity[name][bits] = floor
+    return sensitivity
+
+
+def allocate_bits(
+    float_weights: dict[str, list[list[float]]],
+    sensitivity: dict[str, dict[int, float]],
+    budget_bytes: int,
+) -> tuple[dict[str, int], float, int] | None:
+    """Multiple-choice knapsack: one width per matrix, minimum predicted loss increase.
+
+    DP state: model size so far -> (cheapest predicted increase, plan). Sizes are
+    integers and few distinct sums are reachable, so the table stays small.
+    Ties go to the larger model (spare budget buys precision even when the predicted
+    gain is zero). Returns (plan, predicted increase, size), or None if even
+    all-minimum-bits exceeds the budget.
+    """
+    best: dict[int, tuple[float, dict[str, int]]] = {0: (0.0, {})}
+    for name, matrix in float_weights.items():
+        nxt: dict[int, tuple[float, dict[str, int]]] = {}
+        for size, (cost, plan) in best.items():
+            for bits in MIXED_BITS:
+                new_size = size + matrix_bytes(matrix, bits)
+                new_cost = cost + sensitivity[name][bits]
+                if new_size > budget_bytes:
+                    continue
+                if new_size not in nxt or new_cost < nxt[new_size][0]:
+                    nxt[new_size] = (new_cost, {**plan, name: bits})
+        best = nxt
+    if not best:
+        return None
+    size, (cost, plan) = min(best.items(), key=lambda item: (item[1][0], -item[0]))
+    return plan, cost, size
+
+
+def apply_plan(
+    float_weights: dict[str, list[list[float]]], plan: dict[str, int],
+) -> dict[str, list[list[float]]]:
+    """Quantize each matrix to the width the plan assigns it."""
+    return {name: fake_quantize(matrix, plan[name]) for name, matrix in float_weights.items()}
+
+
+# === PARALLEL EVALUATION HARNESS ===
+# Every scheme is evaluated on the same docs, and every doc is independent (fresh
+# KV cache), so the work is a grid of schemes x doc shards with no dependencies --
+# embarrassingly parallel. A harness fans the tasks out to workers and merges
+# the per-token NLLs back in document order, so the merged loss is bit-identical to
+# the sequential evaluate_loss (same floats, same summation order). The main script
+# computes every scheme's loss this way, so the harness phase schedules tasks that
+# have already run instead of evaluating the schemes a second time.
+#
+# This script has no process pool (stdlib multiprocessing is outside its toolset),
+# so, like microparallel.py, workers are simulated: each task runs for real and is
+# timed, then the timed tasks are list-scheduled onto P workers. The simulated wall
+# time is the busiest worker's load -- the critical path of the schedule.
+#
+# Shipping weights: pickling a scheme's weights with every task sends them
+# (schemes x shards) times; sending once per worker, P x schemes times; placing
+# them in shared memory that all workers map read-only, schemes times -- once.
+
+def shard_docs(docs: list[str], n_shards: int) -> list[list[str]]:
+    """Split docs into n_shards contiguous shards (sizes differ by at most one)."""
+    base, extra = divmod(len(docs), n_shards)
+    shards: list[list[str]] = []
+    start = 0
+    for i in range(n_shards):
+        end = start + base + (1 if i < extra else 0)
+        shards.append(docs[start:end])
+        start = end
+    return shards
+
+
+def run_eval_tasks(
+    schemes: dict[str, dict[str, list[list[float]]]],
+    shards: list[list[str]],
+    unique_chars: list[str],
+    bos: int,
+) -> dict[tuple[str, int], tuple[list[float], float]]:
+    """Execute every (scheme, shard) task, returning its token NLLs and its runtime."""
+    results: dict[tuple[str, int], tuple[list[float], float]] = {}
+    for name, weights in schemes.items():
+        for shard_idx, shard in enumerate(shards):
+            t0 = time.perf_counter()
+            nlls = token_nlls(weights, shard, unique_chars, bos)
+            results[(name, shard_idx)] = (nlls, time.perf_counter() - t0)
+    return results
+
+
+def merge_losses(
+    results: dict[tuple[str, int], tuple[list[float], float]], n_shards: int,
+) -> dict[str, float]:
+    """Concatenate each scheme's shard NLLs in shard order and average them."""
+    losses: dict[str, float] = {}
+    for name in dict.fromkeys(name for name, _ in results):
+        nlls = [nll for i in range(n_shards) for nll in results[(name, i)][0]]
+        losses[name] = sum(nlls) / len(nlls)
+    return losses
+
+
+def evaluate_sharded(
+    name: str,
+    weights: dict[str, list[list[float]]],
+    shards: list[list[str]],
+    unique_chars: list[str],
+    bos: int,
+    results: dict[tuple[str, int], tuple[list[float], float]],
+) -> float:
+    """evaluate_loss as one timed task per shard. The tasks are recorded in results
+    under name; the returned loss is merged from their NLLs."""
+    tasks = run_eval_tasks({name: weights}, shards, unique_chars, bos)
+    results.update(tasks)
+    return merge_losses(tasks, len(shards))[name]
+
+
+def schedule_makespan(durations: list[float], n_workers: int) -> float:
+    """Longest-processing-time-first list scheduling: each task, longest first, goes
+    to the least-loaded worker. Returns the busiest worker's load (within 4/3 of optimal)."""
+    loads = [0.0] * n_workers
+    for d in sorted(durations, reverse=True):
+        i = loads.index(min(loads))
+        loads[i] += d
+    return max(loads)
+
+
 # === TRAINING AND QUANTIZATION ===
 
 if __name__ == "__main__":
@@ -596,8 +1089,14 @@ if __name__ == "__main__":
     # Use a fixed evaluation set (first 200 docs) for consistent loss comparison
     eval_docs = docs[:200]
 
+    # Each scheme's loss is computed as timed shard tasks, kept in eval_tasks for
+    # the parallel evaluation harness (PHASE 6d)
+    eval_shards = shard_docs(eval_docs, NUM_EVAL_SHARDS)
+    eval_tasks: dict[tuple[str, int], tuple[list[float], float]] = {}
+
     # Baseline loss with original float32 weights
-    baseline_loss = evaluate_loss(float_weights, eval_docs, unique_chars, BOS)
+    baseline_loss = evaluate_sharded("Float32 (baseline)", float_weights, eval_shards,
+                                     unique_chars, BOS, eval_tasks)
     print(f"Float32 baseline loss: {baseline_loss:.4f}")
 
     # Seed reset for reproducible generation across all quantization variants
@@ -611,7 +1110,8 @@ if __name__ == "__main__":
         q, s = quantize_absmax_int8(matrix)
         int8_weights[name] = dequantize_absmax(q, s)
 
-    int8_loss = evaluate_loss(int8_weights, eval_docs, unique_chars, BOS)
+    int8_loss = evaluate_sharded("INT8 absmax", int8_weights, eval_shards,
+                                 unique_chars, BOS, eval_tasks)
     random.seed(42)
     int8_sample = generate_sample(int8_weights, unique_chars, BOS, VOCAB_SIZE)
     int8_err = compute_roundtrip_error(float_weights, int8_weights)
@@ -624,7 +1124,8 @@ if __name__ == "__main__":
         q, s = quantize_absmax_int4(matrix)
         int4_weights[name] = dequantize_absmax(q, s)
 
-    int4_loss = evaluate_loss(int4_weights, eval_docs, unique_chars, BOS)
+    int4_loss = evaluate_sharded("INT4 absmax", int4_weights, eval_shards,
+                                 unique_chars, BOS, eval_tasks)
     random.seed(42)
     int4_sample = generate_sample(int4_weights, unique_chars, BOS, VOCAB_SIZE)
     int4_err = compute_roundtrip_error(float_weights, int4_weights)
@@ -640,7 +1141,8 @@ if __name__ == "__main__":
         q, s, zp = quantize_zeropoint_int8(matrix)
         zp_weights[name] = dequantize_zeropoint(q, s, zp)
 
-    zp_loss = evaluate_loss(zp_weights, eval_docs, unique_chars, BOS)
+    zp_loss = evaluate_sharded("INT8 zero-point", zp_weights, eval_shards,
+                               unique_chars, BOS, eval_tasks)
     random.seed(42)
     zp_sample = generate_sample(zp_weights, unique_chars, BOS, VOCAB_SIZE)
     zp_err = compute_roundtrip_error(float_weights, zp_weights)
@@ -656,12 +1158,168 @@ if __name__ == "__main__":
         q, scales = quantize_per_channel_int8(matrix)
         pc_weights[name] = dequantize_per_channel(q, scales)
 
-    pc_loss = evaluate_loss(pc_weights, eval_docs, unique_chars, BOS)
+    pc_loss = evaluate_sharded("INT8 per-channel", pc_weights, eval_shards,
+                               unique_chars, BOS, eval_tasks)
     random.seed(42)
     pc_sample = generate_sample(pc_weights, unique_chars, BOS, VOCAB_SIZE)
     pc_err = compute_roundtrip_error(float_weights, pc_weights)
     print(f"INT8 per-channel loss: {pc_loss:.4f} (delta: {(pc_loss - baseline_loss) / baseline_loss * 100:+.1f}%)")
 
+    # === PHASE 6b: INTEGER-DOMAIN INFERENCE ===
+    # Same quantization, but the forward pass never materializes float weights.
+    # W8 per-channel should match the dequantized per-channel loss above (same
+    # integers, same scales); the W*A8 rows add activation rounding on top.
+    print("\n=== Integer-Domain Inference (packed weights, per-row scales) ===")
+    n_eval_tokens = sum(min(BLOCK_SIZE, len(d) + 1) for d in eval_docs)
+    t0 = time.time()
+    float_loss = evaluate_loss(float_weights, eval_docs, unique_chars, BOS)
+    float_tps = n_eval_tokens / (time.time() - t0)
+    # Every loss above came from evaluate_sharded; this reference run checks that the
+    # merged shard NLLs give exactly the sequential evaluate_loss result.
+    assert float_loss == baseline_loss, "sharded loss must equal evaluate_loss exactly"
+    float_bytes = compute_model_size(float_weights, 32)
+    print(f"{'Path':<22} {'Weight bytes':>13} {'Loss':>8} {'Delta':>8} {'Tok/s':>8} "
+          f"{'vs float':>9}")
+    print("-" * 72)
+    print(f"{'float32 (reference)':<22} {float_bytes:>13,} {baseline_loss:>8.4f} {'---':>8} "
+          f"{float_tps:>8.0f} {'1.00x':>9}")
+    int_path_losses: dict[str, float] = {}
+    for label, bits, act_int8 in [("W8A32 int8", 8, False), ("W8A8 int8+act", 8, True),
+                                  ("W4A32 int4", 4, False), ("W4A8 int4+act", 4, True)]:
+        qmodel: dict = {name: quantize_packed(matrix, bits)
+                        for name, matrix in float_weights.items()}
+        qmodel['act_int8'] = act_int8
+        packed_bytes = sum(len(w['data']) + 4 * len(w['scales'])
+                           for name, w in qmodel.items() if name != 'act_int8')
+        t0 = time.time()
+        q_loss = evaluate_loss(qmodel, eval_docs, unique_chars, BOS, forward=gpt_forward_int)
+        tps = n_eval_tokens / (time.time() - t0)
+        int_path_losses[label] = q_loss
+        print(f"{label:<22} {packed_bytes:>13,} {q_loss:>8.4f} "
+              f"{(q_loss - baseline_loss) / baseline_loss * 100:>+7.1f}% {tps:>8.0f} "
+              f"{tps / float_tps:>8.2f}x")
+    w8_gap = int_path_losses['W8A32 int8'] - pc_loss
+    print(f"(W8A32 vs dequantized per-channel INT8: {w8_gap:+.2e})")
+    # Signpost: in CPython an int*float multiply costs what a float*float does, so the
+    # integer path wins on memory (4-8x fewer weight bytes), not speed. The speed
+    # comes on hardware: INT8 tensor cores run 2x the FLOPs of FP16, and decoding is
+    # memory-bound, so streaming 4-8x fewer weight bytes is 4-8x less time per token.
+
+    # === PHASE 6c: GROUP-WISE INT4 WITH CALIBRATION ===
+    # Calibration docs come from outside the eval set, as a real calibration set
+    # would: the clip ratios must generalize, not memorize the eval tokens.
+    print("\n=== Group-Wise INT4 with Calibrated Clipping ===")
+    calib_docs = docs[len(eval_docs):len(eval_docs) + NUM_CALIB_DOCS]
+    calib = collect_calibration_stats(float_weights, calib_docs, unique_chars, BOS)
+    int4_out_err = compute_output_error(float_weights, int4_weights, calib)
+    print(f"{'Scheme':<28} {'Bits/w':>7} {'Out Err':>9} {'Loss':>8} {'Delta':>8}")
+    print("-" * 64)
+    print(f"{'INT4 absmax (per-tensor)':<28} {4.0:>7.2f} {int4_out_err:>9.5f} {int4_loss:>8.4f} "
+          f"{(int4_loss - baseline_loss) / baseline_loss * 100:>+7.1f}%")
+    group_results: dict[tuple[int, bool], tuple[float, dict[str, list[list[float]]]]] = {}
+    for group_size in GROUP_SIZES:
+        for calibrated in (False, True):
+            g_weights: dict[str, list[list[float]]] = {}
+            for name, matrix in float_weights.items():
+                ratios = (search_clip_ratios(matrix, calib.get(name), 4, group_size)
+                          if calibrated else None)
+                q, group_scales = quantize_groupwise(matrix, 4, group_size, ratios)
+                g_weights[name] = dequantize_groupwise(q, group_scales, group_size)
+            label = f"INT4 group-{group_size}" + (" + clip search" if calibrated else " RTN")
+            g_loss = evaluate_sharded(label, g_weights, eval_shards, unique_chars, BOS,
+                                      eval_tasks)
+            group_results[(group_size, calibrated)] = (g_loss, g_weights)
+            print(f"{label:<28} {4 + 16 / group_size:>7.2f} "
+                  f"{compute_output_error(float_weights, g_weights, calib):>9.5f} {g_loss:>8.4f} "
+                  f"{(g_loss - baseline_loss) / baseline_loss * 100:>+7.1f}%")
+    # Bits/w counts one fp16 scale per group. Group-16 is per-channel for the N_EMBD-wide
+    # matrices; mlp_fc2 (64 inputs) still splits into four groups.
+    # Signpost: clip search reliably lowers the output error it optimizes, but on a
+    # model this small the INT4 loss deltas are a few tenths of a percent and the
+    # residual noise can reorder them. At LLM scale, where outlier channels dominate
+    # the rounding error, calibrated methods are what make 4-bit usable at all.
+
+    gq_loss, gq_weights = group_results[(8, True)]
+    random.seed(42)
+    gq_sample = generate_sample(gq_weights, unique_chars, BOS, VOCAB_SIZE)
+    gq_err = compute_roundtrip_error(float_weights, gq_weights)
+
+    # === PHASE 6d: PARALLEL EVALUATION HARNESS ===
+    # Schedule the shard tasks the comparison-table schemes already ran above. Their
+    # losses were merged from these same NLLs, so nothing is evaluated again here.
+    print("\n=== Parallel Evaluation Harness (simulated workers) ===")
+    scheme_names = ["Float32 (baseline)", "INT8 absmax", "INT8 per-channel", "INT8 zero-point",
+                    "INT4 absmax", "INT4 group-8 + clip search"]
+    durations = [eval_tasks[(name, i)][1]
+                 for name in scheme_names for i in range(NUM_EVAL_SHARDS)]
+    total_work = sum(durations)
+    n_tasks = len(durations)
+    weight_floats = sum(len(row) for matrix in float_weights.values() for row in matrix)
+    print(f"{len(scheme_names)} schemes x {NUM_EVAL_SHARDS} shards = {n_tasks} tasks, "
+          f"{total_work:.2f}s of work, longest task {max(durations) * 1000:.0f} ms")
+    print(f"{'Cores':>5} {'Sim wall (s)':>12} {'Speedup':>8} {'Efficiency':>11} "
+          f"{'Floats/task':>12} {'Floats/worker':>14} {'Shared mem':>11}")
+    print("-" * 79)
+    for cores in CORE_COUNTS:
+        wall = schedule_makespan(durations, cores)
+        speedup = total_work / wall
+        per_worker = min(cores, n_tasks) * len(scheme_names) * weight_floats
+        print(f"{cores:>5} {wall:>12.2f} {speedup:>7.2f}x {speedup / cores:>10.0%} "
+              f"{n_tasks * weight_floats:>12,} {per_worker:>14,} "
+              f"{len(scheme_names) * weight_floats:>11,}")
+    # Speedup tracks the core count until cores approach the task count; past that the
+    # longest shard is the floor. More, smaller shards push the floor down at the
+    # cost of more per-task overhead -- the same granularity tradeoff as micro-batches.
+
+    # === PHASE 6e: MIXED-PRECISION BIT ALLOCATION ===
+    # Sensitivities are measured on the calibration docs so the plan is not fit to
+    # the eval set; the frontier losses below are then measured on the eval set.
+    print("\n=== Mixed-Precision Bit Allocation ===")
+    sensitivity = measure_sensitivity(float_weights, calib_docs, unique_chars, BOS)
+    print("Per-matrix sensitivity (calibration loss increase, that matrix alone quantized):")
+    print(f"{'Matrix':<18} {'Params':>7}" + "".join(f"{f'{b}-bit':>10}" for b in MIXED_BITS))
+    for name, matrix in float_weights.items():
+        print(f"{name:<18} {len(matrix) * len(matrix[0]):>7,}"
+              + "".join(f"{sensitivity[name][b]:>10.4f}" for b in MIXED_BITS))
+
+    uniform_sizes = {b: sum(matrix_bytes(m, b) for m in float_weights.values())
+                     for b in MIXED_BITS}
+    lo, hi = uniform_sizes[MIXED_BITS[0]], uniform_sizes[MIXED_BITS[-1]]
+    budgets = sorted({lo + (hi - lo) * i // (NUM_FRONTIER_POINTS - 1)
+                      for i in range(NUM_FRONTIER_POINTS)} | set(uniform_sizes.values()))
+    print(f"\nSize/loss frontier (eval loss; uniform = per-channel at one width everywhere):")
+    print(f"{'Budget':>8} {'Size':>7} {'Avg bits':>9} {'Pred dL':>9} {'Loss':>8} "
+          f"{'Delta':>8}  Uniform")
+    print("-" * 72)
+    n_weights = sum(len(row) for matrix in float_weights.values() for row in matrix)
+    plans: dict[int, dict[str, int]] = {}
+    for budget in budgets:
+        allocation = allocate_bits(float_weights, sensitivity, budget)
+        if allocation is None:
+            continue
+        plan, predicted, size = allocation
+        plans[budget] = plan
+        mp_loss = evaluate_loss(apply_plan(float_weights, plan), eval_docs, unique_chars, BOS)
+        uniform = ""
+        if budget in uniform_sizes.values():
+            bits = next(b for b in MIXED_BITS if uniform_sizes[b] == budget)
+            uniform_plan = {name: bits for name in float_weights}
+            uniform_loss = evaluate_loss(apply_plan(float_weights, uniform_plan),
+                                         eval_docs, unique_chars, BOS)
+            uniform = f"{bits}-bit: {uniform_loss:.4f}"
+        avg_bits = sum(len(m) * len(m[0]) * plan[n] for n, m in float_weights.items()) / n_weights
+        print(f"{budget:>7,}B {size:>6,}B {avg_bits:>9.2f} {predicted:>+9.4f} {mp_loss:>8.4f} "
+              f"{(mp_loss - baseline_loss) / baseline_loss * 100:>+7.1f}%  {uniform}")
+
+    plan_4 = plans[uniform_sizes[4]]
+    print(f"\nPlan at the uniform 4-bit budget ({uniform_sizes[4]:,} B):")
+    for name in float_weights:
+        print(f"  {name:<18} {plan_4[name]}-bit")
+    # At an equal budget the allocator can only match or beat uniform on the
+    # predicted loss (uniform is one of its candidates). The measured loss can
+    # disagree where per-matrix errors interact -- additivity is an approximation,
+    # the one HAWQ and similar methods also make.
+
     # === PHASE 7: COMPARISON TABLE ===
     t_end = time.time()
 
@@ -687,6 +1345,8 @@ if __name__ == "__main__":
          (zp_loss - baseline_loss) / baseline_loss * 100, zp_err, zp_sample),
         ("INT4 absmax", 4, size_4, int4_loss,
          (int4_loss - baseline_loss) / baseline_loss * 100, int4_err, int4_sample),
+        ("INT4 group-8 calibrated", 6, compute_model_size(float_weights, 6), gq_loss,
+         (gq_loss - baseline_loss) / baseline_loss * 100, gq_err, gq_sample),
     ]
 
     for name, bits, size, loss_val, delta, err, sample in rows:
@@ -718,10 +1378,12 @@ if __name__ == "__main__":
     # INT2 (4 levels) typically destroys model quality entirely.
     #
     # Signpost: production quantization adds several sophistications this script omits:
-    # - GPTQ/AWQ use calibration data to minimize layer-wise output reconstruction error
-    # - Mixed precision keeps sensitive layers (first/last) in higher precision
-    # - Activation quantization (not just weights) for full integer inference
-    # - Group quantization: per-channel but with groups of 32-128 elements per scale
+    # - GPTQ reuses the calibration H above to also correct the not-yet-quantized
+    #   columns after each rounding step, not just to pick clip ratios
+    # - AWQ additionally rescales salient input channels before quantizing
+    # - HAWQ ranks layer sensitivity by Hessian trace instead of one-at-a-time ablation,
+    #   which scales to models with hundreds of matrices
+    # - Group sizes of 32-128 elements per scale (our rows are only 16-64 wide)
     # - SmoothQuant migrates quantization difficulty from activations to weights
 
     print(f"\nTotal runtime: {t_end - t_start:.1f}s")
@@ -42,6 +42,9 @@ N_STATE = 16               # state dimension
 N_EMBD = 8                 # embedding dimension (SISO input width)
 MIMO_RANKS = [1, 4, 8, 16]  # rank sweep for MIMO
 
+# Matmul engine: (n, k, m) shapes timed against the loop and generator matmuls
+ENGINE_SHAPES = [(64, 4, 64), (64, 64, 64), (256, 16, 256), (128, 128, 128)]
+
 # Sequence lengths for the SISO vs MIMO timing comparison
 SEQ_LENS = [1000, 4000, 16000]
 
@@ -285,6 +288,58 @@ def matmul(a: list[list[float]], b: list[list[float]]) -> list[list[float]]:
     return result
 
 
+# === MATMUL ENGINE ===
+# microflash.py and microattention.py used a generator matmul: pre-transpose B, then
+# sum(a[i][p] * bt[j][p] for p in range(k)) per output. Every scalar pays two
+# subscripts, a range step and a generator resume. The engine below (copied into both
+# scripts) keeps the pre-transposed B but zips two whole rows inside one list
+# comprehension, so there is no per-element indexing and no generator frame. On
+# CPython 3.11 that beats sum(map(float.__mul__, ...)), where the slot-wrapper call
+# costs more than the multiply, and math.fsum, which pays for exact rounding.
+#
+# Blocking the loops over i/j/k, as a BLAS kernel does, was measured and dropped:
+# in CPython it cannot cut cache misses (boxed floats sit behind pointers wherever the
+# tiles are), and splitting k only adds slices and shortens each dot product, so
+# throughput rose with tile size all the way to no tiling at all.
+
+
+def matmul_generator(a: list[list[float]], b: list[list[float]]) -> list[list[float]]:
+    """The generator matmul the engine replaced in microflash.py / microattention.py."""
+    k = len(a[0])
+    n = len(b[0])
+    bt = [[b[r][c] for r in range(k)] for c in range(n)]
+    return [[sum(a[i][p] * bt[j][p] for p in range(k)) for j in range(n)]
+            for i in range(len(a))]
+
+
+def matmul_bt(a: list[list[float]], bt: list[list[float]]) -> list[list[float]]:
+    """A[m,k] @ B[k,n] -> C[m,n], given B already transposed as bt[n,k].
+
+    Q @ K^T is exactly this shape, so attention scores need no transpose at all."""
+    return [[sum([x * y for x, y in zip(a_row, b_row)]) for b_row in bt] for a_row in a]
+
+
+def matmul_engine(a: list[list[float]], b: list[list[float]]) -> list[list[float]]:
+    """Drop-in replacement for matmul: transpose B once, then run the engine."""
+    return matmul_bt(a, [list(col) for col in zip(*b)])
+
+
+def run_engine_comparison() -> list[tuple[str, int, float, float, float]]:
+    """Time the loop matmul, the generator matmul and the engine on ENGINE_SHAPES.
+
+    Returns list of (shape label, flops, loop_time, generator_time, engine_time)."""
+    results = []
+    for n, k, m in ENGINE_SHAPES:
+        mat_a = [[random.random() for _ in range(k)] for _ in range(n)]
+        mat_b = [[random.random() for _ in range(m)] for _ in range(k)]
+        t_loop = measure_time(lambda: matmul(mat_a, mat_b), warmup=1, trials=3)
+        t_gen = measure_time(lambda: matmul_generator(mat_a, mat_b), warmup=1, trials=3)
+        t_engine = measure_time(lambda: matmul_engine(mat_a, mat_b), warmup=1, trials=3)
+        results.append((f"[{n}x{k}] @ [{k}x{m}]", count_flops_matmul(n, m, k),
+                        t_loop, t_gen, t_engine))
+    return results
+
+
 # === FOUR OPERATIONS ON THE ROOFLINE ===
 
 # We measure four operations that span the roofline from deep memory-bound
@@ -904,6 +959,30 @@ def main() -> None:
     print(f"  This is the SISO→MIMO transition: same state update, "
           f"higher arithmetic intensity")
 
+    # --- Phase 2b: Matmul engine vs the matmuls it replaces ---
+    print(f"\n{'=' * 70}")
+    print("  PHASE 2b: MATMUL ENGINE — LOOP VS. GENERATOR VS. ENGINE")
+    print(f"{'=' * 70}")
+    print("\n  Same FLOPs, same arithmetic intensity: only the loop structure changes.")
+    print("  Generator = the matmul the engine replaced in microflash/microattention.")
+
+    engine_results = run_engine_comparison()
+    ehdr = (f"{'Shape':<22} {'FLOPs':>10} {'Loop (ms)':>10} {'Gen (ms)':>9} "
+            f"{'Engine (ms)':>12} {'Engine MFLOP/s':>15} {'vs gen':>7} {'vs loop':>8}")
+    print(f"\n{ehdr}")
+    print("-" * len(ehdr))
+    for label, flops, t_loop, t_gen, t_engine in engine_results:
+        print(f"{label:<22} {flops:>10,} {t_loop*1000:>10.2f} {t_gen*1000:>9.2f} "
+              f"{t_engine*1000:>12.2f} {flops / t_engine / 1e6:>15.1f} "
+              f"{t_gen / t_engine:>6.2f}x {t_loop / t_engine:>7.2f}x")
+
+    # Signpost: in CPython the engine can only cut interpreter overhead, never cache
+    # misses. It beats the generator it replaced on every shape; against the plain
+    # loop it wins once k is long enough to amortize the fixed cost of each dot
+    # product (building the zip and the list), and can lose on skinny rank-4/16
+    # products where that fixed cost dominates. In a compiled kernel the i/j/k
+    # blocking dropped here keeps tiles in L1/L2 (or SRAM on GPU) and is worth 10x.
+
     # --- Phase 3: SSM State Update Comparison ---
     print(f"\n{'=' * 70}")
     print("  PHASE 3: SSM STATE UPDATE — SISO VS. MIMO")
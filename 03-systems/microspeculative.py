@@ -48,6 +48,14 @@ BLOCK_SIZE = 16  # context window — shared between both models
 # Speculative decoding parameters
 SPEC_K = 4  # number of draft tokens to propose per speculation round
 
+# Tree speculation: children per node at each depth of the draft tree. Wide near the
+# root, where the draft is most often right about the runner-up too; a single branch
+# deeper down. Depth equals SPEC_K so the tree and the chain look equally far ahead.
+TREE_BRANCHING = [3, 2, 1, 1]
+
+# Draft-free lookup: longest suffix (in tokens) matched against earlier text
+NGRAM_N = 3
+
 # Training
 LEARNING_RATE = 0.01
 BETA1 = 0.85
@@ -312,10 +320,8 @@ def forward_float(
         q = linear_f(x, wf[f'l{li}.wq'])
         k = linear_f(x, wf[f'l{li}.wk'])
         v = linear_f(x, wf[f'l{li}.wv'])
-        kv[li]['k'].append(k)
-        kv[li]['v'].append(v)
+        clen = kv_append(kv[li], k, v)
         head_cat: list[float] = []
-        clen = len(kv[li]['k'])
         hd = c['head_dim']
         for h in range(c['n_head']):
             hs = h * hd
@@ -338,19 +344,49 @@ def forward_float(
     return linear_f(x, wf['lm_head'])
 
 
-def make_kv(c: Cfg) -> list[dict[str, list[list[float]]]]:
+# KV caches carry a length cursor. Entries at or beyond 'len' are stale: a rollback
+# just moves the cursor back (O(1) per layer, whatever the sequence length), and the
+# next write overwrites the stale slot in place. A checkpoint is a saved length.
+
+def make_kv(c: Cfg) -> list[dict]:
     """Fresh empty KV cache for a model config."""
-    return [{'k': [], 'v': []} for _ in range(c['n_layer'])]
+    return [{'k': [], 'v': [], 'len': 0} for _ in range(c['n_layer'])]
+
+
+def kv_append(layer: dict, k: list[float], v: list[float]) -> int:
+    """Write K/V at the layer's cursor, reusing a stale slot if there is one.
+    Returns the new length."""
+    n = layer['len']
+    if n < len(layer['k']):
+        layer['k'][n] = k
+        layer['v'][n] = v
+    else:
+        layer['k'].append(k)
+        layer['v'].append(v)
+    layer['len'] = n + 1
+    return n + 1
+
+
+def kv_len(cache: list[dict]) -> int:
+    """Current cache length: the checkpoint to roll back to."""
+    return cache[0]['len']
+
+
+def kv_truncate(cache: list[dict], length: int) -> None:
+    """Roll the cache back to a checkpoint by moving the cursor -- no copying."""
+    for layer in cache:
+        layer['len'] = length
 
 
-def clone_kv(cache: list[dict[str, list[list[float]]]]) -> list[dict[str, list[list[float]]]]:
-    """Deep copy KV cache — essential so speculative rollbacks don't corrupt state.
+def clone_kv(cache: list[dict]) -> list[dict]:
+    """Deep copy of the live part of a KV cache.
 
-    During speculation, we tentatively advance the KV cache. If the verifier
-    rejects a draft token, we must roll back to the pre-speculation state.
-    Deep copying before speculation makes this rollback trivial.
+    This is how rollback used to work: copy before speculating, throw the copy
+    away on rejection. The copy costs O(seq_len) per round; kv_truncate replaces
+    it, and this is kept only to measure the difference.
     """
-    return [{'k': [r[:] for r in l['k']], 'v': [r[:] for r in l['v']]} for l in cache]
+    return [{'k': [r[:] for r in l['k'][:l['len']]], 'v': [r[:] for r in l['v'][:l['len']]],
+             'len': l['len']} for l in cache]
 
 
 def feed_prompt(
@@ -446,6 +482,75 @@ def train_model(
     print(f"  Final loss: {loss.data:.4f}\n")
 
 
+# === N-GRAM LOOKUP DRAFTING ===
+# A draft model is a second network to train, store and run. Prompt lookup decoding
+# (Saxena, 2023) and LLMA (Yang et al., 2023) drop it: if the last few tokens already
+# appeared earlier in the context, guess that what followed them then follows them
+# again. Proposals come from a table lookup, not a forward pass, so drafting is
+# essentially free and a rejected guess costs nothing but the verifier's work.
+#
+# The index maps every n-gram (n = 1..max_n) to counts of the tokens that followed
+# it. Appending a token updates the max_n n-grams that end just before it: O(max_n)
+# per token, so it is built incrementally as text is generated. Drafting walks
+# forward: take the longest suffix with a match, propose its most frequent
+# continuation, append that guess to the suffix, and repeat up to k times.
+#
+# The proposals are deterministic, i.e. the draft distribution is a point mass on the
+# proposed token. min(1, p_v/p_d) then accepts with probability p_v(x), and the
+# residual max(0, p_v - p_d) is p_v with x removed. The acceptance test is unchanged
+# and the output is still exactly the verifier's distribution.
+
+class NgramIndex:
+    """Incremental suffix index: n-gram -> {next token: count}."""
+
+    def __init__(self, max_n: int = NGRAM_N) -> None:
+        self.max_n = max_n
+        self.tokens: list[int] = []
+        self.table: dict[tuple[int, ...], dict[int, int]] = {}
+
+    def append(self, tok: int) -> None:
+        end = len(self.tokens)
+        for n in range(1, min(self.max_n, end) + 1):
+            nxt = self.table.setdefault(tuple(self.tokens[end - n:end]), {})
+            nxt[tok] = nxt.get(tok, 0) + 1
+        self.tokens.append(tok)
+
+    def extend(self, toks: list[int]) -> None:
+        for t in toks:
+            self.append(t)
+
+    def lookup(self, suffix: list[int]) -> tuple[int, dict[int, int]]:
+        """Longest indexed tail of suffix -> (match_len, next-token counts)."""
+        for n in range(min(self.max_n, len(suffix)), 0, -1):
+            nxt = self.table.get(tuple(suffix[-n:]))
+            if nxt is not None:
+                return n, nxt
+        return 0, {}
+
+
+def propose_ngram(
+    local: NgramIndex, corpus: NgramIndex | None, k: int, bos: int,
+) -> list[int]:
+    """Draft up to k tokens by lookup in the context's own index, or in an optional
+    static corpus index when that matches a longer suffix. Stops at BOS."""
+    ctx = local.tokens[-local.max_n:]
+    out: list[int] = []
+    for _ in range(k):
+        n, nxt = local.lookup(ctx)
+        if corpus is not None:
+            cn, cnxt = corpus.lookup(ctx)
+            if cn > n:
+                nxt = cnxt
+        if not nxt:
+            break
+        tok = max(nxt, key=nxt.get)
+        if tok == bos:
+            break
+        out.append(tok)
+        ctx = ctx[1:] + [tok] if len(ctx) >= local.max_n else ctx + [tok]
+    return out
+
+
 # === DECODING STRATEGIES ===
 
 
@@ -488,12 +593,13 @@ def decode_verifier_only(
 def decode_speculative(
     prompt: list[int],
     verifier_wf: dict[str, list[list[float]]],
-    draft_wf: dict[str, list[list[float]]],
+    draft_wf: dict[str, list[list[float]]] | None,
     vc: Cfg,
-    dc: Cfg,
+    dc: Cfg | None,
     max_len: int = 12,
     draft_k: int = SPEC_K,
     temperature: float = 0.8,
+    corpus_index: NgramIndex | None = None,
 ) -> tuple[list[int], float, int, int, int, int]:
     """Speculative decoding: draft proposes, verifier accepts or rejects.
 
@@ -518,15 +624,24 @@ def decode_speculative(
     This is Metropolis-Hastings style reasoning: the draft is the proposal
     distribution, and the acceptance ratio corrects for proposal bias.
 
+    With draft_wf=None, drafts come from n-gram lookup over the prompt and the
+    generated history (plus corpus_index, if given) instead of a draft model.
+
     Returns: (tokens, log_prob, verifier_fwd_passes, draft_fwd_passes,
               total_proposed, total_accepted)
     """
     v_kv, v_logits = feed_prompt(prompt, verifier_wf, vc)
-    d_kv, d_logits = feed_prompt(prompt, draft_wf, dc)
+    lookup: NgramIndex | None = None
+    if draft_wf is None:
+        lookup = NgramIndex()
+        lookup.extend(prompt)
+        d_fwd = 0
+    else:
+        d_kv, d_logits = feed_prompt(prompt, draft_wf, dc)
+        d_fwd = len(prompt)
     gen: list[int] = []
     lp = 0.0
     v_fwd = len(prompt)
-    d_fwd = len(prompt)
     total_proposed = 0
     total_accepted = 0  # only counts draft tokens that passed the acceptance criterion
 
@@ -540,28 +655,40 @@ def decode_speculative(
         # The draft runs autoregressively (cheap forward passes) to build
         # a speculative continuation. We save each step's probability distribution
         # because the verifier needs p_draft(x) for the acceptance criterion.
-        draft_toks: list[int] = []
-        draft_probs_list: list[list[float]] = []
-        tmp_d_kv = clone_kv(d_kv)
-        tmp_d_logits = d_logits[:]
-
-        for di in range(remaining):
-            pos = cur_pos + di
-            if pos >= BLOCK_SIZE:
-                break
-            dp = softmax_f([l / temperature for l in tmp_d_logits])
-            draft_probs_list.append(dp)
-            # Sample from the draft distribution (not greedy — we need stochastic
-            # proposals to align with the verifier's stochastic generation)
-            dtok = random.choices(range(dc['vocab_size']), weights=dp)[0]
-            if dtok == dc['bos']:
-                break
-            draft_toks.append(dtok)
-            tmp_d_logits = forward_float(dtok, pos, tmp_d_kv, draft_wf, dc)
-            d_fwd += 1
+        # In draft-free mode the n-gram index proposes instead, with point-mass p_draft.
+        if lookup is not None:
+            k = min(remaining, BLOCK_SIZE - cur_pos)
+            draft_toks = propose_ngram(lookup, corpus_index, k, vc['bos'])
+            draft_probs_list = [[1.0 if j == t else 0.0 for j in range(vc['vocab_size'])]
+                                for t in draft_toks]
+        else:
+            # The draft writes straight into its real cache; the checkpoint is just the
+            # current length, and rejected drafts are dropped by moving the cursor back.
+            draft_toks: list[int] = []
+            draft_probs_list: list[list[float]] = []
+            draft_logits_list: list[list[float]] = []  # draft logits after each draft token
+            d_checkpoint = kv_len(d_kv)
+            tmp_d_logits = d_logits
+
+            for di in range(remaining):
+                pos = cur_pos + di
+                if pos >= BLOCK_SIZE:
+                    break
+                dp = softmax_f([l / temperature for l in tmp_d_logits])
+                draft_probs_list.append(dp)
+                # Sample from the draft distribution (not greedy — we need stochastic
+                # proposals to align with the verifier's stochastic generation)
+                dtok = random.choices(range(dc['vocab_size']), weights=dp)[0]
+                if dtok == dc['bos']:
+                    break
+                draft_toks.append(dtok)
+                tmp_d_logits = forward_float(dtok, pos, d_kv, draft_wf, dc)
+                draft_logits_list.append(tmp_d_logits)
+                d_fwd += 1
 
         if not draft_toks:
-            # Draft immediately produced BOS — fall back to one verifier step
+            # Draft immediately produced BOS (or the lookup found no match) — fall
+            # back to one verifier step
             vp = softmax_f([l / temperature for l in v_logits])
             vtok = random.choices(range(vc['vocab_size']), weights=vp)[0]
             if vtok == vc['bos']:
@@ -569,9 +696,12 @@ def decode_speculative(
             lp += math.log(max(vp[vtok], 1e-10))
             gen.append(vtok)
             v_logits = forward_float(vtok, cur_pos, v_kv, verifier_wf, vc)
-            d_logits = forward_float(vtok, cur_pos, d_kv, draft_wf, dc)
             v_fwd += 1
-            d_fwd += 1
+            if lookup is not None:
+                lookup.append(vtok)
+            else:
+                d_logits = forward_float(vtok, cur_pos, d_kv, draft_wf, dc)
+                d_fwd += 1
             continue
 
         total_proposed += len(draft_toks)
@@ -579,11 +709,13 @@ def decode_speculative(
         # --- Phase 2: Verifier scores each draft token ---
         # On a GPU, this would be a single batched forward pass over all K
         # positions. In our scalar implementation we run sequentially, but the
-        # acceptance logic is identical to the parallel version.
+        # acceptance logic is identical to the parallel version. The verifier only
+        # ever runs on tokens it has accepted (or resampled), so its real cache is
+        # always valid and needs no rollback at all.
         accepted: list[int] = []
         draft_accepted_count = 0  # how many draft tokens passed acceptance
-        tmp_v_kv = clone_kv(v_kv)
-        tmp_v_logits = v_logits[:]
+        tmp_v_kv = v_kv
+        tmp_v_logits = v_logits
 
         for vi in range(len(draft_toks)):
             vp = softmax_f([l / temperature for l in tmp_v_logits])
@@ -625,7 +757,7 @@ def decode_speculative(
                     accepted.append(rtok)
                     lp += math.log(max(vp[rtok], 1e-10))
                     # Run verifier on the resampled token to update KV cache
-                    forward_float(rtok, cur_pos + vi, tmp_v_kv, verifier_wf, vc)
+                    tmp_v_logits = forward_float(rtok, cur_pos + vi, tmp_v_kv, verifier_wf, vc)
                     v_fwd += 1
                 # Discard all remaining draft tokens after rejection — they were
                 # conditioned on the rejected token and are no longer valid
@@ -640,18 +772,27 @@ def decode_speculative(
             if bonus_tok != vc['bos']:
                 accepted.append(bonus_tok)
                 lp += math.log(max(bonus_vp[bonus_tok], 1e-10))
-                forward_float(bonus_tok, cur_pos + len(draft_toks), tmp_v_kv, verifier_wf, vc)
+                tmp_v_logits = forward_float(
+                    bonus_tok, cur_pos + len(draft_toks), tmp_v_kv, verifier_wf, vc)
                 v_fwd += 1
 
         total_accepted += draft_accepted_count
 
-        # Commit accepted tokens to both real KV caches
-        for ai, atok in enumerate(accepted):
-            v_logits = forward_float(atok, cur_pos + ai, v_kv, verifier_wf, vc)
-            d_logits = forward_float(atok, cur_pos + ai, d_kv, draft_wf, dc)
-            v_fwd += 1
-            d_fwd += 1
-            gen.append(atok)
+        # Commit: the verifier cache is already exact. The draft cache keeps its
+        # entries for the accepted drafts (same tokens, same positions); roll back
+        # the rejected tail and run the draft on the resampled/bonus token, if any.
+        v_logits = tmp_v_logits
+        if lookup is not None:
+            lookup.extend(accepted)
+        else:
+            kv_truncate(d_kv, d_checkpoint + draft_accepted_count)
+            if draft_accepted_count > 0:
+                d_logits = draft_logits_list[draft_accepted_count - 1]
+            if len(accepted) > draft_accepted_count:
+                d_logits = forward_float(accepted[-1], cur_pos + draft_accepted_count,
+                                         d_kv, draft_wf, dc)
+                d_fwd += 1
+        gen.extend(accepted)
 
         # If nothing was accepted and no resampled token either, the while loop
         # would spin. This shouldn't happen because rejection always resamples,
@@ -664,13 +805,229 @@ def decode_speculative(
             lp += math.log(max(vp[vtok], 1e-10))
             gen.append(vtok)
             v_logits = forward_float(vtok, cur_pos, v_kv, verifier_wf, vc)
-            d_logits = forward_float(vtok, cur_pos, d_kv, draft_wf, dc)
             v_fwd += 1
-            d_fwd += 1
+            if lookup is not None:
+                lookup.append(vtok)
+            else:
+                d_logits = forward_float(vtok, cur_pos, d_kv, draft_wf, dc)
+                d_fwd += 1
 
     return gen, lp, v_fwd, d_fwd, total_proposed, total_accepted
 
 
+# === TREE SPECULATION ===
+# A linear chain wastes the whole round once one draft token is rejected, yet the
+# draft's second or third choice is often what the verifier wanted. Tree speculation
+# (SpecInfer, Miao et al., 2023; Medusa, Cai et al., 2024) keeps the top-k draft
+# tokens at each step as sibling branches, and the verifier scores every node of the
+# tree in ONE forward pass.
+#
+# Tree attention mask: the tree's nodes are laid out as one flat batch, and node i
+# may attend to the prefix cache plus the nodes on its own root path -- never to a
+# sibling branch. Each node's position is prefix length + its depth. Node i thus sees
+# exactly the sequence it would have seen in a sequential decode, so its logits are
+# identical to forward_float's (same products, same summation order).
+#
+#   root  a  b  c  ab  ba        a, b, c: top-3 draft tokens after the root
+#   root [x  .  .  .  .   . ]    ab: best draft token after a
+#   a    [x  x  .  .  .   . ]    ba: best draft token after b
+#   b    [x  .  x  .  .   . ]
+#   c    [x  .  .  x  .   . ]
+#   ab   [x  x  .  .  x   . ]
+#   ba   [x  .  x  .  .   x ]
+#
+# Lossless acceptance with deterministic (top-k) proposals: at each node, sample y
+# from the verifier's distribution there. If y is one of the node's children, accept
+# it and descend; otherwise y itself is the next token and the round ends. This is
+# the point-mass case of min(1, p/q) checked against each sibling in turn -- accept
+# sibling x with probability p(x), else remove x from p and renormalize -- and every
+# emitted token is a sample from the verifier, so the output distribution is exact.
+# A round's first node is the last emitted token (not yet in either cache), so the
+# verifier's single pass both extends its cache and scores the whole tree.
+
+def top_k(scores: list[float], k: int) -> list[int]:
+    """Indices of the k largest scores, best first (ties: lower index first), via a
+    hand-rolled size-k min-heap on (score, -index). Copied from microbeam.py: the
+    draft only needs its top few tokens per node, never a full vocabulary sort."""
+    heap: list[tuple[float, int]] = []
+    for i, sc in enumerate(scores):
+        item = (sc, -i)
+        if len(heap) < k:
+            heap.append(item)
+            j = len(heap) - 1
+            while j > 0 and heap[(j - 1) // 2] > heap[j]:  # sift up
+                parent = (j - 1) // 2
+                heap[parent], heap[j] = heap[j], heap[parent]
+                j = parent
+        elif item > heap[0]:
+            heap[0] = item
+            j = 0
+            while True:  # sift down
+                m, l, r = j, 2 * j + 1, 2 * j + 2
+                if l < len(heap) and heap[l] < heap[m]:
+                    m = l
+                if r < len(heap) and heap[r] < heap[m]:
+                    m = r
+                if m == j:
+                    break
+                heap[j], heap[m] = heap[m], heap[j]
+                j = m
+    return [-i for _, i in sorted(heap, reverse=True)]
+
+
+def tree_mask(parents: list[int]) -> list[list[bool]]:
+    """mask[i][j]: may tree node i attend to tree node j? Only if j is on i's root path."""
+    mask = [[False] * len(parents) for _ in parents]
+    for i in range(len(parents)):
+        j = i
+        while j != -1:
+            mask[i][j] = True
+            j = parents[j]
+    return mask
+
+
+def forward_tree(
+    toks: list[int], parents: list[int], start_pos: int,
+    kv: list[dict[str, list[list[float]]]],
+    tree_kv: list[dict[str, list[list[float]]]],
+    wf: dict[str, list[list[float]]],
+    c: Cfg,
+) -> list[list[float]]:
+    """One forward pass over every tree node not yet in tree_kv (nodes are added in
+    parent-before-child order). K/V of the tree go to tree_kv, not to the prefix
+    cache kv, since most branches will be thrown away. Returns logits per new node."""
+    mask = tree_mask(parents)
+    depth = [0] * len(toks)
+    for i in range(1, len(toks)):
+        depth[i] = depth[parents[i]] + 1
+    first = kv_len(tree_kv)
+    out: list[list[float]] = []
+    for i in range(first, len(toks)):
+        x = [wf['wte'][toks[i]][j] + wf['wpe'][start_pos + depth[i]][j]
+             for j in range(c['n_embd'])]
+        x = rmsnorm_f(x)
+        for li in range(c['n_layer']):
+            x_res = x[:]
+            x = rmsnorm_f(x)
+            q = linear_f(x, wf[f'l{li}.wq'])
+            kv_append(tree_kv[li], linear_f(x, wf[f'l{li}.wk']), linear_f(x, wf[f'l{li}.wv']))
+            visible = [j for j in range(i + 1) if mask[i][j]]
+            n = kv[li]['len']
+            keys = kv[li]['k'][:n] + [tree_kv[li]['k'][j] for j in visible]
+            vals = kv[li]['v'][:n] + [tree_kv[li]['v'][j] for j in visible]
+            head_cat: list[float] = []
+            hd = c['head_dim']
+            for h in range(c['n_head']):
+                hs = h * hd
+                q_h = q[hs:hs + hd]
+                scores = [sum(q_h[j] * key[hs + j] for j in range(hd)) / (hd ** 0.5)
+                          for key in keys]
+                w = softmax_f(scores)
+                for j in range(hd):
+                    head_cat.append(sum(w[t] * vals[t][hs + j] for t in range(len(vals))))
+            x = linear_f(head_cat, wf[f'l{li}.wo'])
+            x = [a + b for a, b in zip(x, x_res)]
+            x_res = x[:]
+            x = rmsnorm_f(x)
+            x = linear_f(x, wf[f'l{li}.fc1'])
+            x = [max(0.0, v) for v in x]
+            x = linear_f(x, wf[f'l{li}.fc2'])
+            x = [a + b for a, b in zip(x, x_res)]
+        out.append(linear_f(x, wf['lm_head']))
+    return out
+
+
+def decode_tree_speculative(
+    prompt: list[int],
+    verifier_wf: dict[str, list[list[float]]],
+    draft_wf: dict[str, list[list[float]]],
+    vc: Cfg,
+    dc: Cfg,
+    max_len: int = 12,
+    branching: list[int] = TREE_BRANCHING,
+    temperature: float = 0.8,
+) -> tuple[list[int], float, int, int, int]:
+    """Speculative decoding over a draft token tree, verified in one pass per round.
+
+    branching[d] is how many top draft tokens each node at depth d gets as children;
+    [1] * K is a linear chain of the draft's greedy picks.
+
+    Returns: (tokens, log_prob, verifier_passes, draft_passes, total_accepted)
+    """
+    v_kv, _ = feed_prompt(prompt[:-1], verifier_wf, vc)
+    d_kv, _ = feed_prompt(prompt[:-1], draft_wf, dc)
+    pending = prompt[-1]  # emitted but not yet in either cache: the next tree's root
+    gen: list[int] = []
+    lp = 0.0
+    v_passes = 0
+    d_passes = 0
+    total_accepted = 0
+
+    while len(gen) < max_len:
+        cur = len(prompt) - 1 + len(gen)  # position of the root
+        if cur >= BLOCK_SIZE:
+            break
+        depth_budget = min(len(branching), max_len - len(gen) - 1, BLOCK_SIZE - 1 - cur)
+
+        # --- Draft: grow the tree one level per draft pass ---
+        toks = [pending]
+        parents = [-1]
+        frontier = [0]
+        d_tree = make_kv(dc)
+        for depth in range(depth_budget):
+            level_logits = forward_tree(toks, parents, cur, d_kv, d_tree, draft_wf, dc)
+            d_passes += 1
+            next_frontier: list[int] = []
+            for node, logits in zip(frontier, level_logits):
+                dp = softmax_f([l / temperature for l in logits])
+                # One extra candidate covers BOS, which never becomes a branch
+                best = top_k(dp, branching[depth] + 1)
+                for tok in [t for t in best if t != dc['bos']][:branching[depth]]:
+                    toks.append(tok)
+                    parents.append(node)
+                    next_frontier.append(len(toks) - 1)
+            frontier = next_frontier
+
+        # --- Verify: every node scored in one pass under the tree mask ---
+        v_tree = make_kv(vc)
+        v_logits = forward_tree(toks, parents, cur, v_kv, v_tree, verifier_wf, vc)
+        v_passes += 1
+
+        # --- Walk: descend while the verifier's own sample is a drafted child ---
+        path = [0]
+        while True:
+            vp = softmax_f([l / temperature for l in v_logits[path[-1]]])
+            y = random.choices(range(vc['vocab_size']), weights=vp)[0]
+            child = next((i for i in range(len(toks))
+                          if parents[i] == path[-1] and toks[i] == y), None)
+            if y != vc['bos']:
+                lp += math.log(max(vp[y], 1e-10))
+            if child is None:
+                break
+            path.append(child)
+            gen.append(y)
+            total_accepted += 1
+
+        # Commit the accepted path's K/V from the tree -- no recomputation. The
+        # draft never ran the deepest level, so finish its cache if the path got there.
+        for d, node in enumerate(path):
+            for li in range(vc['n_layer']):
+                kv_append(v_kv[li], v_tree[li]['k'][node], v_tree[li]['v'][node])
+            if node < kv_len(d_tree):
+                for li in range(dc['n_layer']):
+                    kv_append(d_kv[li], d_tree[li]['k'][node], d_tree[li]['v'][node])
+            else:
+                forward_float(toks[node], cur + d, d_kv, draft_wf, dc)
+                d_passes += 1
+
+        if y == vc['bos']:
+            break
+        gen.append(y)
+        pending = y
+
+    return gen, lp, v_passes, d_passes, total_accepted
+
+
 # === MAIN ===
 
 if __name__ == "__main__":
@@ -800,10 +1157,36 @@ if __name__ == "__main__":
     n_rounds = spec_proposed_total / SPEC_K if spec_proposed_total > 0 else 1
     toks_per_round = spec_accepted_total / max(n_rounds, 1)
     print(f"{'Avg draft tokens accepted per round':<40} {'1.0':>15} {toks_per_round:>15.1f}")
+    print(f"{'Wall-clock speedup':<40} {'1.00x':>15} {verifier_time / spec_time:>14.2f}x")
     # Note: each round also produces 1 extra token (bonus or resampled), so the
     # effective tokens-per-round is ~(accepted + 1). The acceptance rate measures
     # only draft-proposed tokens that passed the min(1, p_v/p_d) criterion.
 
+    # === ROLLBACK COST: CLONE VS CURSOR ===
+    # Copy-before-speculate pays O(seq_len) every round, accepted or not; moving the
+    # length cursor is O(n_layer). The gap grows with context, which is where
+    # speculation is supposed to pay off.
+    print("\n=== Rollback Cost: clone_kv vs Length Cursor (verifier cache) ===\n")
+    print(f"{'Cache length':<14} {'clone_kv (us)':>14} {'kv_truncate (us)':>17} {'Ratio':>8}")
+    print("-" * 56)
+    for cache_len in [16, 64, 256, 1024]:
+        bench_kv = make_kv(vc)
+        for _ in range(cache_len):
+            for layer in bench_kv:
+                kv_append(layer, [random.gauss(0, 1) for _ in range(vc['n_embd'])],
+                          [random.gauss(0, 1) for _ in range(vc['n_embd'])])
+        reps = 200
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            clone_kv(bench_kv)
+        clone_us = (time.perf_counter() - t0) / reps * 1e6
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            kv_truncate(bench_kv, cache_len - SPEC_K)
+            kv_truncate(bench_kv, cache_len)
+        trunc_us = (time.perf_counter() - t0) / reps * 1e6
+        print(f"{cache_len:<14} {clone_us:>14.2f} {trunc_us:>17.2f} {clone_us / trunc_us:>7.0f}x")
+
     # === PER-STEP ACCEPTANCE RATE ANALYSIS ===
     # Acceptance rate typically decreases with position in the speculation window.
     # Token 1 is most likely to match because it's conditioned on the same prefix.
@@ -833,7 +1216,8 @@ if __name__ == "__main__":
             # Draft phase
             d_toks: list[int] = []
             d_probs: list[list[float]] = []
-            td_kv = clone_kv(d_kv_tmp)
+            d_ckpt = kv_len(d_kv_tmp)
+            td_kv = d_kv_tmp
             td_logits = d_logits_tmp[:]
             for di in range(rem):
                 pos = cur + di
@@ -851,7 +1235,8 @@ if __name__ == "__main__":
                 break
 
             # Verify phase — track per-position accept/reject
-            tv_kv = clone_kv(v_kv_tmp)
+            v_ckpt = kv_len(v_kv_tmp)
+            tv_kv = v_kv_tmp
             tv_logits = v_logits_tmp[:]
             accepted_here: list[int] = []
 
@@ -879,7 +1264,9 @@ if __name__ == "__main__":
                         accepted_here.append(rtok)
                     break
 
-            # Commit to real caches
+            # Roll back to the checkpoints, then commit to the real caches
+            kv_truncate(d_kv_tmp, d_ckpt)
+            kv_truncate(v_kv_tmp, v_ckpt)
             for ai, atok in enumerate(accepted_here):
                 v_logits_tmp = forward_float(atok, cur + ai, v_kv_tmp, vwf, vc)
                 d_logits_tmp = forward_float(atok, cur + ai, d_kv_tmp, dwf, dc)
@@ -946,4 +1333,90 @@ if __name__ == "__main__":
     # but amortize the verification cost over more attempts. The sweet spot depends
     # on draft-verifier alignment and the relative cost of draft vs verifier passes.
 
+    # === TREE VS LINEAR CHAIN ===
+    # Same draft, same depth, same one-pass verification: the chain keeps only the
+    # draft's top token at each step, the tree also keeps its runners-up.
+    print("\n=== Tree Speculation vs Linear Chain ===")
+    # The tree pass must reproduce sequential decoding exactly, node by node
+    probe = [BOS, unique_chars.index('a')]
+    tree_kv = make_kv(vc)
+    tree_logits = forward_tree([probe[-1], 0, 1, 0], [-1, 0, 0, 2], 1,
+                               feed_prompt(probe[:-1], vwf, vc)[0], tree_kv, vwf, vc)
+    seq_kv, _ = feed_prompt(probe[:-1], vwf, vc)
+    path_logits = [forward_float(t, 1 + d, seq_kv, vwf, vc)
+                   for d, t in enumerate([probe[-1], 1, 0])]
+    assert tree_logits[0] == path_logits[0] and tree_logits[2] == path_logits[1]
+    assert tree_logits[3] == path_logits[2]
+    print("Tree-masked pass == sequential forward_float on every root path: yes\n")
+
+    shapes = [("chain", [1] * SPEC_K), ("tree", TREE_BRANCHING), ("wide tree", [4, 3, 2, 1])]
+    print(f"{'Shape':<12} {'Branching':<14} {'Nodes':>6} {'Tok/pass':>9} "
+          f"{'Accepted/pass':>14} {'Verifier':>9} {'Draft':>6} {'Time (s)':>9}")
+    print("-" * 86)
+    for name, branching in shapes:
+        nodes = 1
+        width = 1
+        for b in branching:
+            width *= b
+            nodes += width
+        t0 = time.time()
+        n_tok = n_v = n_d = n_acc = 0
+        for i in range(n_samples):
+            pt = [BOS, unique_chars.index(seeds[i])]
+            toks, _, vp_, dp_, acc = decode_tree_speculative(
+                pt, vwf, dwf, vc, dc, max_len=12, branching=branching)
+            n_tok += len(toks)
+            n_v += vp_
+            n_d += dp_
+            n_acc += acc
+        print(f"{name:<12} {str(branching):<14} {nodes:>6} {n_tok / n_v:>9.2f} "
+              f"{n_acc / n_v:>14.2f} {n_v:>9} {n_d:>6} {time.time() - t0:>9.3f}")
+    print(f"\nVerifier-only decoding emits 1.00 token per verifier pass. Tok/pass counts")
+    print(f"accepted drafts plus the verifier's own sample that ends each round. The")
+    print(f"tree verifies more nodes per pass -- free on a GPU until the batch is compute-")
+    print(f"bound -- and converts them into more accepted tokens per pass.")
+
+    # === DRAFT-FREE N-GRAM LOOKUP ===
+    # Same acceptance test, same verifier; only the proposer changes. "context" looks
+    # up the prompt and generated history only. A one-letter prompt gives it little
+    # to match, which is the honest worst case for short names. "+corpus" adds a
+    # static index over the training names: retrieval drafting, no network at all.
+    print("\n=== Draft-Free N-gram Lookup vs Draft Model ===")
+    corpus_index = NgramIndex()
+    for doc in docs:
+        corpus_index.extend([BOS] + [unique_chars.index(ch) for ch in doc])
+    corpus_index.append(BOS)
+    print(f"Corpus index: {len(corpus_index.table):,} distinct n-grams (n <= {NGRAM_N}) "
+          f"over {len(corpus_index.tokens):,} tokens\n")
+    modes = [
+        ("draft model", dwf, dc, None),
+        ("n-gram (context)", None, None, None),
+        ("n-gram (+corpus)", None, None, corpus_index),
+    ]
+    print(f"{'Drafter':<18} {'Acc. Rate':>10} {'Accepted':>10} {'Verifier':>9} "
+          f"{'Draft fwd':>10} {'Time (s)':>9} {'vs Verifier':>12} {'vs Draft':>9}")
+    print("-" * 93)
+    draft_time = 0.0
+    for name, d_wf, d_c, index in modes:
+        m_prop = m_acc = m_v = m_d = 0
+        random.setstate(rng_state)
+        t0 = time.time()
+        for i in range(n_samples):
+            pt = [BOS, unique_chars.index(seeds[i])]
+            _, _, v_f, d_f, prop, acc = decode_speculative(
+                pt, vwf, d_wf, vc, d_c, max_len=12, draft_k=SPEC_K, corpus_index=index)
+            m_prop += prop
+            m_acc += acc
+            m_v += v_f
+            m_d += d_f
+        m_time = time.time() - t0
+        if d_wf is not None:
+            draft_time = m_time
+        print(f"{name:<18} {100.0 * m_acc / max(m_prop, 1):>9.1f}% "
+              f"{m_acc:>10} {m_v:>9} {m_d:>10} {m_time:>9.3f} "
+              f"{verifier_time / m_time:>11.2f}x {draft_time / m_time:>8.2f}x")
+    print(f"\nLookup proposals are point masses, so each is accepted with probability")
+    print(f"p_verifier(x). A draft model's sampled proposals can do better on acceptance,")
+    print(f"but lookup costs no forward passes, so its rounds are far cheaper.")
+
     print("\nDone.")
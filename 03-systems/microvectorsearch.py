@@ -22,7 +22,9 @@ underpins every retrieval-augmented generation system.
 from __future__ import annotations
 
 import math
+import os
 import random
+import struct
 import time
 from collections import defaultdict
 
@@ -51,6 +53,9 @@ NUM_HASH_BITS = 5         # k: bits per hash (precision per table, each bit is o
 NUM_CLUSTERS = 20         # semantic clusters (simulating word embedding neighborhoods)
 CLUSTER_SPREAD = 0.3      # controls intra-cluster variance
 
+# On-disk index file written by the persistence demo (deleted after the run)
+INDEX_FILE = "vector_index.bin"
+
 
 # === DATA GENERATION ===
 # Synthetic word embeddings: clustered random vectors that mimic the structure of real
@@ -242,6 +247,7 @@ class LSHIndex:
         dim: int,
         num_tables: int,
         num_hash_bits: int,
+        hyperplanes: list[list[list[float]]] | None = None,
     ) -> None:
         self.dim = dim
         self.num_tables = num_tables
@@ -250,10 +256,14 @@ class LSHIndex:
         # Each table has its own set of random hyperplanes — independence is critical.
         # Shared hyperplanes would make tables correlated, defeating the purpose of
         # multiple tables (which is to get independent chances at finding neighbors).
-        self.hyperplanes: list[list[list[float]]] = [
-            generate_random_hyperplanes(num_hash_bits, dim)
-            for _ in range(num_tables)
-        ]
+        # A loaded index passes its saved hyperplanes instead: queries must hash with
+        # exactly the planes the buckets were built with, or every lookup misses.
+        if hyperplanes is None:
+            hyperplanes = [
+                generate_random_hyperplanes(num_hash_bits, dim)
+                for _ in range(num_tables)
+            ]
+        self.hyperplanes: list[list[list[float]]] = hyperplanes
 
         # hash_tables[t][bucket_hash] = list of (index, vector) pairs
         self.hash_tables: list[dict[int, list[tuple[int, list[float]]]]] = [
@@ -327,6 +337,134 @@ class LSHIndex:
         }
 
 
+# === PERSISTENT INDEX FORMAT ===
+# An in-memory index dies with the process, and LSHIndex.build costs O(n*L*k*d) on
+# every start. Production vector stores (FAISS, Qdrant, LanceDB) instead write the
+# index to disk once and memory-map it at startup: the OS pages vectors in lazily as
+# queries touch them, so cold start is dominated by page faults, not by rebuilding.
+#
+# File layout (little-endian, every section 4-byte aligned):
+#
+#   header       magic "NMVI" | version | num_vectors n | dim d        (4 x uint32)
+#   vectors      n * d float32, row-major — vector i lives at [i*d, (i+1)*d)
+#   lsh header   num_tables L | num_hash_bits k   (L = 0 means a flat index)
+#   hyperplanes  L * k * d float64
+#   tables       per table: num_buckets, then per bucket: hash | count | indices...
+#
+# Vectors are float32 because they dominate the file (n*d entries) and cosine ranking
+# doesn't need more than ~7 significant digits. Hyperplanes are tiny (L*k*d) and stay
+# float64 so a loaded index hashes queries bit-for-bit like the index that was saved.
+# Buckets store only vector indices — the vectors themselves are stored exactly once.
+
+INDEX_MAGIC = b"NMVI"
+INDEX_VERSION = 1
+
+
+def save_index(
+    path: str,
+    vectors: list[list[float]],
+    lsh: LSHIndex | None = None,
+) -> int:
+    """Write vectors (and optionally an LSH index over them) to `path`.
+
+    Returns the number of bytes written. Passing lsh=None saves a flat index: just
+    the vector matrix, searched by brute force after loading."""
+    dim = len(vectors[0]) if vectors else 0
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sIII", INDEX_MAGIC, INDEX_VERSION, len(vectors), dim))
+        row_format = f"<{dim}f"
+        for vec in vectors:
+            f.write(struct.pack(row_format, *vec))
+
+        if lsh is None:
+            f.write(struct.pack("<II", 0, 0))
+            return f.tell()
+
+        f.write(struct.pack("<II", lsh.num_tables, lsh.num_hash_bits))
+        plane_format = f"<{dim}d"
+        for table_planes in lsh.hyperplanes:
+            for plane in table_planes:
+                f.write(struct.pack(plane_format, *plane))
+        for table in lsh.hash_tables:
+            f.write(struct.pack("<I", len(table)))
+            for bucket, entries in table.items():
+                f.write(struct.pack("<II", bucket, len(entries)))
+                f.write(struct.pack(f"<{len(entries)}I", *(idx for idx, _ in entries)))
+        return f.tell()
+
+
+class MappedVectors:
+    """A read-only n x d float32 matrix viewed directly over the index file's bytes.
+
+    Behaves like list[list[float]] for the search functions above (len, indexing,
+    iteration), but row i is a memoryview slice into the shared buffer — no per-row
+    list is ever built, so scoring a loaded vector copies nothing."""
+
+    def __init__(self, buffer: memoryview, num_vectors: int, dim: int) -> None:
+        # memoryview.cast reinterprets the raw bytes as C floats in native byte order.
+        # The file is little-endian, which matches every x86 and ARM host; a big-endian
+        # machine would need struct.unpack_from per row instead.
+        self.values = buffer.cast("f")
+        self.num_vectors = num_vectors
+        self.dim = dim
+
+    def __len__(self) -> int:
+        return self.num_vectors
+
+    def __getitem__(self, idx: int) -> memoryview:
+        if not 0 <= idx < self.num_vectors:
+            raise IndexError(idx)
+        start = idx * self.dim
+        return self.values[start:start + self.dim]
+
+
+def load_index(path: str) -> tuple[MappedVectors, LSHIndex | None]:
+    """Load an index written by save_index without rebuilding anything.
+
+    Vectors come back as a zero-copy MappedVectors view; if the file holds an LSH
+    index, its hyperplanes and bucket tables are restored as saved (no hashing)."""
+    # Signpost: production stores call mmap.mmap(f.fileno(), 0, access=ACCESS_READ)
+    # here so the kernel faults pages in on demand. mmap is outside this repo's
+    # allowed-module list, so we read the file in one call instead — everything
+    # below works unchanged on an mmap object, since memoryview accepts either.
+    with open(path, "rb") as f:
+        data = memoryview(f.read())
+
+    magic, version, num_vectors, dim = struct.unpack_from("<4sIII", data, 0)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        raise ValueError(f"{path} is not a version-{INDEX_VERSION} vector index file")
+    offset = 16
+    vector_bytes = num_vectors * dim * 4
+    vectors = MappedVectors(data[offset:offset + vector_bytes], num_vectors, dim)
+    offset += vector_bytes
+
+    num_tables, num_hash_bits = struct.unpack_from("<II", data, offset)
+    offset += 8
+    if num_tables == 0:
+        return vectors, None
+
+    plane_format = f"<{dim}d"
+    hyperplanes: list[list[list[float]]] = []
+    for _ in range(num_tables):
+        table_planes = []
+        for _ in range(num_hash_bits):
+            table_planes.append(list(struct.unpack_from(plane_format, data, offset)))
+            offset += dim * 8
+        hyperplanes.append(table_planes)
+
+    lsh = LSHIndex(dim, num_tables, num_hash_bits, hyperplanes=hyperplanes)
+    for table in lsh.hash_tables:
+        (num_buckets,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        for _ in range(num_buckets):
+            bucket, count = struct.unpack_from("<II", data, offset)
+            offset += 8
+            indices = struct.unpack_from(f"<{count}I", data, offset)
+            offset += count * 4
+            table[bucket] = [(idx, vectors[idx]) for idx in indices]
+    return vectors, lsh
+
+
 # === EVALUATION METRICS ===
 
 def recall_at_k(
@@ -515,6 +653,38 @@ def main() -> None:
         spd = avg_brute_ms / avg_t if avg_t > 0 else float("inf")
         print(f"{tables:<12} {avg_c:<18.0f} {avg_r:<15.3f} {spd:<10.2f}x")
 
+    # --- Persistence: save once, load instead of rebuilding ---
+    print("\n" + "=" * 70)
+    print("PERSISTENT INDEX: save to disk, load without rebuilding")
+    print("=" * 70)
+
+    t0 = time.time()
+    file_bytes = save_index(INDEX_FILE, database, lsh)
+    save_time = time.time() - t0
+
+    t0 = time.time()
+    loaded_vectors, loaded_lsh = load_index(INDEX_FILE)
+    load_time = time.time() - t0
+    assert loaded_lsh is not None
+
+    # Loaded results should match the in-memory index. Only float32 rounding of the
+    # stored vectors can reorder near-tied neighbors, so we count identical top-k sets.
+    matching = 0
+    for query in sample_queries:
+        original = {idx for idx, _ in lsh.query(query, database, TOP_K)}
+        reloaded = {idx for idx, _ in loaded_lsh.query(query, loaded_vectors, TOP_K)}
+        matching += original == reloaded
+
+    print(f"\nIndex file: {file_bytes / 1024:.0f} KB "
+          f"({NUM_VECTORS * VECTOR_DIM * 4 / 1024:.0f} KB of float32 vectors)")
+    print(f"{'Build from scratch (s)':<35} {build_time:>10.3f}")
+    print(f"{'Save to disk (s)':<35} {save_time:>10.3f}")
+    print(f"{'Load from disk (s)':<35} {load_time:>10.3f}")
+    print(f"{'Cold-start speedup':<35} {build_time / max(load_time, 1e-9):>9.1f}x")
+    print(f"Queries with identical top-{TOP_K} after reload: "
+          f"{matching}/{len(sample_queries)}")
+    os.remove(INDEX_FILE)
+
     # --- Distance metric comparison ---
     # Show that cosine similarity and euclidean distance can disagree when vectors
     # have different magnitudes, but agree on normalized vectors.